@@ -0,0 +1,184 @@
+from math import cos, sin, radians
+
+
+# Sparse table answering range-maximum queries over level terrain in O(1)
+class TerrainIndex:
+    def __init__(self, terrain):
+        # table[k][i] holds the max height over terrain[i : i + 2**k]
+        self.table = [list(terrain)]
+        span = 1
+        while 2 * span <= len(terrain):
+            prev = self.table[-1]
+            self.table.append(
+                [max(prev[i], prev[i + span]) for i in range(len(prev) - span)]
+            )
+            span *= 2
+
+    # Highest terrain between left and right columns (inclusive)
+    def query(self, left, right):
+        k = (right - left + 1).bit_length() - 1
+        row = self.table[k]
+        return max(row[left], row[right - (1 << k) + 1])
+
+
+# Cosine and sine of the rocket angle, shared by all boundary calculations
+def calc_rotation(player):
+    return cos(radians(player.get_angle())), sin(radians(player.get_angle()))
+
+
+# Pixel bounds of the rotated outer boundary of the rocket. The boundary is an
+# oriented rectangle, so its extremes lie on the corners, evaluated with the
+# same arithmetic as Rocket.calc_rotated_boundary
+def calc_rotated_bounds(player, rotation):
+    cos_a, sin_a = rotation
+    pos_x, pos_y = player.get_pos()
+    half_width = int(player.get_width() * 0.5)
+    half_height = int(player.get_height() * 0.5)
+
+    xs = []
+    ys = []
+    for corner_x, corner_y in (
+        (-half_width, -half_height),
+        (-half_width, half_height),
+        (half_width, -half_height),
+        (half_width, half_height),
+    ):
+        xs.append(int(corner_x * cos_a + corner_y * sin_a + pos_x))
+        ys.append(int(-corner_x * sin_a + corner_y * cos_a + pos_y))
+
+    return min(xs), max(xs), min(ys), max(ys)
+
+
+# Rocket boundary fully outside the playable area
+def bounds_escaped(level, bounds):
+    min_x, max_x, min_y, max_y = bounds
+
+    level_width = level.get_width()
+    level_height = level.get_height()
+
+    return max_x < 0 or min_x > level_width or max_y < 0 or min_y > level_height
+
+
+# Rocket boundary below terrain at any boundary point within the level
+def bounds_collision(level, player, rotation, bounds):
+    level_width = level.get_width()
+    level_height = level.get_height()
+
+    # Broad phase: skip if no boundary point lies above the level horizontally,
+    # or if the lowest boundary point is above the highest terrain beneath it
+    min_x, max_x, _, max_y = bounds
+    if max_x < 0 or min_x >= level_width:
+        return False
+    highest = level.get_terrain_index().query(
+        max(min_x, 0), min(max_x, level_width - 1)
+    )
+    if highest < level_height - max_y:
+        return False
+
+    # Narrow phase: exact test of the rotated boundary points near the ground
+    terrain = level.get_terrain()
+    cos_a, sin_a = rotation
+    pos_x, pos_y = player.get_pos()
+    min_point_y = level_height - highest
+    for point in player.points:
+        y = int(-point[0] * sin_a + point[1] * cos_a + pos_y)
+        if y < min_point_y:
+            continue
+        x = int(point[0] * cos_a + point[1] * sin_a + pos_x)
+        if 0 <= x < level_width and terrain[x] >= (level_height - y):
+            return True
+
+    return False
+
+
+def escaped_boundary(level, player):
+    rotation = calc_rotation(player)
+    return bounds_escaped(level, calc_rotated_bounds(player, rotation))
+
+
+def calc_collision(level, player):
+    rotation = calc_rotation(player)
+    bounds = calc_rotated_bounds(player, rotation)
+    return bounds_collision(level, player, rotation, bounds)
+
+
+# Reference tests over every rotated boundary point, as the game ran them before
+# the analytic bounds and terrain index
+def escaped_boundary_points(level, player):
+    rot_points = player.calc_rotated_boundary()
+    xs = [point[0] for point in rot_points]
+    ys = [point[1] for point in rot_points]
+    level_width = level.get_width()
+    level_height = level.get_height()
+    return (
+        max(xs) < 0 or min(xs) > level_width or max(ys) < 0 or min(ys) > level_height
+    )
+
+
+def calc_collision_points(level, player):
+    terrain = level.get_terrain()
+    level_width = level.get_width()
+    level_height = level.get_height()
+    for x, y in player.calc_rotated_boundary():
+        if 0 <= x < level_width and terrain[x] >= (level_height - y):
+            return True
+    return False
+
+
+# Compare escaped_boundary and calc_collision against the per-point reference
+# tests on a corpus of states recorded from random flights over several levels,
+# flown on through the terrain so collisions are well represented, and time both
+def check_collision(num_levels=8, flights=25, max_frames=400, seed=0):
+    import random
+    import time
+    from game import constants as cfg
+    from game.level import Level
+    from game.rocket import Rocket
+
+    rng = random.Random(seed)
+    corpus = []
+    for level_seed in range(num_levels):
+        level = Level(None, seed=level_seed)
+        for _ in range(flights):
+            player = Rocket(level.get_rocket_start_loc())
+            player.set_x_pos(rng.uniform(0, level.get_width()))
+            player.set_velocity(rng.uniform(-60, 60), rng.uniform(-60, 20))
+            player.set_angle(rng.uniform(0, 360))
+            player.set_omega(rng.uniform(-90, 90))
+            for frame in range(max_frames):
+                if frame % 6 == 0:
+                    player.apply_ai_action(rng.randrange(6))
+                player.update_state(1 / cfg.FPS)
+                corpus.append((level, list(player.get_pos()), player.get_angle()))
+                if escaped_boundary_points(level, player):
+                    break
+
+    player = Rocket([0.0, 0.0])
+    results = {}
+    for name, escaped, collided in (
+        ("per-point", escaped_boundary_points, calc_collision_points),
+        ("analytic", escaped_boundary, calc_collision),
+    ):
+        outcomes = []
+        start = time.perf_counter()
+        for level, pos, angle in corpus:
+            player.pos = pos
+            player.set_angle(angle)
+            outcomes.append((escaped(level, player), collided(level, player)))
+        results[name] = (outcomes, time.perf_counter() - start)
+
+    reference, reference_seconds = results["per-point"]
+    outcomes, analytic_seconds = results["analytic"]
+    mismatches = sum(a != b for a, b in zip(reference, outcomes))
+    assert mismatches == 0, f"{mismatches} of {len(corpus)} states differ"
+    print(
+        f"collision: parity ok over {len(corpus)} states "
+        f"({sum(c for _, c in reference)} collisions, "
+        f"{sum(e for e, _ in reference)} escapes), per-point "
+        f"{1e6 * reference_seconds / len(corpus):.2f} us, analytic "
+        f"{1e6 * analytic_seconds / len(corpus):.2f} us"
+    )
+
+
+if __name__ == "__main__":
+    check_collision()
@@ -1,10 +1,12 @@
 import pygame
 import os
 from game import constants as cfg
+from game import collision
 from game.flags import GameFlags
 from game.flags import LandingFlags
 from game.level import Level
 from game.rocket import Rocket
+from game.termination import calc_landing_flags
 
 
 class Game:
@@ -291,46 +293,8 @@ class Game:
             self.mode_index = 0
 
     def calc_landing(self, level: Level, player: Rocket):
-        pad_loc, _, left_pad, right_pad = level.get_pad_data()
-        level_height = level.get_height()
-
-        player_pos = player.get_pos()
-        player_angle = player.get_angle()
-        player_velocity = player.get_velocity()
-        player_horz_dim = player.get_height()
-        player_vert_dim = player.get_width()
-
-        # horizontal velocity less than threshold
-        self.landing_flags.horz_velocity = (
-            abs(player_velocity[0]) < cfg.LANDING_VELOCITY
-        )
-        # vertical velocity less than threshold
-        self.landing_flags.vert_velocity = (
-            abs(player_velocity[1]) < cfg.LANDING_VELOCITY
-        )
-        # landing angle within tolerance
-        self.landing_flags.angle = (
-            cfg.LANDING_MIN_ANGLE < player_angle < cfg.LANDING_MAX_ANGLE
-        )
-        # entirety of rocket on pad horizontally
-        self.landing_flags.horz_position = left_pad < (
-            player_pos[0] - player_horz_dim / 2
-        ) and right_pad > (player_pos[0] + player_horz_dim / 2)
-        # rocket is touching pad vertically within tolerance
-        self.landing_flags.vert_position = (
-            abs(level_height - player_pos[1] - (player_vert_dim / 2) - pad_loc[1])
-            < cfg.LANDING_HEIGHT
-        )
-
-        if (
-            self.landing_flags.horz_velocity
-            and self.landing_flags.vert_velocity
-            and self.landing_flags.angle
-            and self.landing_flags.horz_position
-            and self.landing_flags.vert_position
-        ):
-            return True
-        return False
+        self.landing_flags = calc_landing_flags(level, player)
+        return all(self.landing_flags.get_flags())
 
     def calc_horizontal_with_pad(self, level: Level, player: Rocket):
         _, _, left_pad, right_pad = level.get_pad_data()
@@ -348,40 +312,10 @@ class Game:
         return False
 
     def escaped_boundary(self, level: Level, player: Rocket):
-        rot_points = player.calc_rotated_boundary()
-
-        x_values = [point[0] for point in rot_points]
-        min_x = min(x_values)
-        max_x = max(x_values)
-        y_values = [point[1] for point in rot_points]
-        min_y = min(y_values)
-        max_y = max(y_values)
-
-        level_width = level.get_width()
-        level_height = level.get_height()
-
-        # If boundary of rocket fully outside playable area, boundary escaped
-        if max_x < 0 or min_x > level_width or max_y < 0 or min_y > level_height:
-            return True
-        return False
+        return collision.escaped_boundary(level, player)
 
     def calc_collision(self, level: Level, player: Rocket):
-        rot_points = player.calc_rotated_boundary()
-        terrain = level.get_terrain()
-
-        level_height = level.get_height()
-        level_width = level.get_width()
-
-        for point in rot_points:
-            # If boundary of rocket is below terrain at given x location, collision occured
-            if (
-                point[0] >= 0
-                and point[0] < level_width
-                and terrain[point[0]] >= (level_height - point[1])
-            ):
-                return True
-
-        return False
+        return collision.calc_collision(level, player)
 
     def set_landing_flags(self):
         self.flags.landing_drawn = False
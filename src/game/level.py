@@ -1,5 +1,6 @@
 import random
 from game import constants as cfg
+from game.collision import TerrainIndex
 
 
 class Level:
@@ -23,6 +24,13 @@ class Level:
         # Generate terrain
         self.terrain = self.init_terrain()
 
+        # Range-maximum index over terrain, built on first use
+        self.terrain_index = None
+
+        # Highest terrain under the state terrain window at each x, built on
+        # first use
+        self.terrain_peaks = None
+
         # Set sky image
         if images == None:
             self.images = None
@@ -143,6 +151,37 @@ class Level:
     def get_terrain(self):
         return self.terrain
 
+    # Make terrain and pad location read-only so a level can be shared between episodes
+    def freeze(self):
+        self.terrain = tuple(self.terrain)
+        self.pad_loc = tuple(self.pad_loc)
+
+    def get_terrain_index(self):
+        if self.terrain_index is None:
+            self.terrain_index = TerrainIndex(self.terrain)
+        return self.terrain_index
+
+    # Highest terrain over columns x - window to x + window - 1 clipped to the
+    # level, which is the terrain window of a state centred on x. Covers every x
+    # whose window overlaps the level, starting from x = 1 - window
+    def get_terrain_peaks(self):
+        if self.terrain_peaks is None:
+            window = cfg.TERRAIN_WINDOW
+            index = self.get_terrain_index()
+            last = len(self.terrain) - 1
+            self.terrain_peaks = [
+                index.query(max(x - window, 0), min(x + window - 1, last))
+                for x in range(1 - window, len(self.terrain) + window)
+            ]
+        return self.terrain_peaks
+
+    # Highest terrain under the state terrain window centred on integer x, or 0
+    # when the window lies entirely outside the level
+    def get_terrain_peak(self, x):
+        peaks = self.get_terrain_peaks()
+        i = x + cfg.TERRAIN_WINDOW - 1
+        return peaks[i] if 0 <= i < len(peaks) else 0
+
     def get_height(self):
         return self.height
 
@@ -0,0 +1,108 @@
+import queue
+import random
+import threading
+from collections import OrderedDict
+from game import constants as cfg
+from game.level import Level
+
+
+# Generates random-seed levels on a worker thread ahead of when they are needed.
+# Level seeds are drawn from a generator seeded with seed, after skipping the
+# first skip of them, so a seeded prefetcher hands out the same levels in the
+# same order and can resume its sequence. taken counts the levels handed out
+class LevelPrefetcher:
+    def __init__(self, height, depth=8, seed=None, skip=0):
+        self.height = height
+        self.rng = random.Random(seed)
+        for _ in range(skip):
+            self.rng.randrange(2**32)
+        self.taken = skip
+        self.levels = queue.Queue(maxsize=depth)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.is_set():
+            level = Level(None, self.rng.randrange(2**32), self.height)
+            level.freeze()
+            while not self.stopped.is_set():
+                try:
+                    self.levels.put(level, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+    def get(self):
+        self.taken += 1
+        return self.levels.get()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+# LRU-bounded cache of headless levels keyed on (seed, height). Cached levels are
+# frozen and shared between episodes, so resetting an episode is a dictionary
+# lookup rather than terrain generation. Random levels (seed None) are never
+# cached and come from a background prefetcher per height instead, seeded from
+# seed if given so that the random levels are reproducible
+class LevelCache:
+    def __init__(self, capacity=32, prefetch_depth=8, seed=None):
+        self.capacity = capacity
+        self.prefetch_depth = prefetch_depth
+        self.seed = seed
+        self.skips = {}
+        self.levels = OrderedDict()
+        self.prefetchers = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, seed, height=None):
+        if height is None:
+            height = cfg.ROCKET_START_HEIGHT_FACTOR
+
+        # Random levels from the prefetcher for this height
+        if seed is None:
+            if height not in self.prefetchers:
+                self.prefetchers[height] = LevelPrefetcher(
+                    height,
+                    self.prefetch_depth,
+                    None if self.seed is None else f"{self.seed}/{height}",
+                    self.skips.pop(height, 0),
+                )
+            return self.prefetchers[height].get()
+
+        key = (seed, height)
+        if key in self.levels:
+            self.hits += 1
+            self.levels.move_to_end(key)
+            return self.levels[key]
+
+        # Generate, then evict least recently used level if over capacity
+        self.misses += 1
+        level = Level(None, seed, height)
+        level.freeze()
+        self.levels[key] = level
+        if len(self.levels) > self.capacity:
+            self.levels.popitem(last=False)
+        return level
+
+    # Seed and random levels taken at each height, from which set_state restarts
+    # the prefetchers where they left off
+    def get_state(self):
+        taken = dict(self.skips)
+        for height, prefetcher in self.prefetchers.items():
+            taken[height] = prefetcher.taken
+        return {"seed": self.seed, "taken": taken}
+
+    def set_state(self, state):
+        self.close()
+        self.seed = state["seed"]
+        self.skips = dict(state["taken"])
+
+    def close(self):
+        for height, prefetcher in self.prefetchers.items():
+            self.skips[height] = prefetcher.taken
+            prefetcher.stop()
+        self.prefetchers = {}
@@ -1,7 +1,12 @@
 import pygame
 from game import constants as cfg
 from game.flags import RocketFlags, SoundFlags
-from math import cos, sin, radians
+from math import ceil, cos, isclose, sin, radians
+import numpy as np
+
+# Fewest burning substeps advance hands to burn, below which the overhead of its
+# array operations outweighs stepping update_state
+BURN_MIN_SUBSTEPS = 16
 
 
 class Rocket:
@@ -35,16 +40,11 @@ class Rocket:
 
         # Mass properties (mass, Iz moment of inertia calculated later)
         self.mass_empty = mass
-        self.mass_fuel = fuel
-        self.mass = mass + fuel
-        self.inertia = None
+        self.fuel_capacity = fuel
 
         # Thrust amount
         self.thrust = thrust
 
-        # Thrust vector
-        self.thrust_vector = [0.0, 0.0]
-
         # Applied torque amount and damping torque
         self.torque = torque
         self.torque_damping = torque_damping
@@ -52,6 +52,19 @@ class Rocket:
         # Fuel burn rate due to thrust and torque (kg / s)
         self.burn_rates = burn_rates
 
+        # Initial flight state
+        self.reset(position)
+
+    # Return to a full, stationary, upright rocket at the given position, keeping
+    # the rocket's constant properties so it can be reused between episodes
+    def reset(self, position):
+        self.mass_fuel = self.fuel_capacity
+        self.mass = self.mass_empty + self.mass_fuel
+        self.inertia = None
+
+        # Thrust vector
+        self.thrust_vector = [0.0, 0.0]
+
         # Position, velocity, and acceleration in x, y
         self.pos = position  # center releative to top left of screen (+right, +down)
         self.velocity = [0.0, 0.0]
@@ -97,6 +110,197 @@ class Rocket:
             self.play_sounds()
             self.move_rect()
 
+    # Advance k substeps of frame_dt with the current inputs held, matching k
+    # calls to update_state to within rounding, and exactly for k = 1. While
+    # fuel burns, the substeps up to fuel exhaustion are integrated together by
+    # burn when there are enough of them, and rendered rockets step them one at a
+    # time for their images. After that only gravity and damping act, and the
+    # rest is advanced in closed form
+    def advance(self, k, frame_dt):
+        if k >= BURN_MIN_SUBSTEPS and self.images == None and self.is_burning():
+            k -= self.burn(k, frame_dt)
+        while k > 0 and self.is_burning():
+            self.update_state(frame_dt)
+            k -= 1
+        if k == 0:
+            return
+
+        # Forces and mass are constant without fuel burn, so the translational
+        # acceleration is too and velocity and position follow the sums of k
+        # substeps of update_state
+        self.calc_mass(frame_dt)
+        self.get_inertia()
+        self.calc_forces()
+        self.calc_accels()
+        for axis, sign in ((0, 1), (1, -1)):
+            v0 = self.velocity[axis]
+            accel = self.accel[axis]
+            self.velocity[axis] = v0 + accel * frame_dt * k
+            self.pos[axis] += (
+                sign * (v0 * k + accel * frame_dt * (k * (k + 1) // 2)) * frame_dt
+            )
+
+        self.rotate_unpowered(k, frame_dt)
+        if self.images != None:
+            self.update_image("rocket")
+            self.play_sounds()
+            self.move_rect()
+
+    # Take up to n burning substeps as array operations, stopping before the one
+    # that exhausts the fuel, and return how many were taken. The fuel and mass
+    # of every substep follow from the constant burn, and a single side
+    # thruster's torque gives the rotation in closed form too. Damping depends
+    # on the sign of omega, so without one the rotation is stepped in a loop.
+    # The thrust direction follows the rotation, and with it the velocity and
+    # position. Sums accumulate in the order update_state adds them
+    def burn(self, n, frame_dt):
+        flags = self.flags
+        burns = []
+        if flags.thrust:
+            burns.append(self.burn_rates[0] * frame_dt)
+        if flags.left_torque or flags.right_torque:
+            burns.append(self.burn_rates[1] * frame_dt)
+        fuel = np.subtract.accumulate(np.concatenate(([self.mass_fuel], burns * n)))
+        fuel = fuel[len(burns) :: len(burns)]
+        exhausted = np.flatnonzero(fuel <= 0)
+        if len(exhausted) > 0:
+            n = int(exhausted[0])
+            fuel = fuel[:n]
+        if n == 0:
+            return 0
+        mass = self.mass_empty + fuel
+        inertia = (mass * (self.geom_height * 0.5) ** 2) / 4 + (
+            mass * self.geom_width**2
+        ) / 12
+
+        # Rotation, with the angle each substep starts from
+        if flags.left_torque != flags.right_torque:
+            torque = self.torque if flags.left_torque else -self.torque
+            alpha = torque / inertia
+        else:
+            torque = self.sum_torques
+            omega = self.omega
+            alpha = []
+            for substep_inertia in inertia.tolist():
+                if omega > 1e-6:
+                    torque = -self.torque_damping
+                elif omega < -1e-6:
+                    torque = self.torque_damping
+                alpha.append(torque / substep_inertia)
+                omega += alpha[-1] * frame_dt
+            alpha = np.array(alpha)
+        omega = np.add.accumulate(np.concatenate(([self.omega], alpha * frame_dt)))
+        angle = np.add.accumulate(np.concatenate(([self.angle], omega[1:] * frame_dt)))
+
+        # Thrust along the angle each substep starts from, and gravity
+        thrust_x = np.zeros(n)
+        thrust_y = np.zeros(n)
+        if flags.thrust:
+            angle_rad = np.radians(angle[:-1])
+            thrust_x = self.thrust * np.cos(angle_rad)
+            thrust_y = self.thrust * np.sin(angle_rad)
+        force_y = thrust_y - mass * cfg.GRAV_M_S2
+        accel_x = thrust_x / mass
+        accel_y = force_y / mass
+        velocity_x = np.add.accumulate(
+            np.concatenate(([self.velocity[0]], accel_x * frame_dt))
+        )
+        velocity_y = np.add.accumulate(
+            np.concatenate(([self.velocity[1]], accel_y * frame_dt))
+        )
+        pos_x = np.add.accumulate(
+            np.concatenate(([self.pos[0]], velocity_x[1:] * frame_dt))
+        )
+        pos_y = np.subtract.accumulate(
+            np.concatenate(([self.pos[1]], velocity_y[1:] * frame_dt))
+        )
+
+        self.mass_fuel = float(fuel[-1])
+        self.mass = float(mass[-1])
+        self.inertia = float(inertia[-1])
+        self.thrust_vector = [float(thrust_x[-1]), float(thrust_y[-1])]
+        self.sum_forces = [self.thrust_vector[0], float(force_y[-1])]
+        self.sum_torques = torque
+        self.accel = [float(accel_x[-1]), float(accel_y[-1])]
+        self.alpha = float(alpha[-1])
+        self.velocity[0] = float(velocity_x[-1])
+        self.velocity[1] = float(velocity_y[-1])
+        self.omega = float(omega[-1])
+        self.pos[0] = float(pos_x[-1])
+        self.pos[1] = float(pos_y[-1])
+        self.angle = float(angle[-1])
+        return n
+
+    # Whether the next substep burns fuel
+    def is_burning(self):
+        return self.mass_fuel > 0 and (
+            self.flags.thrust or self.flags.left_torque or self.flags.right_torque
+        )
+
+    # Torque calc_torques applies without fuel: damping against omega outside
+    # the deadband, and the previous torque held inside it
+    def unpowered_torque(self):
+        if self.omega > 1e-6:
+            return -self.torque_damping
+        if self.omega < -1e-6:
+            return self.torque_damping
+        return self.sum_torques
+
+    # Rotation over n substeps of constant torque, in closed form
+    def rotate(self, n, torque, frame_dt):
+        alpha = torque / self.inertia
+        omega = self.omega
+        self.sum_torques = torque
+        self.alpha = alpha
+        self.omega = omega + alpha * frame_dt * n
+        self.angle += (omega * n + alpha * frame_dt * (n * (n + 1) // 2)) * frame_dt
+
+    # Rotation over n unpowered substeps. Damping brings omega to the deadband
+    # in one run of constant torque, after which omega cycles around it with a
+    # period of at most 4 substeps, so whole cycles are skipped at once
+    def rotate_unpowered(self, n, frame_dt):
+        while n > 0:
+            torque = self.unpowered_torque()
+            if torque == 0:
+                self.rotate(n, torque, frame_dt)
+                return
+
+            # Substeps before the torque changes, checked against the closed
+            # form omega the last of them starts from
+            run = 1
+            if abs(self.omega) > 1e-6:
+                sign = 1 if self.omega > 0 else -1
+                alpha = torque / self.inertia
+                run = min(ceil((abs(self.omega) - 1e-6) / abs(alpha * frame_dt)), n)
+                last = self.omega + alpha * frame_dt * (run - 1)
+                if run > 1 and sign * last <= 1e-6:
+                    run -= 1
+            if run > 1 or n == 1:
+                self.rotate(run, torque, frame_dt)
+                n -= run
+                continue
+
+            # Torque changes every substep, so omega is cycling. Step through one
+            # cycle, then repeat its angle change for every whole cycle left
+            start_omega = self.omega
+            start_angle = self.angle
+            period = 0
+            while period < min(n, 4):
+                self.rotate(1, self.unpowered_torque(), frame_dt)
+                period += 1
+                if (
+                    self.unpowered_torque() == torque
+                    and abs(self.omega - start_omega) <= 1e-9
+                ):
+                    break
+            else:
+                n -= period
+                continue
+            n -= period
+            cycles = n // period
+            self.angle += (self.angle - start_angle) * cycles
+            n -= cycles * period
+
     def calc_mass(self, frame_dt):
         if self.flags.thrust:
             self.mass_fuel -= self.burn_rates[0] * frame_dt
@@ -388,3 +592,66 @@ class Rocket:
     # Manually set omega
     def set_alpha(self, alpha):
         self.alpha = alpha
+
+
+# Compare Rocket.advance against repeated update_state from random flight states
+# and inputs, including near empty tanks, and time both separately for intervals
+# that start unpowered and that start burning fuel
+def check_advance(samples=500, seed=0):
+    import random
+    import time
+
+    rng = random.Random(seed)
+    fields = ("pos", "velocity", "angle", "omega", "alpha", "mass_fuel", "accel")
+    frame_dt = 1 / cfg.FPS
+    for k in (1, 6, 60, 600):
+        seconds = {"unpowered": [0, 0, 0], "burning": [0, 0, 0]}
+        for _ in range(samples):
+            rockets = [Rocket([300.0, 200.0]) for _ in range(2)]
+            action = rng.randrange(6)
+            velocity = [rng.uniform(-50, 50), rng.uniform(-50, 50)]
+            angle = rng.uniform(0, 360)
+            omega = rng.choice([0, rng.uniform(-200, 200)])
+            fuel = rng.choice([cfg.MASS_FUEL_KG, rng.uniform(0, 0.01), 0.0])
+            for rocket in rockets:
+                rocket.set_velocity(*velocity)
+                rocket.set_angle(angle)
+                rocket.set_omega(omega)
+                rocket.mass_fuel = fuel
+                rocket.apply_ai_action(action)
+            stepped, advanced = rockets
+            timing = seconds["burning" if stepped.is_burning() else "unpowered"]
+
+            start = time.perf_counter()
+            for _ in range(k):
+                stepped.update_state(frame_dt)
+            timing[0] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            advanced.advance(k, frame_dt)
+            timing[1] += time.perf_counter() - start
+            timing[2] += 1
+
+            for field in fields:
+                expected = getattr(stepped, field)
+                actual = getattr(advanced, field)
+                if k == 1:
+                    assert actual == expected, f"{field} differs for k = 1"
+                    continue
+                if not isinstance(expected, list):
+                    expected, actual = [expected], [actual]
+                for e, a in zip(expected, actual):
+                    assert isclose(
+                        a, e, rel_tol=1e-9, abs_tol=1e-7
+                    ), f"{field} differs for k = {k}: {a} != {e}"
+
+        for name, (stepped_seconds, advanced_seconds, count) in seconds.items():
+            print(
+                f"k = {k}, {name}: parity ok, update_state "
+                f"{1e6 * stepped_seconds / count:.1f} us, advance "
+                f"{1e6 * advanced_seconds / count:.1f} us"
+            )
+
+
+if __name__ == "__main__":
+    check_advance()
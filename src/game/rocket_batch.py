@@ -0,0 +1,278 @@
+import numpy as np
+from game import constants as cfg
+
+
+# Struct-of-arrays version of Rocket, stepping N rockets at once with NumPy
+class RocketBatch:
+    def __init__(
+        self,
+        positions,
+        width=cfg.ROCKET_RENDER_WIDTH,
+        height=cfg.ROCKET_RENDER_HEIGHT,
+        geom_width=cfg.ROCKET_GEOM_WIDTH,
+        geom_height=cfg.ROCKET_GEOM_HEIGHT,
+        mass=cfg.MASS_EMPTY_KG,
+        fuel=cfg.MASS_FUEL_KG,
+        thrust=cfg.THRUST_N,
+        torque=cfg.TORQUE_NM,
+        torque_damping=cfg.TORQUE_DAMP_NM,
+        burn_rates=cfg.BURN_RATES_KG_S,
+    ):
+        # Starting positions, one [x, y] row per rocket
+        positions = np.array(positions, dtype=np.float64).reshape(-1, 2)
+        self.count = len(positions)
+        n = self.count
+
+        # Rect dimensions in renderer
+        self.width = width
+        self.height = height
+
+        # Rocket dimensions for determining inertia (cylinder)
+        self.geom_width = geom_width
+        self.geom_height = geom_height
+
+        # Constant properties shared by all rockets
+        self.mass_empty = mass
+        self.fuel_capacity = fuel
+        self.thrust = thrust
+        self.torque = torque
+        self.torque_damping = torque_damping
+        self.burn_rates = burn_rates
+
+        # Mass properties (inertia calculated later)
+        self.mass_fuel = np.full(n, fuel, dtype=np.float64)
+        self.mass = np.full(n, mass + fuel, dtype=np.float64)
+        self.inertia = np.zeros(n)
+
+        # Thrust vector, sum of forces in x, y and sum of torque in z
+        self.thrust_vector = np.zeros((n, 2))
+        self.sum_forces = np.zeros((n, 2))
+        self.sum_torques = np.zeros(n)
+
+        # Position, velocity, and acceleration in x, y
+        self.pos = positions  # center relative to top left of screen (+right, +down)
+        self.velocity = np.zeros((n, 2))
+        self.accel = np.zeros((n, 2))
+
+        # z angle, angular velocity, and angular acceleration
+        self.angle = np.full(n, 90.0)
+        self.omega = np.zeros(n)
+        self.alpha = np.zeros(n)
+
+        # Action flags
+        self.thrust_flags = np.zeros(n, dtype=bool)
+        self.left_torque_flags = np.zeros(n, dtype=bool)
+        self.right_torque_flags = np.zeros(n, dtype=bool)
+
+    # Build a batch holding a copy of the current state of scalar rockets
+    @classmethod
+    def from_rockets(cls, rockets):
+        batch = cls([rocket.get_pos() for rocket in rockets])
+        for index, rocket in enumerate(rockets):
+            batch.load_rocket(index, rocket)
+        return batch
+
+    # Copy the state of a scalar rocket into one slot of the batch
+    def load_rocket(self, index, rocket):
+        self.pos[index] = rocket.pos
+        self.velocity[index] = rocket.velocity
+        self.accel[index] = rocket.accel
+        self.angle[index] = rocket.angle
+        self.omega[index] = rocket.omega
+        self.alpha[index] = rocket.alpha
+        self.mass_fuel[index] = rocket.mass_fuel
+        self.mass[index] = rocket.mass
+        self.sum_torques[index] = rocket.sum_torques
+        self.thrust_flags[index] = rocket.flags.thrust
+        self.left_torque_flags[index] = rocket.flags.left_torque
+        self.right_torque_flags[index] = rocket.flags.right_torque
+
+    # Restore selected rockets to the freshly constructed state at new positions
+    def reset(self, mask, positions):
+        self.pos[mask] = positions
+        self.velocity[mask] = 0.0
+        self.accel[mask] = 0.0
+        self.angle[mask] = 90.0
+        self.omega[mask] = 0.0
+        self.alpha[mask] = 0.0
+        self.mass_fuel[mask] = self.fuel_capacity
+        self.mass[mask] = self.mass_empty + self.fuel_capacity
+        self.sum_torques[mask] = 0.0
+        self.thrust_flags[mask] = False
+        self.left_torque_flags[mask] = False
+        self.right_torque_flags[mask] = False
+
+    def update_state(self, frame_dt):
+        self.calc_mass(frame_dt)
+        self.get_inertia()
+        self.calc_forces()
+        self.calc_torques()
+        self.calc_accels()
+        self.calc_velocities(frame_dt)
+        self.calc_positions(frame_dt)
+
+    def calc_mass(self, frame_dt):
+        self.mass_fuel[self.thrust_flags] -= self.burn_rates[0] * frame_dt
+
+        torque_flags = self.left_torque_flags | self.right_torque_flags
+        self.mass_fuel[torque_flags] -= self.burn_rates[1] * frame_dt
+
+        # Enforce floor for fuel quantity
+        np.maximum(self.mass_fuel, 0.0, out=self.mass_fuel)
+
+        self.mass = self.mass_empty + self.mass_fuel
+
+    def get_inertia(self):
+        # Assume rocket is a solid cylinder, inertia about z axis passing through center
+        self.inertia = (self.mass * (self.geom_height * 0.5) ** 2) / 4 + (
+            self.mass * self.geom_width**2
+        ) / 12
+
+    def calc_forces(self):
+        # gravity
+        mg = self.mass * cfg.GRAV_M_S2
+
+        # thrust, only for rockets with thrust applied and fuel remaining
+        thrusting = self.thrust_flags & (self.mass_fuel > 0)
+        angle_rad = np.radians(self.angle)
+        self.thrust_vector[:, 0] = np.where(
+            thrusting, self.thrust * np.cos(angle_rad), 0.0
+        )
+        self.thrust_vector[:, 1] = np.where(
+            thrusting, self.thrust * np.sin(angle_rad), 0.0
+        )
+
+        self.sum_forces[:, 0] = self.thrust_vector[:, 0]
+        self.sum_forces[:, 1] = self.thrust_vector[:, 1] - mg
+
+    def calc_torques(self):
+        has_fuel = self.mass_fuel > 0
+        left = self.left_torque_flags & ~self.right_torque_flags & has_fuel
+        right = self.right_torque_flags & ~self.left_torque_flags & has_fuel
+
+        # applied torque, otherwise damping if angular velocity nonzero
+        # (rockets matching no condition keep their previous torque, as in Rocket)
+        self.sum_torques = np.select(
+            [left, right, self.omega > 1e-6, self.omega < -1e-6],
+            [self.torque, -self.torque, -self.torque_damping, self.torque_damping],
+            default=self.sum_torques,
+        )
+
+    def calc_accels(self):
+        # Translational and angular accelerations
+        self.accel = self.sum_forces / self.mass[:, None]
+        self.alpha = self.sum_torques / self.inertia
+
+    def calc_velocities(self, frame_dt):
+        # Assuming constant accel in current frame, vf = vi + a*t
+        self.velocity += self.accel * frame_dt
+
+        # Assuming constant angular accel in current frame, wf = wi + alpha*t
+        self.omega += self.alpha * frame_dt
+
+    def calc_positions(self, frame_dt):
+        # p = p0 + v0*t (note inverted y axis)
+        self.pos[:, 0] += self.velocity[:, 0] * frame_dt
+        self.pos[:, 1] -= self.velocity[:, 1] * frame_dt
+
+        # ang = ang0 + omega*t
+        self.angle += self.omega * frame_dt
+
+    def apply_ai_action(self, actions):
+        # Same action encoding as Rocket.apply_ai_action, one action per rocket
+        actions = np.asarray(actions)
+        self.thrust_flags = (actions == 1) | (actions == 4) | (actions == 5)
+        self.left_torque_flags = (actions == 2) | (actions == 4)
+        self.right_torque_flags = (actions == 3) | (actions == 5)
+
+    def get_action_state(self):
+        actions = np.zeros(self.count, dtype=np.int64)
+        actions[self.right_torque_flags] = 3
+        actions[self.left_torque_flags] = 2
+        actions[self.thrust_flags] = 1
+        actions[self.thrust_flags & self.right_torque_flags] = 5
+        actions[self.thrust_flags & self.left_torque_flags] = 4
+        return actions
+
+    # Determine how far angle is from upright orientation
+    def angle_deviation_from_upright(self, angle=None):
+        if angle is None:
+            angle = self.angle
+        return np.abs((angle - 90 + 180) % 360 - 180)
+
+    def get_fuel(self):
+        return self.mass_fuel
+
+    def get_pos(self):
+        return self.pos
+
+    def get_velocity(self):
+        return self.velocity
+
+    def get_angle(self):
+        return self.angle
+
+    def get_omega(self):
+        return self.omega
+
+    def get_height(self):
+        return self.height
+
+    def get_width(self):
+        return self.width
+
+
+# Compare RocketBatch against scalar Rockets stepped with the same random
+# actions from random flight states, including near empty tanks, and time both
+def check_rocket_batch(num_rockets=256, steps=300, seed=0):
+    import random
+    import time
+    from game.rocket import Rocket
+
+    rng = random.Random(seed)
+    rockets = []
+    for _ in range(num_rockets):
+        rocket = Rocket([rng.uniform(0, cfg.LEVEL_WIDTH), rng.uniform(0, 400)])
+        rocket.set_velocity(rng.uniform(-50, 50), rng.uniform(-50, 50))
+        rocket.set_angle(rng.uniform(0, 360))
+        rocket.set_omega(rng.choice([0.0, rng.uniform(-200, 200)]))
+        rocket.mass_fuel = rng.choice([cfg.MASS_FUEL_KG, rng.uniform(0, 0.05)])
+        rockets.append(rocket)
+    batch = RocketBatch.from_rockets(rockets)
+
+    fields = ("pos", "velocity", "accel", "angle", "omega", "alpha", "mass_fuel")
+    scalar_seconds = 0
+    batch_seconds = 0
+    for step in range(steps):
+        frame_dt = rng.choice([1 / cfg.FPS, 1 / cfg.MODEL_HZ])
+        actions = [rng.randrange(6) for _ in rockets]
+
+        start = time.perf_counter()
+        for rocket, action in zip(rockets, actions):
+            rocket.apply_ai_action(action)
+            rocket.update_state(frame_dt)
+        scalar_seconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        batch.apply_ai_action(actions)
+        batch.update_state(frame_dt)
+        batch_seconds += time.perf_counter() - start
+
+        for field in fields:
+            expected = np.array([getattr(rocket, field) for rocket in rockets])
+            assert np.array_equal(
+                getattr(batch, field), expected
+            ), f"{field} differs at step {step}"
+        assert np.array_equal(
+            batch.sum_torques, [rocket.sum_torques for rocket in rockets]
+        ), f"sum_torques differs at step {step}"
+
+    print(
+        f"rocket batch: parity ok over {num_rockets} rockets x {steps} steps, "
+        f"Rocket {1e6 * scalar_seconds / steps:.0f} us, RocketBatch "
+        f"{1e6 * batch_seconds / steps:.0f} us per step"
+    )
+
+
+if __name__ == "__main__":
+    check_rocket_batch()
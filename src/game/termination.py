@@ -0,0 +1,82 @@
+from enum import IntEnum
+from game import constants as cfg
+from game import collision
+from game.flags import LandingFlags
+
+
+class Outcome(IntEnum):
+    NONE = 0
+    LANDING = 1
+    PAD_CONTACT = 2
+    COLLISION = 3
+    ESCAPED = 4
+    FLIPPED = 5
+
+
+# Episode outcome strings used in episode info and plots
+OUTCOME_DESCRIPTIONS = {
+    Outcome.NONE: "",
+    Outcome.LANDING: "landing",
+    Outcome.PAD_CONTACT: "pad contact",
+    Outcome.COLLISION: "collision",
+    Outcome.ESCAPED: "escaped",
+    Outcome.FLIPPED: "flipped",
+}
+
+
+# Evaluate the five landing criteria without modifying any game state
+def calc_landing_flags(level, player):
+    pad_loc, _, left_pad, right_pad = level.get_pad_data()
+    level_height = level.get_height()
+
+    player_pos = player.get_pos()
+    player_angle = player.get_angle()
+    player_velocity = player.get_velocity()
+    player_horz_dim = player.get_height()
+    player_vert_dim = player.get_width()
+
+    return LandingFlags(
+        # horizontal velocity less than threshold
+        horz_velocity=abs(player_velocity[0]) < cfg.LANDING_VELOCITY,
+        # vertical velocity less than threshold
+        vert_velocity=abs(player_velocity[1]) < cfg.LANDING_VELOCITY,
+        # landing angle within tolerance
+        angle=cfg.LANDING_MIN_ANGLE < player_angle < cfg.LANDING_MAX_ANGLE,
+        # entirety of rocket on pad horizontally
+        horz_position=left_pad < (player_pos[0] - player_horz_dim / 2)
+        and right_pad > (player_pos[0] + player_horz_dim / 2),
+        # rocket is touching pad vertically within tolerance
+        vert_position=abs(
+            level_height - player_pos[1] - (player_vert_dim / 2) - pad_loc[1]
+        )
+        < cfg.LANDING_HEIGHT,
+    )
+
+
+# Single pass over the terminal checks shared by the game, trainer and evaluator.
+# The rotated boundary geometry is computed once and reused by the escape and
+# collision tests, with outcomes resolved in the order used during training
+class TerminationEvaluator:
+    def __init__(self, flip_angle=90):
+        self.flip_angle = flip_angle
+
+    # Returns the outcome and the landing flags for the current rocket state
+    def evaluate(self, level, player):
+        landing_flags = calc_landing_flags(level, player)
+        if all(landing_flags.get_flags()):
+            return Outcome.LANDING, landing_flags
+
+        rotation = collision.calc_rotation(player)
+        bounds = collision.calc_rotated_bounds(player, rotation)
+        if collision.bounds_escaped(level, bounds):
+            return Outcome.ESCAPED, landing_flags
+
+        if collision.bounds_collision(level, player, rotation, bounds):
+            if landing_flags.horz_position:
+                return Outcome.PAD_CONTACT, landing_flags
+            return Outcome.COLLISION, landing_flags
+
+        if player.angle_deviation_from_upright() > self.flip_angle:
+            return Outcome.FLIPPED, landing_flags
+
+        return Outcome.NONE, landing_flags
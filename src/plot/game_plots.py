@@ -1,5 +1,8 @@
 import matplotlib.pyplot as plt
-from trainer.reward import calc_shaping_rewards
+from trainer.reward import ShapingReward, get_reward_inputs
+
+# Compiled shaping reward of each phase, built on first use
+shaping_by_phase = {}
 
 
 def init_plot_vars():
@@ -16,7 +19,7 @@ def get_plot_data(state_vector, player, prev_state, step, shaping_log, phase, ac
     curr_y = state_vector[1]
     curr_dx = state_vector[8]
     curr_dy = state_vector[9]
-    terrain_from_bottom = state_vector[10:]
+    terrain_peak = max(state_vector[10:])
     vel_x, vel_y = player.get_velocity()
     angle = player.get_angle()
     action = player.get_action_state()
@@ -25,14 +28,11 @@ def get_plot_data(state_vector, player, prev_state, step, shaping_log, phase, ac
         prev_state[0] = curr_dx
         prev_state[1] = curr_dy
     # Calculate minor shaping rewards
-    shaping_rewards = calc_shaping_rewards(
-        phase,
-        player,
-        curr_y,
-        curr_dx,
-        curr_dy,
-        prev_state,
-        terrain_from_bottom,
+    shaping = shaping_by_phase.get(phase)
+    if shaping is None:
+        shaping = shaping_by_phase[phase] = ShapingReward(phase)
+    shaping_rewards = shaping.components(
+        get_reward_inputs(player, curr_y, curr_dx, curr_dy, terrain_peak)
     )
     step += 1
     for key, value in shaping_rewards.items():
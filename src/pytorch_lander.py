@@ -4,6 +4,7 @@ from game import constants as cfg
 from game.game import Game
 from game.level import Level
 from game.rocket import Rocket
+from game.termination import TerminationEvaluator, Outcome
 from game.events import handle_events
 from plot.game_plots import init_plot_vars, get_plot_data, plot_rewards
 from trainer.model import LanderNet
@@ -12,6 +13,7 @@ from trainer.action import select_action
 
 # Initialize game and level
 game = Game()
+termination = TerminationEvaluator()
 level = Level(game.images, 13)
 player = Rocket(level.get_rocket_start_loc(), game.images, game.sounds)
 
@@ -91,18 +93,19 @@ while game.flags.running:
 
         player.update_state(delta_time_seconds)
         game.update_renderer(level, player)
-        if game.calc_landing(level, player):
+        outcome, game.landing_flags = termination.evaluate(level, player)
+        if outcome == Outcome.LANDING:
             player.stop_sounds()
             game.set_landing_flags()
             end_game_time_ms = pygame.time.get_ticks()
             terminated = True
-        elif game.escaped_boundary(level, player):
+        elif outcome == Outcome.ESCAPED:
             player.stop_sounds()
             game.sounds["escape"].play()
             game.set_escape_flags()
             end_game_time_ms = pygame.time.get_ticks()
             terminated = True
-        elif game.calc_collision(level, player):
+        elif outcome in (Outcome.COLLISION, Outcome.PAD_CONTACT):
             player.stop_sounds()
             game.sounds["explosion"].play()
             game.set_collide_flags()
@@ -1,5 +1,4 @@
-from trainer.train_loop import train_loop
-from plot.train_plots import plot_results
+from trainer.pipeline import run_pipeline
 import os
 
 configs = [
@@ -14,6 +13,7 @@ configs = [
         "episode_cap": 5000,
         "buffer_cap": 100000,
         "update_interval": 4,
+        "target_tau": 1.0,
         "warmup_steps": 2000,
         "eval_interval": 200,
         "level_seeds": [13],
@@ -35,6 +35,7 @@ configs = [
         "episode_cap": 2000,
         "buffer_cap": 100000,
         "update_interval": 4,
+        "target_tau": 1.0,
         "warmup_steps": 500,
         "eval_interval": 200,
         "level_seeds": [13],
@@ -56,6 +57,7 @@ configs = [
         "episode_cap": 2000,
         "buffer_cap": 100000,
         "update_interval": 4,
+        "target_tau": 1.0,
         "warmup_steps": 500,
         "eval_interval": 200,
         "level_seeds": [13],
@@ -75,6 +77,7 @@ configs = [
         "episode_cap": 5000,
         "buffer_cap": 100000,
         "update_interval": 4,
+        "target_tau": 1.0,
         "warmup_steps": 500,
         "eval_interval": 25,
         "level_seeds": [13],
@@ -89,15 +92,10 @@ configs = [
     },
 ]
 
-# Perform training on each config if not already run, and if either no prerequisite checkpoint or existing prerequisite
-for config in configs:
-    if not os.path.isfile(config["save_path"]) and (
-        config["checkpoint_path"] is None or os.path.isfile(config["checkpoint_path"])
-    ):
-        train_loop(config)
-    if os.path.isfile(config["csv_plot_path"] + ".csv") and not os.path.isfile(
-        config["csv_plot_path"] + ".pdf"
-    ):
-        plot_results(config["csv_plot_path"])
+# Train the configs as a dependency graph, running independent phases and reports
+# in parallel processes with per-job logs. Workers and actor processes re-import
+# this module, so training only runs when executed as a script
+if __name__ == "__main__":
+    run_pipeline(configs, max_workers=os.cpu_count(), log_dir="logs")
 
-print("Training complete for all config phases!")
+    print("Training complete for all config phases!")
@@ -1,23 +1,42 @@
-import random
 import torch
 
 
-# Returns the action, and whether it was random
-def select_action(model, state, action_dim_choice, epsilon):
+# Epsilon-greedy actions for a [N, state_dim] batch of states, without reading
+# anything back to the host. Returns the action indices, a mask of which actions
+# were random, and a [N, 2] tensor of each state's max and mean Q-value
+def select_actions(model, states, action_dim_choice, epsilon, generator=None):
     with torch.no_grad():
-        q_values = model(state.unsqueeze(0))
-        max_q = q_values.max().item()
-        mean_q = q_values.mean().item()
+        q_values = model(states)
+    q_stats = torch.stack((q_values.max(dim=1)[0], q_values.mean(dim=1)), dim=1)
 
     # With probability epsilon, choose a random action (exploration)
-    if random.random() < epsilon:
-        # 0 = no thrust or torque
-        # 1 = thrust
-        # 2 = left torque
-        # 3 = right torque
-        # 4 = thrust + left torque
-        # 5 = thrust + right torque
-        return random.randint(0, action_dim_choice - 1), True, max_q, mean_q
+    # 0 = no thrust or torque
+    # 1 = thrust
+    # 2 = left torque
+    # 3 = right torque
+    # 4 = thrust + left torque
+    # 5 = thrust + right torque
     # Otherwise, choose the best action according to the Q-network (exploitation)
-    else:
-        return torch.argmax(q_values).item(), False, max_q, mean_q
+    n = states.shape[0]
+    is_random = (
+        torch.rand(n, generator=generator, device=states.device, dtype=q_values.dtype)
+        < epsilon
+    )
+    random_actions = torch.randint(
+        0, action_dim_choice, (n,), generator=generator, device=states.device
+    )
+    actions = torch.where(is_random, random_actions, q_values.argmax(dim=1))
+
+    return actions, is_random, q_stats
+
+
+# Returns the action, whether it was random, and the max and mean Q-value for a
+# single state, reading them back to the host together
+def select_action(model, state, action_dim_choice, epsilon, generator=None):
+    actions, is_random, q_stats = select_actions(
+        model, state.unsqueeze(0), action_dim_choice, epsilon, generator
+    )
+    action, random_flag, max_q, mean_q = torch.cat(
+        (actions.to(q_stats.dtype), is_random.to(q_stats.dtype), q_stats[0])
+    ).tolist()
+    return int(action), bool(random_flag), max_q, mean_q
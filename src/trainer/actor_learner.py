@@ -0,0 +1,452 @@
+from game import constants as cfg
+from game.game import Game
+from game.level_cache import LevelCache
+from game.rocket import Rocket
+from game.termination import TerminationEvaluator, Outcome, OUTCOME_DESCRIPTIONS
+from trainer.state import get_state, get_terrain_x
+from trainer.action import select_actions
+from trainer.model import LanderNet
+from trainer.reward import (
+    ShapingReward,
+    get_reward_inputs,
+    get_terminal_rewards,
+    smooth_terminal_reward,
+)
+from trainer.target import TargetUpdater
+from trainer.train import Learner
+from trainer.utils import (
+    get_epsilon,
+    print_episode,
+    print_csv_summary,
+    export_checkpoint,
+    get_success_buffer_rate,
+    evaluate_policy,
+    modify_starting_state,
+    get_level,
+    init_replay_buffers,
+)
+from trainer.episode_info import (
+    init_episode_info,
+    episode_action_count,
+    episode_cumulative_shaping,
+    episode_min_max_avg,
+    episode_q_totals,
+    episode_final_values,
+    episode_eval_results,
+    get_episode_info_fields,
+)
+from trainer.eval_worker import AsyncEvaluator
+from plot.train_plots import plot_trajectory
+from collections import deque
+import queue
+import time
+import torch
+import torch.multiprocessing as mp
+import random
+import matplotlib.pyplot as plt
+
+
+# Play one episode with the actor's copy of the model. Returns the transitions
+# packed row-wise as [state, next_state, action, reward, done] in one float32
+# tensor, the episode info, and the normalized trajectory for plotting
+def run_episode(config, model, game, level, player, prev_state, epsilon, generator):
+    phase = config["reward_phase"]
+    shaping = ShapingReward(phase)
+    reward_diagnostics = config.get("reward_diagnostics", True)
+    terminal_rewards = get_terminal_rewards(phase, config.get("terminal_rewards"))
+    termination = TerminationEvaluator()
+    delta_time_seconds = 1 / cfg.MODEL_HZ
+
+    episode_info = init_episode_info()
+    q_totals = torch.zeros(2)
+    episode_reward = 0
+    rows = []
+    xs = []
+    ys = []
+
+    # Observation after each step is carried over as the next step's state
+    state_vector = get_state(game, player, level)
+    done = False
+    while not done:
+        # Get current state
+        state = torch.tensor(state_vector, dtype=torch.float32)
+        curr_y = state_vector[1]
+        curr_dx = state_vector[8]
+        curr_dy = state_vector[9]
+        terrain_x = get_terrain_x(player)
+        terrain_peak = level.get_terrain_peak(terrain_x) / level.get_height()
+        vel_x, vel_y = player.get_velocity()
+        angle = player.get_angle()
+        xs.append(state_vector[0])
+        ys.append(curr_y)
+
+        # If first step, need to assign previous delta positions values
+        if prev_state[0] == None and prev_state[1] == None:
+            prev_state[0] = curr_dx
+            prev_state[1] = curr_dy
+
+        # Select and apply action
+        actions, is_random, q_stats = select_actions(
+            model, state.unsqueeze(0), config["action_dim"], epsilon, generator
+        )
+        q_totals += q_stats[0]
+        action, is_random = torch.stack((actions[0], is_random[0].long())).tolist()
+        player.apply_ai_action(action)
+        player.update_state(delta_time_seconds)
+        episode_action_count(episode_info, action, is_random)
+
+        # Use current state values to update episode info min, max, avg
+        episode_min_max_avg(episode_info, vel_x, vel_y, angle, curr_dx, curr_dy)
+
+        # Calculate minor shaping rewards
+        reward_inputs = get_reward_inputs(
+            player, curr_y, curr_dx, curr_dy, terrain_peak
+        )
+        if reward_diagnostics:
+            shaping_rewards = shaping.components(reward_inputs)
+            step_reward = shaping_rewards["r_total"]
+            episode_cumulative_shaping(episode_info, shaping_rewards)
+        else:
+            step_reward = shaping(reward_inputs)
+        episode_reward += step_reward
+
+        # Update previous state in place so it carries over to the next episode
+        prev_state[:] = [curr_dx, curr_dy, vel_x, vel_y, angle, action]
+
+        # Check terminal events
+        outcome, _ = termination.evaluate(level, player)
+        done = outcome != Outcome.NONE
+        event_description = OUTCOME_DESCRIPTIONS[outcome]
+        if done:
+            terminal_award = terminal_rewards[event_description]
+        else:
+            terminal_award = 0
+        if outcome == Outcome.PAD_CONTACT:
+            # Partial awards for being closer to successful landing
+            vx_score = smooth_terminal_reward(vel_x, cfg.LANDING_VELOCITY)
+            vy_score = smooth_terminal_reward(vel_y, cfg.LANDING_VELOCITY)
+            ang_score = smooth_terminal_reward(
+                player.angle_deviation_from_upright(), cfg.LANDING_MAX_ANGLE - 90
+            )
+            terminal_award += terminal_rewards["partial"] * (
+                vx_score + vy_score + ang_score
+            )
+
+        # Increment by terminal award
+        episode_reward += terminal_award
+        step_reward += terminal_award
+
+        # Store transition as one packed row
+        next_state_vector = get_state(game, player, level)
+        rows.append(
+            [*state_vector, *next_state_vector, action, step_reward, float(done)]
+        )
+        state_vector = next_state_vector
+
+    # Assign episode info
+    episode_q_totals(episode_info, q_totals)
+    episode_info["r_terminal"] = terminal_award
+    episode_info["r_total"] = episode_reward
+    episode_info["episode_outcome"] = event_description
+    episode_info["epsilon"] = epsilon
+    episode_info["gamma"] = config["gamma"]
+    episode_info["level_seed"] = level.get_seed()
+    episode_final_values(episode_info, vel_x, vel_y, angle, curr_dx, curr_dy)
+
+    return torch.tensor(rows, dtype=torch.float32), episode_info, (xs, ys)
+
+
+# Actor process: plays episodes with a local model refreshed from the shared
+# weights whenever the learner publishes a new version, and streams each
+# finished episode to the learner through the queue
+def actor_process(
+    config,
+    state_dim,
+    shared_model,
+    weights_version,
+    episode_count,
+    episode_queue,
+    stop_event,
+    seed,
+):
+    # One thread per actor so actors scale across cores instead of contending
+    torch.set_num_threads(1)
+    random.seed(seed)
+    generator = torch.Generator()
+    generator.manual_seed(seed)
+
+    game = Game(-1)
+    level_cache = LevelCache()
+    model = LanderNet(state_dim=state_dim, action_dim=config["action_dim"])
+    weight_copier = TargetUpdater(model, shared_model)
+    local_version = -1
+
+    # Initialize previous state (velocity x, velocity y, angle)
+    prev_state = [None, None, 0, 0, 90, 0]
+
+    while not stop_event.is_set():
+        # Refresh weights if the learner has published newer ones
+        if weights_version.value != local_version:
+            with weights_version.get_lock():
+                weight_copier.update()
+                local_version = weights_version.value
+
+        epsilon = get_epsilon(
+            config["epsilon_start"],
+            config["epsilon_end"],
+            episode_count.value,
+            config["epsilon_decay"],
+        )
+
+        level = get_level(config, level_cache)
+        player = Rocket(level.get_rocket_start_loc())
+        modify_starting_state(config, player, cfg.LEVEL_WIDTH)
+        episode = run_episode(
+            config, model, game, level, player, prev_state, epsilon, generator
+        )
+
+        # Retry until there is room, unless training stopped in the meantime
+        while not stop_event.is_set():
+            try:
+                episode_queue.put(episode, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+
+    # Exit without waiting for the learner to read episodes still in the queue
+    episode_queue.cancel_join_thread()
+    level_cache.close()
+
+
+# Actor/learner training: config["num_actors"] processes play episodes in
+# parallel while this process owns the replay buffers, optimizer and logging,
+# training continuously on whatever has arrived and publishing weights back
+# through shared memory every config["weight_sync_interval"] learner steps
+def train_actor_learner(config):
+    if config.get("compact_replay", False):
+        raise ValueError("compact_replay is not supported with actor processes")
+
+    # Set device to GPU if available
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    # Initialize replay buffers and batch size
+    prioritized = config.get("prioritized_replay", False)
+    main_buffer, success_buffer = init_replay_buffers(config)
+    batch_size = 64
+
+    # State dimension from a throwaway level and player
+    level_cache = LevelCache()
+    level = get_level(config, level_cache)
+    state_dim = len(get_state(Game(-1), Rocket(level.get_rocket_start_loc()), level))
+
+    # Initialize online and target models, loading previous training if applicable
+    model = LanderNet(state_dim=state_dim, action_dim=config["action_dim"]).to(device)
+    if config["checkpoint_path"] is not None:
+        state_dict = torch.load(config["checkpoint_path"], map_location=device)
+        model.load_state_dict(state_dict, strict=False)
+    target_model = LanderNet(
+        state_dim=state_dim, action_dim=config["action_dim"]
+    ).to(device)
+    target_model.load_state_dict(model.state_dict())
+    learner = Learner(
+        model,
+        target_model,
+        device,
+        config["gamma"],
+        grad_steps=config.get("grad_steps", 1),
+        tau=config.get("target_tau", 1.0),
+    )
+
+    # CPU copy of the weights in shared memory that actors read from
+    shared_model = LanderNet(state_dim=state_dim, action_dim=config["action_dim"])
+    shared_model.share_memory()
+    weight_publisher = TargetUpdater(shared_model, model)
+    weight_publisher.update()
+    weight_sync_interval = config.get("weight_sync_interval", 100)
+
+    # Background policy evaluation process, unless disabled in the config
+    evaluator = None
+    if config.get("async_eval", True):
+        evaluator = AsyncEvaluator(config, state_dim, rate_threshold=0.25)
+
+    # Start actors
+    num_actors = config["num_actors"]
+    ctx = mp.get_context("spawn")
+    episode_queue = ctx.Queue(maxsize=4 * num_actors)
+    stop_event = ctx.Event()
+    weights_version = ctx.Value("i", 0)
+    episode_count = ctx.Value("i", 0)
+    actors = [
+        ctx.Process(
+            target=actor_process,
+            args=(
+                config,
+                state_dim,
+                shared_model,
+                weights_version,
+                episode_count,
+                episode_queue,
+                stop_event,
+                random.randrange(2**31),
+            ),
+            daemon=True,
+        )
+        for _ in range(num_actors)
+    ]
+    for actor in actors:
+        actor.start()
+
+    phase = config["reward_phase"]
+    learner_steps = 0
+    env_steps = 0
+    episodes = 0
+    recent_episodes = deque(maxlen=100)
+    all_episodes = []
+    rolling_pad = 0
+    rolling_land = 0
+
+    # Create a persistent figure and axis once
+    fig, ax = plt.subplots()
+    plt.ion()  # interactive mode so the window stays open and updates
+    plt.show()
+
+    start_time = time.perf_counter()
+    while episodes < config["episode_cap"]:
+        # Take at most one finished episode between learner steps, waiting for
+        # one only while there is not yet enough data to train
+        episode = None
+        if len(main_buffer) < batch_size:
+            episode = episode_queue.get()
+        else:
+            try:
+                episode = episode_queue.get_nowait()
+            except queue.Empty:
+                pass
+
+        if episode is not None:
+            transitions, episode_info, (xs, ys) = episode
+            event_description = episode_info["episode_outcome"]
+
+            # Route the episode to the success or main buffer
+            traj_color = "red"
+            target_buffer = main_buffer
+            if phase in ("phase1", "phase2", "phase3"):
+                if event_description == "pad contact":
+                    traj_color = "lightgreen"
+                    target_buffer = success_buffer
+            elif phase == "phase4":
+                if event_description == "landing":
+                    traj_color = "green"
+                    target_buffer = success_buffer
+                elif event_description == "pad contact":
+                    traj_color = "lightgreen"
+
+            # Unpack [state, next_state, action, reward, done] rows
+            transitions = transitions.numpy()
+            target_buffer.add_batch(
+                transitions[:, :state_dim],
+                transitions[:, -3].astype("int64"),
+                transitions[:, -2],
+                transitions[:, state_dim : 2 * state_dim],
+                transitions[:, -1],
+            )
+            env_steps += len(transitions)
+
+            plot_trajectory(xs, ys, ax, fig, traj_color, episode_info["level_seed"])
+
+            # Log episode and determine rolling rate of success
+            episode_info["episode_number"] = episodes
+            recent_episodes.append(episode_info.copy())
+            episode_info = get_episode_info_fields(episode_info, recent_episodes)
+            print_episode(
+                episode_info, episodes, event_description, episode_info["r_total"]
+            )
+            all_episodes.append(episode_info.copy())
+            rolling_pad = all_episodes[-1]["rolling_avg_pad_contact_rate"]
+            rolling_land = all_episodes[-1]["rolling_avg_landing_rate"]
+
+            episodes += 1
+            episode_count.value = episodes
+
+            # Record results of background evaluations that have finished
+            if evaluator is not None:
+                episode_eval_results(all_episodes, evaluator.poll())
+
+            # Evaulate policy with zero epsilon if episode number is at interval, in
+            # the background unless async evaluation is disabled
+            if episodes % config["eval_interval"] == 0:
+                if evaluator is not None:
+                    evaluator.submit(model, episodes)
+                else:
+                    [passed_test, success_rate, episodes_used] = evaluate_policy(
+                        config,
+                        model,
+                        config["action_dim"],
+                        device,
+                        1 / cfg.MODEL_HZ,
+                        eval_episodes=50,
+                        rate_threshold=0.25,
+                        level_cache=level_cache,
+                        confidence=config.get("eval_confidence"),
+                    )
+                    episode_eval_results(
+                        all_episodes, [(episodes, success_rate, episodes_used)]
+                    )
+                    if passed_test:
+                        # Export model and image
+                        export_checkpoint(model, config, plt, episodes, success_rate)
+
+            # Keep waiting for episodes until there is enough data to train
+            if len(main_buffer) < batch_size:
+                continue
+
+        # Refine rate of success buffer usage
+        if prioritized:
+            buffer_pct = 0
+        elif phase in ("phase1", "phase2", "phase3"):
+            buffer_pct = get_success_buffer_rate(rolling_pad)
+        elif phase == "phase4":
+            buffer_pct = get_success_buffer_rate(rolling_land)
+
+        # Train model either using success buffer or main buffer
+        if random.random() < buffer_pct and len(success_buffer) > batch_size:
+            learner.step(success_buffer, batch_size)
+        else:
+            learner.step(main_buffer, batch_size)
+        learner_steps += 1
+
+        # Update target network after warmup, and publish weights to actors
+        if (
+            learner_steps > config["warmup_steps"]
+            and learner_steps % config["update_interval"] == 0
+        ):
+            learner.update_target()
+        if learner_steps % weight_sync_interval == 0:
+            with weights_version.get_lock():
+                weight_publisher.update()
+                weights_version.value += 1
+
+    # Stop actors. Episodes still in flight are abandoned
+    stop_event.set()
+    for actor in actors:
+        actor.join()
+    level_cache.close()
+    main_buffer.close()
+    success_buffer.close()
+
+    # Report throughput
+    elapsed = time.perf_counter() - start_time
+    print(
+        f"{num_actors} actors: {env_steps / elapsed:.0f} env steps/s, "
+        f"{learner_steps / elapsed:.0f} learner steps/s"
+    )
+    print(f"Replay sampling: {main_buffer.get_sample_rate():.0f} transitions/s")
+
+    # Save model after training
+    torch.save(model.state_dict(), config["save_path"])
+    print("Model saved to " + config["save_path"])
+
+    # Create csv file output once outstanding evaluations have been recorded
+    if evaluator is not None:
+        episode_eval_results(all_episodes, evaluator.close())
+    print_csv_summary(all_episodes, config)
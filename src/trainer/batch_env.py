@@ -0,0 +1,428 @@
+from game import constants as cfg
+from game.level_cache import LevelCache
+from game.rocket import Rocket
+from game.rocket_batch import RocketBatch
+from game.termination import Outcome, OUTCOME_DESCRIPTIONS
+from trainer.state import STATE_SIZE, get_padded_terrain, write_states
+from trainer.reward import ShapingReward, RewardInputs, get_terminal_rewards
+from trainer.utils import get_level, modify_starting_state
+import numpy as np
+import random
+import torch
+
+
+# Batched counterpart of SyncVectorLanderEnv, with the same reset/step API and
+# autoreset, taking actions and returning observations, rewards, done flags and
+# outcome codes as tensors on device. Episodes start exactly as in LanderEnv, one
+# scalar Rocket per reset, and are then stepped together on a RocketBatch, with
+# observations, shaping and terminal rewards and the TerminationEvaluator checks
+# computed over all of them with NumPy. Each environment draws its episodes from
+# its own generator seeded by reset, unless one rng such as the random module is
+# given for all of them. On the CPU, returned tensors share memory with the
+# environment until the next step
+class BatchLanderEnv:
+    def __init__(
+        self,
+        config,
+        num_envs,
+        control_hz=cfg.MODEL_HZ,
+        max_steps=None,
+        level_cache=None,
+        device="cpu",
+        rng=None,
+    ):
+        self.config = config
+        self.num_envs = num_envs
+        self.phase = config["reward_phase"]
+        self.shaping = ShapingReward(self.phase)
+        self.reward_diagnostics = config.get("reward_diagnostics", True)
+        self.terminal_rewards = get_terminal_rewards(
+            self.phase, config.get("terminal_rewards")
+        )
+        self.delta_time_seconds = 1 / control_hz
+        self.max_steps = max_steps
+        self.device = torch.device(device)
+
+        self.owns_cache = level_cache is None
+        self.level_cache = LevelCache() if level_cache is None else level_cache
+        self.shared_rng = rng
+        if rng is None:
+            self.rngs = [random.Random() for _ in range(num_envs)]
+        else:
+            self.rngs = [rng] * num_envs
+        self.levels = [None] * num_envs
+        self.players = [None] * num_envs
+        self.steps = np.zeros(num_envs, dtype=np.int64)
+
+        # Rockets, and the outer boundary points and size they all share
+        self.rockets = RocketBatch(np.zeros((num_envs, 2)))
+        rocket = Rocket([0, 0])
+        self.points = np.array(rocket.points, dtype=np.float64)
+        half_width = int(rocket.get_width() * 0.5)
+        half_height = int(rocket.get_height() * 0.5)
+        self.corners = np.array(
+            [
+                [-half_width, -half_height],
+                [-half_width, half_height],
+                [half_width, -half_height],
+                [half_width, half_height],
+            ],
+            dtype=np.float64,
+        )
+
+        # Terrain, terrain peaks and pad of each environment's level
+        self.window = cfg.TERRAIN_WINDOW
+        self.level_width = int(cfg.LEVEL_WIDTH)
+        self.level_height = int(cfg.LEVEL_HEIGHT)
+        self.terrain = np.zeros((num_envs, self.level_width), dtype=np.int64)
+        self.padded_terrain = np.zeros((num_envs, self.level_width + 2 * self.window))
+        self.terrain_peaks = np.zeros(
+            (num_envs, self.level_width + 2 * self.window - 1), dtype=np.int64
+        )
+        self.pad_x = np.zeros(num_envs)
+        self.pad_y = np.zeros(num_envs)
+        self.pad_left = np.zeros(num_envs)
+        self.pad_right = np.zeros(num_envs)
+
+        # Terminal reward of each outcome code
+        self.outcome_rewards = np.zeros(len(Outcome))
+        for code, description in OUTCOME_DESCRIPTIONS.items():
+            if code != Outcome.NONE:
+                self.outcome_rewards[code] = self.terminal_rewards[description]
+
+        # Current states at full precision, written by trainer.state.write_states
+        self.state = np.zeros((num_envs, STATE_SIZE))
+        self.rows = np.arange(num_envs)
+
+    # Put a level and a rocket prepared with the scalar API into one slot. The
+    # rocket is kept as the episode's starting point
+    def load(self, index, level, player):
+        self.levels[index] = level
+        self.players[index] = player
+        self.steps[index] = 0
+        self.rockets.load_rocket(index, player)
+        self.terrain[index] = level.get_terrain()
+        self.padded_terrain[index] = get_padded_terrain(level, self.window)
+        self.terrain_peaks[index] = level.get_terrain_peaks()
+        pad_loc, _, pad_left, pad_right = level.get_pad_data()
+        self.pad_x[index], self.pad_y[index] = pad_loc
+        self.pad_left[index] = pad_left
+        self.pad_right[index] = pad_right
+        self.write_states(self.state, self.rows[index : index + 1])
+
+    # Start a new episode in one slot, drawing the level and initial conditions
+    # from the slot's generator exactly as LanderEnv.reset does
+    def reset_env(self, index):
+        rng = self.rngs[index]
+        level = get_level(self.config, self.level_cache, rng)
+        player = Rocket(level.get_rocket_start_loc())
+        modify_starting_state(self.config, player, cfg.LEVEL_WIDTH, rng)
+        self.load(index, level, player)
+        return {"level_seed": level.get_seed()}
+
+    # Environment i is seeded with seed + i if a seed is given, or a shared rng
+    # with seed itself
+    def reset(self, seed=None, options=None):
+        if seed is not None and self.shared_rng is not None:
+            self.shared_rng.seed(seed)
+        infos = []
+        for i in range(self.num_envs):
+            if seed is not None and self.shared_rng is None:
+                self.rngs[i].seed(seed + i)
+            infos.append(self.reset_env(i))
+        return self.get_observations(), infos
+
+    # Apply one action per environment for a control step, resetting finished
+    # environments with their terminal step info and observation under
+    # "final_info" and "final_observation", as SyncVectorLanderEnv does. Outcome
+    # codes are in the info of each environment
+    def step(self, actions):
+        rockets = self.rockets
+        prev_state = self.state
+        prev_velocity = rockets.velocity.copy()
+        terrain_x = self.get_terrain_x()
+        terrain_peak = self.get_terrain_peaks(terrain_x) / self.level_height
+
+        outcomes = self.simulate(self.as_array(actions), self.delta_time_seconds)
+        self.steps += 1
+
+        # Shaping rewards from the pre-step position and post-step kinematics,
+        # with their breakdown if diagnostics are on
+        angle_dev = rockets.angle_deviation_from_upright()
+        torque_flags = rockets.left_torque_flags | rockets.right_torque_flags
+        inputs = RewardInputs(
+            vx=rockets.velocity[:, 0],
+            vy=rockets.velocity[:, 1],
+            angle_dev=angle_dev,
+            curr_y=prev_state[:, 1],
+            curr_dx=prev_state[:, 8],
+            curr_dy=prev_state[:, 9],
+            terrain=terrain_peak,
+            thrust=rockets.thrust_flags.astype(np.float64),
+            torque=torque_flags.astype(np.float64),
+        )
+        components = None
+        if self.reward_diagnostics:
+            components = self.shaping.batch_components(inputs, np)
+            rewards = components["r_total"]
+        else:
+            rewards = self.shaping.batch(inputs, np)
+
+        # Terminal rewards, with partial awards for pad contact near landing criteria
+        terminal_awards = self.outcome_rewards[outcomes]
+        pad_contact = outcomes == Outcome.PAD_CONTACT
+        if pad_contact.any():
+            vx_score = np.maximum(
+                1.0 - np.abs(prev_velocity[:, 0]) / cfg.LANDING_VELOCITY, 0.0
+            )
+            vy_score = np.maximum(
+                1.0 - np.abs(prev_velocity[:, 1]) / cfg.LANDING_VELOCITY, 0.0
+            )
+            ang_score = np.maximum(1.0 - angle_dev / (cfg.LANDING_MAX_ANGLE - 90), 0.0)
+            partial = self.terminal_rewards["partial"] * (
+                vx_score + vy_score + ang_score
+            )
+            terminal_awards = np.where(
+                pad_contact, terminal_awards + partial, terminal_awards
+            )
+        rewards = rewards + terminal_awards
+
+        terminated = outcomes != Outcome.NONE
+        truncated = ~terminated
+        if self.max_steps is None:
+            truncated[:] = False
+        else:
+            truncated &= self.steps >= self.max_steps
+
+        observations = self.state.astype(np.float32)
+        next_terrain_x = self.get_terrain_x()
+        shaping_rows = [None] * self.num_envs
+        if components is not None:
+            columns = [
+                v if np.ndim(v) else np.full(self.num_envs, v)
+                for v in components.values()
+            ]
+            shaping_rows = [
+                dict(zip(components, row))
+                for row in np.column_stack(columns).tolist()
+            ]
+        infos = []
+        for i in range(self.num_envs):
+            info = {
+                "outcome": Outcome(outcomes[i]),
+                "event_description": OUTCOME_DESCRIPTIONS[Outcome(outcomes[i])],
+                "shaping_rewards": shaping_rows[i],
+                "terminal_award": float(terminal_awards[i]),
+                "terrain_ref": (
+                    self.levels[i],
+                    int(terrain_x[i]),
+                    int(next_terrain_x[i]),
+                ),
+            }
+            if terminated[i] or truncated[i]:
+                final_observation, final_info = observations[i].copy(), info
+                info = self.reset_env(i)
+                info["final_observation"] = final_observation
+                info["final_info"] = final_info
+                observations[i] = self.state[i]
+            infos.append(info)
+
+        return (
+            self.as_tensor(observations),
+            self.as_tensor(rewards),
+            self.as_tensor(terminated),
+            self.as_tensor(truncated),
+            infos,
+        )
+
+    # Advance every rocket by one step of frame_dt under the given actions and
+    # return the outcome code of each environment, without resetting any
+    def advance(self, actions, frame_dt):
+        return self.as_tensor(self.simulate(self.as_array(actions), frame_dt))
+
+    # Observations of the current states
+    def get_observations(self):
+        return self.as_tensor(self.state.astype(np.float32))
+
+    # Tensor on device from a NumPy array, and back
+    def as_tensor(self, array):
+        return torch.from_numpy(array).to(self.device)
+
+    def as_array(self, values):
+        if isinstance(values, torch.Tensor):
+            return values.cpu().numpy()
+        return np.asarray(values)
+
+    # NumPy form of advance, also updating the states
+    def simulate(self, actions, frame_dt):
+        self.rockets.apply_ai_action(actions)
+        self.rockets.update_state(frame_dt)
+        self.state = np.empty_like(self.state)
+        self.write_states(self.state)
+        return self.evaluate()
+
+    # Integer x positions the terrain windows are centred on, as get_terrain_x
+    def get_terrain_x(self):
+        return np.trunc(self.rockets.pos[:, 0]).astype(np.int64)
+
+    # Level.get_terrain_peak for every environment
+    def get_terrain_peaks(self, xs):
+        indices = xs + self.window - 1
+        valid = (indices >= 0) & (indices < self.terrain_peaks.shape[1])
+        indices = np.clip(indices, 0, self.terrain_peaks.shape[1] - 1)
+        return np.where(valid, self.terrain_peaks[self.rows, indices], 0)
+
+    # States of the given rows, or all of them, written into out
+    def write_states(self, out, rows=None):
+        write_states(
+            self.rockets,
+            self.padded_terrain,
+            self.pad_x,
+            self.pad_y,
+            self.level_width,
+            self.level_height,
+            out,
+            rows,
+        )
+
+    # Array version of TerminationEvaluator.evaluate, resolving outcomes in the
+    # same order: landing, escape, collision or pad contact, then flipping
+    def evaluate(self):
+        rockets = self.rockets
+        width = self.level_width
+        height = self.level_height
+        pos_x = rockets.pos[:, 0]
+        pos_y = rockets.pos[:, 1]
+        velocity = rockets.velocity
+        angle = rockets.angle
+
+        # Landing criteria, as in calc_landing_flags
+        horz_position = (self.pad_left < pos_x - rockets.get_height() / 2) & (
+            self.pad_right > pos_x + rockets.get_height() / 2
+        )
+        landing = (
+            (np.abs(velocity[:, 0]) < cfg.LANDING_VELOCITY)
+            & (np.abs(velocity[:, 1]) < cfg.LANDING_VELOCITY)
+            & (cfg.LANDING_MIN_ANGLE < angle)
+            & (angle < cfg.LANDING_MAX_ANGLE)
+            & horz_position
+            & (
+                np.abs(height - pos_y - rockets.get_width() / 2 - self.pad_y)
+                < cfg.LANDING_HEIGHT
+            )
+        )
+
+        # Escape from the rotated corners, as in calc_rotated_bounds
+        angle_rad = np.radians(angle)[:, None]
+        cos_a = np.cos(angle_rad)
+        sin_a = np.sin(angle_rad)
+        corner_xs = np.trunc(
+            self.corners[:, 0] * cos_a + self.corners[:, 1] * sin_a + pos_x[:, None]
+        )
+        corner_ys = np.trunc(
+            -self.corners[:, 0] * sin_a + self.corners[:, 1] * cos_a + pos_y[:, None]
+        )
+        escaped = (
+            (corner_xs.max(axis=1) < 0)
+            | (corner_xs.min(axis=1) > width)
+            | (corner_ys.max(axis=1) < 0)
+            | (corner_ys.min(axis=1) > height)
+        )
+
+        # Collision of any rotated boundary point with the terrain below it
+        point_xs = np.trunc(
+            self.points[:, 0] * cos_a + self.points[:, 1] * sin_a + pos_x[:, None]
+        ).astype(np.int64)
+        point_ys = np.trunc(
+            -self.points[:, 0] * sin_a + self.points[:, 1] * cos_a + pos_y[:, None]
+        )
+        in_level = (point_xs >= 0) & (point_xs < width)
+        heights = self.terrain[self.rows[:, None], np.clip(point_xs, 0, width - 1)]
+        collision = (in_level & (heights >= height - point_ys)).any(axis=1)
+
+        flipped = rockets.angle_deviation_from_upright() > 90
+
+        outcomes = np.select(
+            [landing, escaped, collision & horz_position, collision, flipped],
+            [
+                Outcome.LANDING,
+                Outcome.ESCAPED,
+                Outcome.PAD_CONTACT,
+                Outcome.COLLISION,
+                Outcome.FLIPPED,
+            ],
+            default=Outcome.NONE,
+        )
+        return outcomes.astype(np.int64)
+
+    def close(self):
+        if self.owns_cache:
+            self.level_cache.close()
+
+
+# Step a BatchLanderEnv and a SyncVectorLanderEnv with the same seeds and random
+# actions through several episodes per environment for every training phase,
+# holding left torque in a quarter of the environments so rockets also flip.
+# Observations and outcomes must match exactly and rewards and their breakdown to
+# rounding of the batched shaping sums. Times both
+def check_batch_env(num_envs=32, steps=300, seed=0):
+    import time
+    from pytorch_trainer import configs
+    from trainer.lander_env import SyncVectorLanderEnv
+
+    rng = np.random.default_rng(seed)
+    for config in configs:
+        envs = [
+            SyncVectorLanderEnv(config, num_envs, max_steps=150),
+            BatchLanderEnv(config, num_envs, max_steps=150),
+        ]
+        obs, _ = envs[0].reset(seed=seed)
+        batch_obs, _ = envs[1].reset(seed=seed)
+        assert np.array_equal(obs, batch_obs.numpy()), "reset differs"
+        seconds = [0, 0]
+        episodes = 0
+        for step in range(steps):
+            actions = rng.integers(0, config["action_dim"], num_envs)
+            actions[: num_envs // 4] = 2
+            start = time.perf_counter()
+            obs, rewards, terminated, truncated, infos = envs[0].step(actions)
+            seconds[0] += time.perf_counter() - start
+            start = time.perf_counter()
+            batch = envs[1].step(torch.from_numpy(actions))
+            seconds[1] += time.perf_counter() - start
+
+            batch_obs, batch_rewards, batch_terminated, batch_truncated = (
+                tensor.numpy() for tensor in batch[:4]
+            )
+            assert np.array_equal(obs, batch_obs), f"observations differ at {step}"
+            assert np.allclose(rewards, batch_rewards, rtol=1e-12, atol=1e-9), (
+                f"rewards differ at {step} by "
+                f"{np.abs(rewards - batch_rewards).max()}"
+            )
+            assert np.array_equal(terminated, batch_terminated), f"terminated {step}"
+            assert np.array_equal(truncated, batch_truncated), f"truncated at {step}"
+            for info, batch_info in zip(infos, batch[4]):
+                if "final_info" in info:
+                    assert np.array_equal(
+                        info["final_observation"], batch_info["final_observation"]
+                    )
+                    info = info["final_info"]
+                    batch_info = batch_info["final_info"]
+                    episodes += 1
+                assert info["outcome"] == batch_info["outcome"], step
+                for name, value in info["shaping_rewards"].items():
+                    assert np.isclose(
+                        value, batch_info["shaping_rewards"][name], 1e-12, 1e-9
+                    ), f"{name} differs at {step}"
+
+        for env in envs:
+            env.close()
+        print(
+            f"{config['reward_phase']}: parity ok over {episodes} episodes, "
+            f"SyncVectorLanderEnv {1e3 * seconds[0] / steps:.2f} ms, "
+            f"BatchLanderEnv {1e3 * seconds[1] / steps:.2f} ms per step"
+        )
+
+
+if __name__ == "__main__":
+    check_batch_env()
@@ -1,30 +1,659 @@
-import game.constants as cfg
-from collections import deque
+import numpy as np
+import json
+import os
+import shutil
+import time
 import random
 import torch
+from game import constants as cfg
 
 
 class ReplayBuffer:
+    # Deltas a snapshot may stack on its last full copy
+    max_snapshot_deltas = 16
+
     def __init__(self, capacity):
-        self.buffer = deque(maxlen=capacity)
+        self.capacity = capacity
+
+        # Ring buffer storage, allocated on first add once the state size is known
+        self.states = None
+        self.actions = None
+        self.rewards = None
+        self.next_states = None
+        self.dones = None
+
+        # Next slot to write and number of stored transitions
+        self.index = 0
+        self.size = 0
+
+        # Sampling counters used to report throughput
+        self.sample_calls = 0
+        self.sampled_transitions = 0
+        self.sample_seconds = 0.0
+
+        # Directory of the last snapshot, the snapshot directories that make it
+        # up, transitions recorded in its deltas and added since it was taken
+        self.snapshot_path = None
+        self.snapshot_segments = []
+        self.snapshot_count = 0
+        self.delta_adds = 0
+        self.adds_since_snapshot = 0
+
+    # Allocate one contiguous array per transition field
+    def init_storage(self, state_size):
+        self.states = np.zeros((self.capacity, state_size), dtype=np.float32)
+        self.actions = np.zeros(self.capacity, dtype=np.int64)
+        self.rewards = np.zeros(self.capacity, dtype=np.float32)
+        self.next_states = np.zeros((self.capacity, state_size), dtype=np.float32)
+        self.dones = np.zeros(self.capacity, dtype=np.float32)
+
+    # Store a single transition in the buffer, representing one step of experience.
+    # Once full, the oldest transition is overwritten. The terrain reference is
+    # only needed by compact storage
+    def add(self, state, action, reward, next_state, done, terrain_ref=None):
+        if self.states is None:
+            self.init_storage(len(state))
+
+        i = self.index
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = next_state
+        self.dones[i] = done
+
+        self.index = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.adds_since_snapshot += 1
+
+    # Store a batch of transitions given as arrays, returning the slots written
+    def add_batch(self, states, actions, rewards, next_states, dones):
+        if self.states is None:
+            self.init_storage(states.shape[1])
+
+        # Only the newest transitions survive if the batch exceeds capacity
+        count = min(len(states), self.capacity)
+        slots = (self.index + np.arange(count)) % self.capacity
+        self.states[slots] = states[-count:]
+        self.actions[slots] = actions[-count:]
+        self.rewards[slots] = rewards[-count:]
+        self.next_states[slots] = next_states[-count:]
+        self.dones[slots] = dones[-count:]
 
-    # Store a single transition tuple in the buffer, representing one step of experience
-    def add(self, state, action, reward, next_state, done):
-        self.buffer.append((state, action, reward, next_state, done))
+        self.index = (self.index + count) % self.capacity
+        self.size = min(self.size + count, self.capacity)
+        self.adds_since_snapshot += count
+        return slots
 
-    # Retrieves a random minibatch of stored experience tuples and returns
-    # them as PyTorch tensors so the agent can learn from past transitions
+    # Append every transition stored in another buffer, oldest first, so a new
+    # training phase can start from the experience left by the previous one.
+    # relabel maps each chunk of (states, actions, rewards, next_states, dones)
+    # to the transitions to add, and returns the number added
+    def copy_from(self, other, relabel=None, chunk_size=65536):
+        start = other.index if other.size == other.capacity else 0
+        copied = 0
+        for offset in range(0, other.size, chunk_size):
+            count = min(chunk_size, other.size - offset)
+            indices = (start + offset + np.arange(count)) % other.capacity
+            transitions = (
+                other.states[indices],
+                other.actions[indices],
+                other.rewards[indices],
+                other.next_states[indices],
+                other.dones[indices],
+            )
+            if relabel is not None:
+                transitions = relabel(*transitions)
+            if len(transitions[0]) > 0:
+                copied += len(self.add_batch(*transitions))
+        return copied
+
+    # Retrieves a random minibatch of stored transitions and returns them as
+    # PyTorch tensors so the agent can learn from past experience, recording the
+    # time spent for throughput reporting
     def sample(self, batch_size=128):
-        batch = random.sample(self.buffer, batch_size)
-        states, actions, rewards, next_states, dones = zip(*batch)
+        start = time.perf_counter()
+        batch = self.draw(batch_size)
+        self.sample_calls += 1
+        self.sampled_transitions += batch_size
+        self.sample_seconds += time.perf_counter() - start
+        return batch
+
+    # Draw indices uniformly without replacement
+    def draw(self, batch_size):
+        indices = np.fromiter(
+            random.sample(range(self.size), batch_size),
+            dtype=np.int64,
+            count=batch_size,
+        )
+        return self.gather(indices)
+
+    # Gather transitions at the given indices, wrapping the arrays without copying
+    def gather(self, indices):
         return (
-            torch.tensor(states, dtype=torch.float32),
-            torch.tensor(actions, dtype=torch.long),
-            torch.tensor(rewards, dtype=torch.float32),
-            torch.tensor(next_states, dtype=torch.float32),
-            torch.tensor(dones, dtype=torch.float32),
+            torch.from_numpy(self.states[indices]),
+            torch.from_numpy(self.actions[indices]),
+            torch.from_numpy(self.rewards[indices]),
+            torch.from_numpy(self.next_states[indices]),
+            torch.from_numpy(self.dones[indices]),
         )
 
+    # Return sampled transitions per second spent inside sample()
+    def get_sample_rate(self):
+        if self.sample_seconds == 0:
+            return 0.0
+        return self.sampled_transitions / self.sample_seconds
+
     # Return the current number of stored transitions.
     def __len__(self):
-        return len(self.buffer)
+        return self.size
+
+    # Per-slot arrays written by snapshot()
+    def snapshot_fields(self):
+        return ["states", "actions", "rewards", "next_states", "dones"]
+
+    # Write the buffer to a new directory under path and return the ring position,
+    # counters and the snapshot directories that together hold its contents. The
+    # first snapshot to a path writes every field in full and later ones only the
+    # slots added since the previous snapshot, until the deltas add up to the
+    # capacity or max_snapshot_deltas and a full copy is written again. Snapshot
+    # directories are never modified once written
+    def snapshot(self, path):
+        segment = f"snapshot_{self.snapshot_count}"
+        segment_path = os.path.join(path, segment)
+        shutil.rmtree(segment_path, ignore_errors=True)
+        os.makedirs(segment_path)
+
+        count = min(self.adds_since_snapshot, self.capacity)
+        full = (
+            path != self.snapshot_path
+            or self.delta_adds + count >= self.capacity
+            or len(self.snapshot_segments) > self.max_snapshot_deltas
+        )
+        if self.states is not None:
+            if full:
+                for name in self.snapshot_fields():
+                    np.save(os.path.join(segment_path, name), getattr(self, name))
+            else:
+                slots = (self.index - count + np.arange(count)) % self.capacity
+                np.save(os.path.join(segment_path, "slots"), slots)
+                for name in self.snapshot_fields():
+                    array = getattr(self, name)
+                    np.save(os.path.join(segment_path, name), array[slots])
+
+        # An empty buffer has nothing for later deltas to build on
+        self.snapshot_path = None if self.states is None else path
+        if full:
+            self.snapshot_segments = [segment]
+        else:
+            self.snapshot_segments = self.snapshot_segments + [segment]
+        self.snapshot_count += 1
+        self.delta_adds = 0 if full else self.delta_adds + count
+        self.adds_since_snapshot = 0
+        return {
+            "index": self.index,
+            "size": self.size,
+            "state_size": None if self.states is None else self.states.shape[1],
+            "sample_calls": self.sample_calls,
+            "sampled_transitions": self.sampled_transitions,
+            "sample_seconds": self.sample_seconds,
+            "segments": self.snapshot_segments,
+            "snapshot_count": self.snapshot_count,
+            "delta_adds": self.delta_adds,
+        }
+
+    # Load a snapshot written by snapshot(), given the state it returned, by
+    # applying its full copy and then each delta in order
+    def restore(self, path, state):
+        if state["state_size"] is not None:
+            if self.states is None:
+                self.init_storage(state["state_size"])
+            for segment in state["segments"]:
+                segment_path = os.path.join(path, segment)
+                slots = slice(None)
+                if os.path.isfile(os.path.join(segment_path, "slots.npy")):
+                    slots = np.load(os.path.join(segment_path, "slots.npy"))
+                for name in self.snapshot_fields():
+                    field_path = os.path.join(segment_path, name + ".npy")
+                    getattr(self, name)[slots] = np.load(field_path, mmap_mode="r")
+
+        self.index = state["index"]
+        self.size = state["size"]
+        self.sample_calls = state["sample_calls"]
+        self.sampled_transitions = state["sampled_transitions"]
+        self.sample_seconds = state["sample_seconds"]
+        self.snapshot_path = None if state["state_size"] is None else path
+        self.snapshot_segments = list(state["segments"])
+        self.snapshot_count = state["snapshot_count"]
+        self.delta_adds = state["delta_adds"]
+        self.adds_since_snapshot = 0
+
+    # Directory of the newest snapshot, where subclasses save their extra state
+    def snapshot_segment_path(self, path):
+        return os.path.join(path, self.snapshot_segments[-1])
+
+    # Release any resources held by the buffer
+    def close(self):
+        pass
+
+
+# Replay buffer whose fields live in fixed-width binary files, one per field,
+# memory-mapped from a directory. A small JSON header records the layout, ring
+# position and the reward phase the rewards were given under, and is rewritten
+# every flush_interval adds so the buffer can be reopened after a crash with at
+# most that many transitions lost
+class MemmapReplayBuffer(ReplayBuffer):
+    HEADER_FILE = "header.json"
+    HEADER_VERSION = 1
+    FIELDS = {
+        "states": np.float32,
+        "actions": np.int64,
+        "rewards": np.float32,
+        "next_states": np.float32,
+        "dones": np.float32,
+    }
+
+    def __init__(
+        self,
+        path,
+        capacity=None,
+        read_only=False,
+        flush_interval=1000,
+        reward_phase=None,
+    ):
+        self.path = path
+        self.read_only = read_only
+        self.flush_interval = flush_interval
+        self.adds_since_flush = 0
+        self.reward_phase = reward_phase
+
+        header = self.read_header()
+        if header is None:
+            if capacity is None or read_only:
+                raise FileNotFoundError(f"No replay buffer found at {path}")
+            super().__init__(capacity)
+            os.makedirs(path, exist_ok=True)
+        else:
+            if capacity is not None and capacity != header["capacity"]:
+                raise ValueError(
+                    f"Replay buffer at {path} has capacity {header['capacity']}, "
+                    f"not {capacity}"
+                )
+            stored_phase = header.get("reward_phase")
+            if reward_phase is not None and reward_phase != stored_phase:
+                raise ValueError(
+                    f"Replay buffer at {path} holds {stored_phase} rewards, "
+                    f"not {reward_phase}"
+                )
+            self.reward_phase = stored_phase
+            super().__init__(header["capacity"])
+            if header["state_size"] is not None:
+                self.init_storage(header["state_size"])
+            self.index = header["index"]
+            self.size = header["size"]
+
+    def read_header(self):
+        header_path = os.path.join(self.path, self.HEADER_FILE)
+        if not os.path.isfile(header_path):
+            return None
+        with open(header_path) as f:
+            header = json.load(f)
+        if header["version"] != self.HEADER_VERSION:
+            raise ValueError(
+                f"Unsupported replay buffer version {header['version']} at {self.path}"
+            )
+        return header
+
+    # Write the header to a temporary file and swap it in, so a crash never
+    # leaves a partially written header behind
+    def write_header(self):
+        header = {
+            "version": self.HEADER_VERSION,
+            "capacity": self.capacity,
+            "state_size": None if self.states is None else self.states.shape[1],
+            "index": self.index,
+            "size": self.size,
+            "reward_phase": self.reward_phase,
+        }
+        header_path = os.path.join(self.path, self.HEADER_FILE)
+        with open(header_path + ".tmp", "w") as f:
+            json.dump(header, f)
+        os.replace(header_path + ".tmp", header_path)
+
+    # Map one file per field, creating them at full capacity if new
+    def init_storage(self, state_size):
+        for name, dtype in self.FIELDS.items():
+            if "states" in name:
+                shape = (self.capacity, state_size)
+            else:
+                shape = (self.capacity,)
+            field_path = os.path.join(self.path, name + ".bin")
+            if self.read_only:
+                mode = "r"
+            elif os.path.isfile(field_path):
+                mode = "r+"
+            else:
+                mode = "w+"
+            field = np.memmap(field_path, dtype=dtype, mode=mode, shape=shape)
+            setattr(self, name, field)
+
+    def add(self, state, action, reward, next_state, done, terrain_ref=None):
+        super().add(state, action, reward, next_state, done)
+        self.count_adds(1)
+
+    def add_batch(self, states, actions, rewards, next_states, dones):
+        slots = super().add_batch(states, actions, rewards, next_states, dones)
+        self.count_adds(len(slots))
+        return slots
+
+    def count_adds(self, count):
+        self.adds_since_flush += count
+        if self.adds_since_flush >= self.flush_interval:
+            self.flush()
+
+    # Write mapped data to disk before the header that makes it visible
+    def flush(self):
+        if self.read_only:
+            return
+        if self.states is not None:
+            for name in self.FIELDS:
+                getattr(self, name).flush()
+        self.write_header()
+        self.adds_since_flush = 0
+
+    # Snapshots copy the mapped fields like any other buffer, and restoring one
+    # writes its transitions back into the files, so slots written after the
+    # snapshot are reverted too
+    def restore(self, path, state):
+        super().restore(path, state)
+        self.flush()
+
+    def close(self):
+        self.flush()
+
+
+# Array-based binary sum-tree over leaf priorities. Node i has children 2i and
+# 2i + 1, the root is node 1 and leaves start at node `leaf_start`, so both
+# batched updates and proportional lookups walk one tree level per iteration
+class SumTree:
+    def __init__(self, capacity):
+        self.leaf_start = 1
+        while self.leaf_start < capacity:
+            self.leaf_start *= 2
+        self.depth = self.leaf_start.bit_length() - 1
+        self.tree = np.zeros(2 * self.leaf_start, dtype=np.float64)
+
+    def total(self):
+        return self.tree[1]
+
+    # Set priorities of the given leaves and refresh their ancestors
+    def update(self, indices, priorities):
+        nodes = np.asarray(indices, dtype=np.int64) + self.leaf_start
+        self.tree[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    # Find the leaf whose cumulative priority range contains each value
+    def find(self, values):
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            left_sum = self.tree[left]
+            go_right = values > left_sum
+            values -= np.where(go_right, left_sum, 0.0)
+            nodes = left + go_right
+        return nodes - self.leaf_start
+
+    def get(self, indices):
+        return self.tree[np.asarray(indices, dtype=np.int64) + self.leaf_start]
+
+
+# Replay buffer sampling transitions in proportion to priority^alpha, with
+# importance-sampling weights whose exponent beta anneals towards 1. New
+# transitions get the largest priority seen so far so they are replayed at least once
+class PrioritizedReplayBuffer(ReplayBuffer):
+    def __init__(
+        self, capacity, alpha=0.6, beta_start=0.4, beta_steps=100000, eps=1e-5
+    ):
+        super().__init__(capacity)
+        self.tree = SumTree(capacity)
+        self.alpha = alpha
+        self.beta_start = beta_start
+        self.beta_steps = beta_steps
+        self.eps = eps
+        self.max_priority = 1.0
+
+    def add(self, state, action, reward, next_state, done, terrain_ref=None):
+        i = self.index
+        super().add(state, action, reward, next_state, done)
+        self.tree.update([i], self.max_priority**self.alpha)
+
+    def add_batch(self, states, actions, rewards, next_states, dones):
+        slots = super().add_batch(states, actions, rewards, next_states, dones)
+        self.tree.update(slots, self.max_priority**self.alpha)
+        return slots
+
+    def get_beta(self):
+        progress = min(1.0, self.sample_calls / self.beta_steps)
+        return self.beta_start + progress * (1.0 - self.beta_start)
+
+    # Sample one value from each of batch_size equal slices of the total
+    # priority, returning the batch tensors, buffer indices and normalized
+    # importance-sampling weights
+    def draw(self, batch_size):
+        total = self.tree.total()
+        segment = total / batch_size
+        values = (np.arange(batch_size) + np.random.random_sample(batch_size)) * segment
+        indices = self.tree.find(np.minimum(values, total))
+
+        # Guard against landing on an empty leaf from floating point round-off
+        indices = np.minimum(indices, self.size - 1)
+
+        probs = self.tree.get(indices) / total
+        weights = (self.size * probs) ** (-self.get_beta())
+        weights = (weights / weights.max()).astype(np.float32)
+
+        return (*self.gather(indices), indices, torch.from_numpy(weights))
+
+    # Set priorities of sampled transitions from their absolute TD errors
+    def update_priorities(self, indices, td_errors):
+        priorities = np.abs(np.asarray(td_errors, dtype=np.float64)) + self.eps
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.tree.update(indices, priorities**self.alpha)
+
+    # Priorities change wherever transitions are sampled, so every leaf is saved
+    # with each snapshot
+    def snapshot(self, path):
+        state = super().snapshot(path)
+        priorities = self.tree.get(np.arange(self.capacity))
+        segment_path = self.snapshot_segment_path(path)
+        np.save(os.path.join(segment_path, "priorities"), priorities)
+        state["max_priority"] = self.max_priority
+        return state
+
+    def restore(self, path, state):
+        super().restore(path, state)
+        segment_path = self.snapshot_segment_path(path)
+        priorities = np.load(os.path.join(segment_path, "priorities.npy"))
+        self.tree.update(np.arange(self.capacity), priorities)
+        self.max_priority = state["max_priority"]
+
+
+# Replay buffer storing only the kinematic part of each state. The terrain slice
+# of a state depends only on the level and the integer x position, so each
+# transition keeps a (level id, x) reference for both states and the slices are
+# rebuilt at sample time from a shared per-level table of normalized terrain.
+# Adds need terrain_ref = (level, x, next_x), with x from get_terrain_x
+class CompactReplayBuffer(ReplayBuffer):
+    def __init__(self, capacity, window=cfg.TERRAIN_WINDOW):
+        super().__init__(capacity)
+        self.window = window
+        self.kinematic_size = None
+
+        # Per-transition level references and terrain x positions
+        self.level_ids = np.full(capacity, -1, dtype=np.int32)
+        self.xs = np.zeros(capacity, dtype=np.int16)
+        self.next_xs = np.zeros(capacity, dtype=np.int16)
+
+        # Shared terrain table with a reference count per row. Rows are reused
+        # once every transition pointing at them has been overwritten
+        self.terrain_table = None
+        self.terrain_refs = np.zeros(0, dtype=np.int64)
+        self.level_rows = {}
+        self.row_levels = []
+        self.free_rows = []
+
+    def init_storage(self, state_size):
+        self.kinematic_size = state_size - 2 * self.window
+        self.states = np.zeros((self.capacity, self.kinematic_size), dtype=np.float32)
+        self.actions = np.zeros(self.capacity, dtype=np.int64)
+        self.rewards = np.zeros(self.capacity, dtype=np.float32)
+        self.next_states = np.zeros(
+            (self.capacity, self.kinematic_size), dtype=np.float32
+        )
+        self.dones = np.zeros(self.capacity, dtype=np.float32)
+
+    # Return the terrain table row for a level, adding it if needed
+    def get_level_row(self, level):
+        if level in self.level_rows:
+            return self.level_rows[level]
+
+        terrain = np.asarray(level.get_terrain(), dtype=np.float64)
+        terrain = (terrain / level.get_height()).astype(np.float32)
+        if self.terrain_table is None:
+            self.terrain_table = np.zeros((1, len(terrain)), dtype=np.float32)
+            self.terrain_refs = np.zeros(1, dtype=np.int64)
+            self.row_levels = [None]
+            self.free_rows = [0]
+        if not self.free_rows:
+            rows = len(self.row_levels)
+            self.terrain_table = np.resize(self.terrain_table, (2 * rows, len(terrain)))
+            self.terrain_refs = np.concatenate(
+                [self.terrain_refs, np.zeros(rows, dtype=np.int64)]
+            )
+            self.row_levels += [None] * rows
+            self.free_rows = list(range(2 * rows - 1, rows - 1, -1))
+
+        row = self.free_rows.pop()
+        self.terrain_table[row] = terrain
+        self.level_rows[level] = row
+        self.row_levels[row] = level
+        return row
+
+    # Drop one reference to a terrain row, freeing it when unused
+    def release_row(self, row):
+        self.terrain_refs[row] -= 1
+        if self.terrain_refs[row] == 0:
+            del self.level_rows[self.row_levels[row]]
+            self.row_levels[row] = None
+            self.free_rows.append(row)
+
+    def snapshot_fields(self):
+        return super().snapshot_fields() + ["level_ids", "xs", "next_xs"]
+
+    # Terrain rows are saved whole with each snapshot. Levels are not saved, so
+    # restored rows are keyed by placeholders and new adds of the same level use
+    # a fresh row
+    def snapshot(self, path):
+        state = super().snapshot(path)
+        if self.states is None:
+            return state
+        state["state_size"] += 2 * self.window
+        segment_path = self.snapshot_segment_path(path)
+        np.save(os.path.join(segment_path, "terrain_table"), self.terrain_table)
+        np.save(os.path.join(segment_path, "terrain_refs"), self.terrain_refs)
+        state["free_rows"] = list(self.free_rows)
+        return state
+
+    def restore(self, path, state):
+        super().restore(path, state)
+        if state["state_size"] is None:
+            return
+        segment_path = self.snapshot_segment_path(path)
+        self.terrain_table = np.load(os.path.join(segment_path, "terrain_table.npy"))
+        self.terrain_refs = np.load(os.path.join(segment_path, "terrain_refs.npy"))
+        self.free_rows = list(state["free_rows"])
+        self.row_levels = [None] * len(self.terrain_refs)
+        self.level_rows = {}
+        for row in np.flatnonzero(self.terrain_refs):
+            self.row_levels[row] = ("restored", int(row))
+            self.level_rows[self.row_levels[row]] = int(row)
+
+    def add(self, state, action, reward, next_state, done, terrain_ref=None):
+        if terrain_ref is None:
+            raise ValueError("CompactReplayBuffer.add requires a terrain_ref")
+        level, x, next_x = terrain_ref
+        if self.states is None:
+            self.init_storage(len(state))
+
+        i = self.index
+        if self.level_ids[i] >= 0:
+            self.release_row(self.level_ids[i])
+        row = self.get_level_row(level)
+        self.terrain_refs[row] += 1
+
+        # Keep x within a full window of the level, the range over which
+        # get_state slices are well defined, so it fits in int16
+        width = self.terrain_table.shape[1]
+        self.level_ids[i] = row
+        self.xs[i] = min(max(x, -self.window), width + self.window)
+        self.next_xs[i] = min(max(next_x, -self.window), width + self.window)
+        self.states[i] = state[: self.kinematic_size]
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = next_state[: self.kinematic_size]
+        self.dones[i] = done
+
+        self.index = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.adds_since_snapshot += 1
+
+    # Store a batch of transitions through add, with one terrain reference per
+    # transition, returning the slots written
+    def add_batch(
+        self, states, actions, rewards, next_states, dones, terrain_refs=None
+    ):
+        if terrain_refs is None or len(terrain_refs) != len(states):
+            raise ValueError(
+                "CompactReplayBuffer.add_batch requires a terrain_ref per transition"
+            )
+        start = self.index
+        for transition in zip(
+            states, actions, rewards, next_states, dones, terrain_refs
+        ):
+            self.add(*transition)
+        count = min(len(states), self.capacity)
+        return (start + len(states) - count + np.arange(count)) % self.capacity
+
+    # Rebuild left aligned, zero padded terrain slices like get_state
+    def get_terrain_slices(self, rows, xs):
+        width = self.terrain_table.shape[1]
+        xs = xs.astype(np.int64)
+        left = np.maximum(0, xs - self.window)
+        right = np.minimum(width, xs + self.window)
+        columns = left[:, None] + np.arange(2 * self.window)
+        valid = columns < right[:, None]
+        slices = self.terrain_table[rows[:, None], np.minimum(columns, width - 1)]
+        return np.where(valid, slices, np.float32(0))
+
+    def gather(self, indices):
+        rows = self.level_ids[indices]
+        states = np.concatenate(
+            [self.states[indices], self.get_terrain_slices(rows, self.xs[indices])],
+            axis=1,
+        )
+        next_states = np.concatenate(
+            [
+                self.next_states[indices],
+                self.get_terrain_slices(rows, self.next_xs[indices]),
+            ],
+            axis=1,
+        )
+        return (
+            torch.from_numpy(states),
+            torch.from_numpy(self.actions[indices]),
+            torch.from_numpy(self.rewards[indices]),
+            torch.from_numpy(next_states),
+            torch.from_numpy(self.dones[indices]),
+        )
@@ -0,0 +1,97 @@
+import numpy as np
+import os
+import random
+import shutil
+import torch
+
+# Complete training state checkpoints. A checkpoint directory holds the
+# networks, optimizer, counters, episode logs and random number generator states
+# in one file that is replaced atomically, next to a directory per replay buffer.
+# Each checkpoint adds new snapshot directories to those, and the state file
+# records which ones make up the buffers, so replacing it switches every buffer
+# to the new snapshot at once
+STATE_FILE = "training_state.pt"
+
+
+# States of every random number generator training draws from, including the
+# exploration generator
+def get_rng_states(generator):
+    return {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+        "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+        "generator": generator.get_state(),
+    }
+
+
+def set_rng_states(rng_states, generator):
+    random.setstate(rng_states["python"])
+    np.random.set_state(rng_states["numpy"])
+    torch.set_rng_state(rng_states["torch"])
+    if rng_states["cuda"] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(rng_states["cuda"])
+    generator.set_state(rng_states["generator"])
+
+
+# Rocket initial conditions, so an episode start drawn before a checkpoint can be
+# replayed on resume
+def get_start_state(player):
+    return {
+        "pos": list(player.get_pos()),
+        "velocity": list(player.get_velocity()),
+        "accel": list(player.get_accel()),
+        "angle": player.get_angle(),
+        "omega": player.get_omega(),
+        "alpha": player.get_alpha(),
+    }
+
+
+def set_start_state(player, start_state):
+    player.pos = list(start_state["pos"])
+    player.set_velocity(*start_state["velocity"])
+    player.set_accel(*start_state["accel"])
+    player.set_angle(start_state["angle"])
+    player.set_omega(start_state["omega"])
+    player.set_alpha(start_state["alpha"])
+
+
+# Replay buffers to checkpoint by name, counting a buffer shared by both roles once
+def checkpoint_buffers(main_buffer, success_buffer):
+    if success_buffer is main_buffer:
+        return {"main": main_buffer}
+    return {"main": main_buffer, "success": success_buffer}
+
+
+# Snapshot the buffers, then write the training state with the buffer ring
+# positions to a temporary file and swap it in. Snapshot directories the new
+# state no longer refers to are only deleted after the swap, so a crash at any
+# point leaves the previous checkpoint usable
+def save_training_state(path, state, buffers):
+    os.makedirs(path, exist_ok=True)
+    state = dict(state)
+    state["buffers"] = {
+        name: buffer.snapshot(os.path.join(path, name))
+        for name, buffer in buffers.items()
+    }
+    state_path = os.path.join(path, STATE_FILE)
+    torch.save(state, state_path + ".tmp")
+    os.replace(state_path + ".tmp", state_path)
+
+    for name in buffers:
+        buffer_path = os.path.join(path, name)
+        segments = set(state["buffers"][name]["segments"])
+        for entry in os.listdir(buffer_path):
+            if entry not in segments:
+                shutil.rmtree(os.path.join(buffer_path, entry))
+
+
+# Load a checkpoint written by save_training_state, restoring the buffers in
+# place and returning the rest of the training state
+def load_training_state(path, buffers, device):
+    state = torch.load(
+        os.path.join(path, STATE_FILE), map_location=device, weights_only=False
+    )
+    for name, buffer in buffers.items():
+        buffer.restore(os.path.join(path, name), state["buffers"][name])
+    return state
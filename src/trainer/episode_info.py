@@ -45,6 +45,8 @@ def init_episode_info():
     episode_info["rolling_avg_reward"] = None
     episode_info["q_max_avg"] = 0
     episode_info["q_mean_avg"] = 0
+    episode_info["eval_success_rate"] = None
+    episode_info["eval_episodes_used"] = None
 
     return episode_info
 
@@ -79,7 +81,7 @@ def episode_cumulative_shaping(episode_info, shaping_rewards):
 
 
 # Update min, max, and average values for episode info
-def episode_min_max_avg(episode_info, vx, vy, angle, dx_pad, dy_pad, max_q, mean_q):
+def episode_min_max_avg(episode_info, vx, vy, angle, dx_pad, dy_pad):
     # horizontal velocity
     episode_info["vx_min"] = min(episode_info["vx_min"], vx)
     episode_info["vx_max"] = max(episode_info["vx_max"], vx)
@@ -98,9 +100,48 @@ def episode_min_max_avg(episode_info, vx, vy, angle, dx_pad, dy_pad, max_q, mean
     episode_info["angle_min"] = min(episode_info["angle_min"], angle)
     episode_info["angle_max"] = max(episode_info["angle_max"], angle)
     episode_info["angle_avg"] += angle
-    # q-values
-    episode_info["q_max_avg"] += max_q
-    episode_info["q_mean_avg"] += mean_q
+
+
+# Set episode q-value totals from the [max, mean] sums accumulated on device,
+# reading them back to the host once per episode
+def episode_q_totals(episode_info, q_totals):
+    episode_info["q_max_avg"], episode_info["q_mean_avg"] = q_totals.tolist()
+
+
+# Get number of episode steps, turn accumulated sums into averages and record
+# the final values at the end of an episode
+def episode_final_values(episode_info, vx, vy, angle, dx_pad, dy_pad):
+    episode_info["num_steps"] = (
+        episode_info["action_count_exploration"]
+        + episode_info["action_count_exploitation"]
+    )
+
+    # Calculate averages for episode info
+    try:
+        episode_info["vy_avg"] /= episode_info["num_steps"]
+        episode_info["vx_avg"] /= episode_info["num_steps"]
+        episode_info["angle_avg"] /= episode_info["num_steps"]
+        episode_info["q_max_avg"] /= episode_info["num_steps"]
+        episode_info["q_mean_avg"] /= episode_info["num_steps"]
+    except:
+        raise ZeroDivisionError("Error: number of steps is zero for episode.")
+
+    # Get final values for episode info
+    episode_info["vy_final"] = vy
+    episode_info["vx_final"] = vx
+    episode_info["dy_pad_final"] = dy_pad
+    episode_info["dx_pad_final"] = dx_pad
+    episode_info["dx_pad_final_abs"] = abs(dx_pad)
+    episode_info["angle_final"] = angle
+
+
+# Record evaluation success rates and episodes played on the episodes that
+# triggered them. Evaluations are numbered by the episode count after the
+# triggering episode finished
+def episode_eval_results(all_episodes, results):
+    for episodes, success_rate, episodes_used in results:
+        all_episodes[episodes - 1]["eval_success_rate"] = success_rate
+        all_episodes[episodes - 1]["eval_episodes_used"] = episodes_used
 
 
 # Calculate rolling average rate of occurrence of episode outcome
@@ -0,0 +1,117 @@
+from game import constants as cfg
+from game.level_cache import LevelCache
+from trainer.model import LanderNet
+from trainer.utils import evaluate_policy, export_checkpoint
+from plot.train_plots import plot_trajectory
+import queue
+import torch
+import torch.multiprocessing as mp
+import matplotlib.pyplot as plt
+
+
+# Evaluation worker process: evaluates each submitted weight snapshot and, if it
+# passes the rate threshold, exports the checkpoint along with a plot of the
+# evaluation trajectories. Reports (episode, success rate, episodes used) back
+# for every snapshot
+def evaluation_worker(
+    config, state_dim, rate_threshold, eval_episodes, request_queue, result_queue
+):
+    torch.set_num_threads(1)
+    plt.switch_backend("Agg")
+
+    device = torch.device("cpu")
+    model = LanderNet(state_dim=state_dim, action_dim=config["action_dim"])
+    level_cache = LevelCache()
+
+    while True:
+        request = request_queue.get()
+        if request is None:
+            break
+        episodes, state_dict = request
+        model.load_state_dict(state_dict)
+
+        trajectories = []
+        [passed_test, success_rate, episodes_used] = evaluate_policy(
+            config,
+            model,
+            config["action_dim"],
+            device,
+            1 / cfg.MODEL_HZ,
+            eval_episodes=eval_episodes,
+            rate_threshold=rate_threshold,
+            level_cache=level_cache,
+            trajectories=trajectories,
+            confidence=config.get("eval_confidence"),
+        )
+        if passed_test:
+            # Export model and image of the evaluation trajectories
+            fig, ax = plt.subplots()
+            for xs, ys, seed, success in trajectories:
+                plot_trajectory(xs, ys, ax, fig, "green" if success else "red", seed)
+            ax.set_title("Evaluation trajectories")
+            export_checkpoint(
+                model,
+                config,
+                plt,
+                episodes,
+                success_rate,
+                plot_name="evaluation_trajectories",
+            )
+            plt.close(fig)
+
+        result_queue.put((episodes, success_rate, episodes_used))
+
+    level_cache.close()
+
+
+# Runs policy evaluation in a separate process so training continues while it
+# runs. submit() snapshots the model weights, and poll() returns the
+# (episode, success rate, episodes used) results that have arrived since the last call
+class AsyncEvaluator:
+    def __init__(self, config, state_dim, rate_threshold=0.25, eval_episodes=50):
+        ctx = mp.get_context("spawn")
+        self.request_queue = ctx.Queue()
+        self.result_queue = ctx.Queue()
+        self.pending = 0
+        self.process = ctx.Process(
+            target=evaluation_worker,
+            args=(
+                config,
+                state_dim,
+                rate_threshold,
+                eval_episodes,
+                self.request_queue,
+                self.result_queue,
+            ),
+            daemon=True,
+        )
+        self.process.start()
+
+    # Queue a CPU copy of the current weights for evaluation
+    def submit(self, model, episodes):
+        state_dict = {
+            key: value.detach().cpu().clone()
+            for key, value in model.state_dict().items()
+        }
+        self.request_queue.put((episodes, state_dict))
+        self.pending += 1
+
+    def poll(self):
+        results = []
+        while self.pending > 0:
+            try:
+                results.append(self.result_queue.get_nowait())
+            except queue.Empty:
+                break
+            self.pending -= 1
+        return results
+
+    # Wait for outstanding evaluations, stop the worker and return their results
+    def close(self):
+        results = []
+        while self.pending > 0:
+            results.append(self.result_queue.get())
+            self.pending -= 1
+        self.request_queue.put(None)
+        self.process.join()
+        return results
@@ -0,0 +1,204 @@
+from game import constants as cfg
+from game.game import Game
+from game.level_cache import LevelCache
+from game.rocket import Rocket
+from game.termination import TerminationEvaluator, Outcome, OUTCOME_DESCRIPTIONS
+from trainer.state import STATE_SIZE, get_state, get_terrain_x
+from trainer.reward import (
+    ShapingReward,
+    get_reward_inputs,
+    get_terminal_rewards,
+    smooth_terminal_reward,
+)
+from trainer.utils import get_level, modify_starting_state
+import numpy as np
+import random
+
+# Gymnasium is optional. With it installed the environment is a gymnasium.Env
+# with action and observation spaces, otherwise it only follows the same API
+try:
+    import gymnasium
+    from gymnasium import spaces
+except ImportError:
+    gymnasium = None
+
+
+# Headless lander environment with the Gymnasium reset(seed)/step(action) API.
+# Levels, start-state randomization and reward phase come from a training phase
+# config, and reset reuses the same game, rocket and cached levels
+class LanderEnv(gymnasium.Env if gymnasium is not None else object):
+    metadata = {"render_modes": []}
+
+    def __init__(self, config, control_hz=cfg.MODEL_HZ, max_steps=None):
+        self.config = config
+        self.phase = config["reward_phase"]
+        self.shaping = ShapingReward(self.phase)
+        self.reward_diagnostics = config.get("reward_diagnostics", True)
+        self.terminal_rewards = get_terminal_rewards(
+            self.phase, config.get("terminal_rewards")
+        )
+        self.delta_time_seconds = 1 / control_hz
+        self.max_steps = max_steps
+
+        self.game = Game(-1)
+        self.termination = TerminationEvaluator()
+        self.level_cache = LevelCache()
+        self.rng = random.Random()
+        self.level = None
+        self.player = None
+
+        self.state_dim = STATE_SIZE
+        if gymnasium is not None:
+            self.action_space = spaces.Discrete(config["action_dim"])
+            self.observation_space = spaces.Box(
+                -np.inf, np.inf, (self.state_dim,), dtype=np.float32
+            )
+
+    # Start a new episode on a level chosen from the config's seeds, with the
+    # rocket's initial conditions randomized within the config's ranges. With
+    # Gymnasium the seed also seeds the env's np_random
+    def reset(self, seed=None, options=None):
+        if gymnasium is not None:
+            super().reset(seed=seed)
+        if seed is not None:
+            self.rng.seed(seed)
+
+        self.level = get_level(self.config, self.level_cache, self.rng)
+        if self.player is None:
+            self.player = Rocket(self.level.get_rocket_start_loc())
+        else:
+            self.player.reset(self.level.get_rocket_start_loc())
+        modify_starting_state(self.config, self.player, cfg.LEVEL_WIDTH, self.rng)
+
+        # Initialize previous state (velocity x, velocity y, angle)
+        self.prev_state = [None, None, 0, 0, 90, 0]
+        self.steps = 0
+
+        self.state_vector = get_state(self.game, self.player, self.level)
+        info = {"level_seed": self.level.get_seed()}
+        return np.asarray(self.state_vector, dtype=np.float32), info
+
+    # Apply an action for one control step, returning the next observation, the
+    # shaping plus terminal reward, whether a terminal event happened, whether
+    # max_steps was reached, and details of the step
+    def step(self, action):
+        state_vector = self.state_vector
+        curr_y = state_vector[1]
+        curr_dx = state_vector[8]
+        curr_dy = state_vector[9]
+        vel_x, vel_y = self.player.get_velocity()
+        angle = self.player.get_angle()
+        terrain_x = get_terrain_x(self.player)
+        terrain_peak = self.level.get_terrain_peak(terrain_x) / self.level.get_height()
+
+        # If first step, need to assign previous delta positions values
+        if self.prev_state[0] == None and self.prev_state[1] == None:
+            self.prev_state[0] = curr_dx
+            self.prev_state[1] = curr_dy
+
+        action = int(action)
+        self.player.apply_ai_action(action)
+        self.player.update_state(self.delta_time_seconds)
+        self.steps += 1
+
+        # Calculate minor shaping rewards, with their breakdown if diagnostics are on
+        reward_inputs = get_reward_inputs(
+            self.player, curr_y, curr_dx, curr_dy, terrain_peak
+        )
+        shaping_rewards = None
+        if self.reward_diagnostics:
+            shaping_rewards = self.shaping.components(reward_inputs)
+            reward = shaping_rewards["r_total"]
+        else:
+            reward = self.shaping(reward_inputs)
+
+        # Update previous state
+        self.prev_state = [curr_dx, curr_dy, vel_x, vel_y, angle, action]
+
+        # Check terminal events
+        outcome, _ = self.termination.evaluate(self.level, self.player)
+        terminated = outcome != Outcome.NONE
+        event_description = OUTCOME_DESCRIPTIONS[outcome]
+        if terminated:
+            terminal_award = self.terminal_rewards[event_description]
+        else:
+            terminal_award = 0
+        if outcome == Outcome.PAD_CONTACT:
+            # Partial awards for being closer to successful landing
+            vx_score = smooth_terminal_reward(vel_x, cfg.LANDING_VELOCITY)
+            vy_score = smooth_terminal_reward(vel_y, cfg.LANDING_VELOCITY)
+            ang_score = smooth_terminal_reward(
+                self.player.angle_deviation_from_upright(), cfg.LANDING_MAX_ANGLE - 90
+            )
+            terminal_award += self.terminal_rewards["partial"] * (
+                vx_score + vy_score + ang_score
+            )
+        reward += terminal_award
+
+        truncated = (
+            not terminated
+            and self.max_steps is not None
+            and self.steps >= self.max_steps
+        )
+
+        self.state_vector = get_state(self.game, self.player, self.level)
+        info = {
+            "outcome": outcome,
+            "event_description": event_description,
+            "shaping_rewards": shaping_rewards,
+            "terminal_award": terminal_award,
+            "terrain_ref": (self.level, terrain_x, get_terrain_x(self.player)),
+        }
+        return (
+            np.asarray(self.state_vector, dtype=np.float32),
+            reward,
+            terminated,
+            truncated,
+            info,
+        )
+
+    def close(self):
+        self.level_cache.close()
+
+
+# Steps several LanderEnvs together in this process, returning stacked arrays.
+# An environment whose episode ends is reset straight away and returns its reset
+# info, with the finished episode's final observation and step info kept under
+# "final_observation" and "final_info"
+class SyncVectorLanderEnv:
+    def __init__(self, config, num_envs, control_hz=cfg.MODEL_HZ, max_steps=None):
+        self.num_envs = num_envs
+        self.envs = [
+            LanderEnv(config, control_hz, max_steps) for _ in range(num_envs)
+        ]
+
+    # Environment i is seeded with seed + i if a seed is given
+    def reset(self, seed=None, options=None):
+        observations = []
+        infos = []
+        for i, env in enumerate(self.envs):
+            obs, info = env.reset(None if seed is None else seed + i, options)
+            observations.append(obs)
+            infos.append(info)
+        return np.stack(observations), infos
+
+    def step(self, actions):
+        observations = []
+        rewards = np.zeros(self.num_envs)
+        terminated = np.zeros(self.num_envs, dtype=bool)
+        truncated = np.zeros(self.num_envs, dtype=bool)
+        infos = []
+        for i, (env, action) in enumerate(zip(self.envs, actions)):
+            obs, rewards[i], terminated[i], truncated[i], info = env.step(action)
+            if terminated[i] or truncated[i]:
+                final_obs, final_info = obs, info
+                obs, info = env.reset()
+                info["final_observation"] = final_obs
+                info["final_info"] = final_info
+            observations.append(obs)
+            infos.append(info)
+        return np.stack(observations), rewards, terminated, truncated, infos
+
+    def close(self):
+        for env in self.envs:
+            env.close()
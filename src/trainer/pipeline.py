@@ -0,0 +1,199 @@
+from trainer.train_loop import train_loop
+from trainer.actor_learner import train_actor_learner
+from plot.train_plots import plot_results
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import multiprocessing as mp
+import numpy as np
+import os
+import random
+import sys
+import torch
+import matplotlib.pyplot as plt
+
+# Config keys holding files a config produces, and the keys of other configs that
+# consume them. A config depends on every config producing a file it consumes
+OUTPUT_INPUT_KEYS = [
+    ("save_path", "checkpoint_path"),
+    ("buffer_path", "warm_start_buffer_path"),
+]
+
+
+# Copy of the configs with one replica of each per seed. Each replica gets a
+# "seed" key and suffixed output paths, and inputs that another config produces
+# are suffixed the same way so each replica chain only depends on itself
+def expand_replicas(configs, seeds):
+    produced = {
+        config.get(output_key)
+        for config in configs
+        for output_key, _ in OUTPUT_INPUT_KEYS
+    }
+    produced.discard(None)
+
+    def suffix(path, seed):
+        if path is None:
+            return None
+        root, ext = os.path.splitext(path)
+        if ext != ".pth":
+            root, ext = path, ""
+        return f"{root}_seed_{seed}{ext}"
+
+    replicas = []
+    for seed in seeds:
+        for config in configs:
+            replica = dict(config, seed=seed)
+            for output_key, input_key in OUTPUT_INPUT_KEYS:
+                replica[output_key] = suffix(config.get(output_key), seed)
+                if config.get(input_key) in produced:
+                    replica[input_key] = suffix(config[input_key], seed)
+            replica["csv_plot_path"] = suffix(config["csv_plot_path"], seed)
+            replicas.append(replica)
+    return replicas
+
+
+# Indices of the configs each config depends on
+def config_dependencies(configs):
+    producers = {}
+    for i, config in enumerate(configs):
+        for output_key, _ in OUTPUT_INPUT_KEYS:
+            if config.get(output_key) is not None:
+                producers[config[output_key]] = i
+
+    dependencies = []
+    for config in configs:
+        dependencies.append(
+            {
+                producers[config[input_key]]
+                for _, input_key in OUTPUT_INPUT_KEYS
+                if config.get(input_key) in producers
+            }
+        )
+    return dependencies
+
+
+# Train if not already run, and if either no prerequisite checkpoint or existing prerequisite
+def needs_training(config):
+    return not os.path.isfile(config["save_path"]) and (
+        config["checkpoint_path"] is None or os.path.isfile(config["checkpoint_path"])
+    )
+
+
+def needs_report(config):
+    return os.path.isfile(config["csv_plot_path"] + ".csv") and not os.path.isfile(
+        config["csv_plot_path"] + ".pdf"
+    )
+
+
+# Send stdout and stderr of this process, and of any processes it starts, to a
+# log file. Only for pool workers, as it is not undone
+def redirect_output(log_path):
+    log = open(log_path, "a")
+    os.dup2(log.fileno(), sys.stdout.fileno())
+    os.dup2(log.fileno(), sys.stderr.fileno())
+    sys.stdout.reconfigure(line_buffering=True)
+    sys.stderr.reconfigure(line_buffering=True)
+
+
+# Seed every random number generator training draws from
+def set_seed(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+# Runs one training or report job in a pool worker, logging to the job's log file
+def run_job(kind, config, log_path, num_threads):
+    redirect_output(log_path)
+    plt.switch_backend("Agg")
+    torch.set_num_threads(num_threads)
+
+    if kind == "report":
+        plot_results(config["csv_plot_path"])
+        return
+
+    if "seed" in config:
+        set_seed(config["seed"])
+
+    # Configs with "num_actors" train with parallel actor processes
+    if config.get("num_actors", 0) > 0:
+        train_actor_learner(config)
+    else:
+        train_loop(config)
+
+
+# Runs the training phase configs as a dependency graph on a process pool of at
+# most max_workers jobs. A config starts as soon as the configs producing its
+# checkpoint and warm start buffer have finished, and each report is generated
+# while later phases train. With seeds, every config is run once per seed.
+# Per-job logs are written to log_dir
+def run_pipeline(configs, max_workers=None, seeds=None, log_dir="logs"):
+    if seeds is not None:
+        configs = expand_replicas(configs, seeds)
+    dependencies = config_dependencies(configs)
+    if max_workers is None:
+        max_workers = os.cpu_count()
+    num_threads = max(1, os.cpu_count() // max_workers)
+    os.makedirs(log_dir, exist_ok=True)
+
+    waiting = set(range(len(configs)))
+    finished = set()
+    failed = set()
+    running = {}
+
+    # Fresh spawned worker per job, so jobs can start their own processes and
+    # nothing carries over between jobs
+    with ProcessPoolExecutor(
+        max_workers, mp_context=mp.get_context("spawn"), max_tasks_per_child=1
+    ) as pool:
+
+        def submit(kind, i):
+            name = os.path.basename(configs[i]["csv_plot_path"])
+            log_path = os.path.join(log_dir, f"{name}_{kind}.log")
+            print(f"Starting {kind} for {name}, logging to {log_path}")
+            future = pool.submit(run_job, kind, configs[i], log_path, num_threads)
+            running[future] = (kind, i)
+
+        def finish(i):
+            finished.add(i)
+            if needs_report(configs[i]):
+                submit("report", i)
+
+        while waiting or running:
+            # Start every config whose dependencies are resolved, repeating as
+            # skipped configs resolve others
+            progress = True
+            while progress:
+                progress = False
+                for i in sorted(waiting):
+                    if dependencies[i] & failed:
+                        name = configs[i]["save_path"]
+                        print(f"Skipping {name}, a prerequisite failed")
+                        failed.add(i)
+                    elif dependencies[i] <= finished:
+                        if needs_training(configs[i]):
+                            submit("train", i)
+                        else:
+                            finish(i)
+                    else:
+                        continue
+                    waiting.remove(i)
+                    progress = True
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, i = running.pop(future)
+                name = os.path.basename(configs[i]["csv_plot_path"])
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"{kind} for {name} failed: {e!r}")
+                    if kind == "train":
+                        failed.add(i)
+                    continue
+                print(f"Finished {kind} for {name}")
+                if kind == "train":
+                    finish(i)
+
+    return not failed
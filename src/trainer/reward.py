@@ -1,6 +1,10 @@
 import game.constants as cfg
+from collections import namedtuple
+import numpy as np
 
 
+# Reference shaping rewards, built component by component. The training loops use
+# the equivalent ShapingReward, which check_shaping_parity compares against this
 def calc_shaping_rewards(
     reward_phase, player, curr_y, curr_dx, curr_dy, prev_state, terrain_slice
 ):
@@ -50,6 +54,35 @@ def calc_shaping_rewards(
     return reward
 
 
+# Terminal reward amounts, keyed by episode outcome, with any amounts given in
+# overrides replacing the phase defaults
+def get_terminal_rewards(reward_phase, overrides=None):
+    if reward_phase in ("phase1", "phase2", "phase3"):
+        rewards = {
+            "partial": 0,
+            "landing": 200,
+            "escaped": -600,
+            "flipped": -400,
+            "collision": -175,
+            "pad contact": 200,
+        }
+    elif reward_phase == "phase4":
+        rewards = {
+            "partial": 100,
+            "landing": 600,
+            "escaped": -600,
+            "flipped": -500,
+            "collision": -300,
+            "pad contact": 0,
+        }
+    else:
+        raise ValueError(f"Unknown shaping mode: {reward_phase}")
+
+    if overrides is not None:
+        rewards.update(overrides)
+    return rewards
+
+
 # Time penalty
 def r_time(scale=-0.02):
     return scale
@@ -156,3 +189,504 @@ def smooth_terminal_reward(v, limit):
     # 1 when |v| = 0, 0 when |v| >= limit
     x = abs(v) / limit
     return max(0.0, 1.0 - x)
+
+
+# Values the shaping terms depend on for one step, with terrain the highest
+# normalized terrain of the state terrain window. Scalars for a single rocket,
+# with thrust/torque booleans. For a batch, [N] NumPy arrays or tensors, with
+# thrust/torque as 0/1 floats
+RewardInputs = namedtuple(
+    "RewardInputs",
+    [
+        "vx",
+        "vy",
+        "angle_dev",
+        "curr_y",
+        "curr_dx",
+        "curr_dy",
+        "terrain",
+        "thrust",
+        "torque",
+    ],
+)
+
+
+# terrain_peak is level.get_terrain_peak(x) / level.get_height() for the x the
+# state was built at, or the max of the state terrain slice
+def get_reward_inputs(player, curr_y, curr_dx, curr_dy, terrain_peak):
+    vx, vy = player.get_velocity()
+    return RewardInputs(
+        vx,
+        vy,
+        player.angle_deviation_from_upright(),
+        curr_y,
+        curr_dx,
+        curr_dy,
+        terrain_peak,
+        player.flags.thrust,
+        player.flags.left_torque or player.flags.right_torque,
+    )
+
+
+# Shaping terms of each phase as (component name, term, parameters), in the
+# order calc_shaping_rewards adds them
+SHAPING_SPECS = {
+    "phase1": [
+        ("r_angle", "angle", {"scale": 0.05}),
+        ("r_vertical_position", "vertical_position", {"scale": 0.2}),
+        ("r_horizontal_position", "horizontal_position", {"scale": 0.2}),
+        ("r_terrain", "terrain", {"scale": 0.5}),
+        ("r_vertical_velocity", "vertical_velocity", {"scale": 0.05}),
+        ("r_time", "time", {"scale": -0.05}),
+        ("r_fuel", "fuel", {"thrust_scale": 1.0, "torque_scale": 1.5}),
+    ],
+    "phase2": [
+        ("r_angle", "angle", {"scale": 0.02}),
+        ("r_vertical_position", "vertical_position", {"scale": 0.2}),
+        ("r_horizontal_position", "horizontal_position", {"scale": 0.2}),
+        ("r_terrain", "terrain", {"scale": 0.5}),
+        ("r_vertical_velocity", "vertical_velocity", {"scale": 0.05}),
+        ("r_time", "time", {"scale": -0.05}),
+        ("r_fuel", "fuel", {"thrust_scale": 1.0, "torque_scale": 1.5}),
+        (
+            "r_upright_bonus",
+            "upright_bonus",
+            {"scale": 0.1, "threshold": 0.2, "max_angle": 30},
+        ),
+    ],
+    "phase4": [
+        (
+            "r_landing_vertical",
+            "landing_vertical",
+            {"minfac": 0.3, "maxfac": 0.8, "scale": 5.0},
+        ),
+        ("r_landing_horizontal", "landing_horizontal", {}),
+        ("r_landing_angle", "landing_angle", {}),
+    ],
+}
+SHAPING_SPECS["phase3"] = SHAPING_SPECS["phase2"]
+
+
+# Scalar terms, computing the same values as the r_ functions
+def term_angle(i, scale):
+    return r_angle(i.angle_dev, scale)
+
+
+def term_vertical_position(i, scale):
+    return r_vertical_position(i.curr_dy, scale)
+
+
+def term_horizontal_position(i, scale):
+    return r_horizontal_position(i.curr_dx, scale)
+
+
+# As r_terrain, with the minimum clearance taken from the highest terrain
+def term_terrain(i, scale):
+    if abs(i.curr_dx) <= 0.2:
+        return 0
+    min_clearance = max(1 - i.curr_y - i.terrain, 0)
+    if min_clearance < 0.3:
+        return -scale * (0.3 - min_clearance)
+    return 0
+
+
+def term_vertical_velocity(i, scale):
+    return r_vertical_velocity(i.vy, scale)
+
+
+def term_time(i, scale):
+    return r_time(scale)
+
+
+def term_fuel(i, thrust_scale, torque_scale):
+    reward = 0
+    if i.thrust:
+        reward -= cfg.BURN_RATES_KG_S[0] * thrust_scale
+    if i.torque:
+        reward -= cfg.BURN_RATES_KG_S[1] * torque_scale
+    return reward
+
+
+def term_upright_bonus(i, scale, threshold, max_angle):
+    return r_upright_bonus(i.angle_dev, i.curr_dy, scale, threshold, max_angle)
+
+
+def term_landing_vertical(i, minfac, maxfac, scale):
+    return r_landing_vertical(i.vy, i.curr_dy, minfac, maxfac, scale)
+
+
+def term_landing_horizontal(i):
+    return r_landing_horizontal(i.vx, i.curr_dy)
+
+
+def term_landing_angle(i):
+    return r_landing_angle(i.angle_dev, i.curr_dy)
+
+
+SCALAR_TERMS = {
+    "angle": term_angle,
+    "vertical_position": term_vertical_position,
+    "horizontal_position": term_horizontal_position,
+    "terrain": term_terrain,
+    "vertical_velocity": term_vertical_velocity,
+    "time": term_time,
+    "fuel": term_fuel,
+    "upright_bonus": term_upright_bonus,
+    "landing_vertical": term_landing_vertical,
+    "landing_horizontal": term_landing_horizontal,
+    "landing_angle": term_landing_angle,
+}
+
+
+# Batched terms over [N] rockets, where xp is numpy or torch
+def batch_angle(xp, i, scale):
+    return -scale * i.angle_dev
+
+
+def batch_vertical_position(xp, i, scale):
+    return -scale * xp.abs(i.curr_dy)
+
+
+def batch_horizontal_position(xp, i, scale):
+    return -scale * xp.abs(i.curr_dx)
+
+
+def batch_terrain(xp, i, scale):
+    min_clearance = xp.clip(1 - i.curr_y - i.terrain, 0, None)
+    penalize = (xp.abs(i.curr_dx) > 0.2) & (min_clearance < 0.3)
+    return xp.where(penalize, -scale * (0.3 - min_clearance), 0.0)
+
+
+def batch_vertical_velocity(xp, i, scale, v_safe=cfg.LANDING_VELOCITY):
+    norm = (i.vy + v_safe) / v_safe
+    reward = scale * (1.0 - norm**2)
+    return reward - xp.where(i.vy > 0, scale * (i.vy / v_safe) ** 2, 0.0)
+
+
+def batch_time(xp, i, scale):
+    return scale
+
+
+def batch_fuel(xp, i, thrust_scale, torque_scale):
+    return -cfg.BURN_RATES_KG_S[0] * thrust_scale * i.thrust - (
+        cfg.BURN_RATES_KG_S[1] * torque_scale * i.torque
+    )
+
+
+def batch_upright_bonus(xp, i, scale, threshold, max_angle):
+    uprightness = xp.clip(1.0 - i.angle_dev / max_angle, 0.0, None)
+    return xp.where(i.curr_dy > threshold, 0.0, scale * uprightness)
+
+
+# Strength of the landing terms, growing as the rocket nears the pad
+def batch_landing_factor(xp, i, minfac, maxfac):
+    w = xp.clip(1.0 - xp.clip(i.curr_dy / 0.20, None, 1.0), 0.0, None)
+    return minfac + w * (maxfac - minfac)
+
+
+def batch_landing_vertical(xp, i, minfac, maxfac, scale):
+    factor = batch_landing_factor(xp, i, minfac, maxfac)
+    return factor * batch_vertical_velocity(xp, i, scale)
+
+
+def batch_landing_horizontal(xp, i, minfac=0.3, maxfac=0.8):
+    return -batch_landing_factor(xp, i, minfac, maxfac) * xp.abs(i.vx)
+
+
+def batch_landing_angle(xp, i, minfac=0.3, maxfac=0.8):
+    return -batch_landing_factor(xp, i, minfac, maxfac) * i.angle_dev
+
+
+BATCH_TERMS = {
+    "angle": batch_angle,
+    "vertical_position": batch_vertical_position,
+    "horizontal_position": batch_horizontal_position,
+    "terrain": batch_terrain,
+    "vertical_velocity": batch_vertical_velocity,
+    "time": batch_time,
+    "fuel": batch_fuel,
+    "upright_bonus": batch_upright_bonus,
+    "landing_vertical": batch_landing_vertical,
+    "landing_horizontal": batch_landing_horizontal,
+    "landing_angle": batch_landing_angle,
+}
+
+
+# Shaping reward of one phase, with its terms looked up once. Calling it returns
+# only the total, components() also returns the breakdown for diagnostics, and
+# batch() and batch_components() compute the same for [N] rockets
+class ShapingReward:
+    def __init__(self, reward_phase):
+        if reward_phase not in SHAPING_SPECS:
+            raise ValueError(f"Unknown shaping mode: {reward_phase}")
+        specs = SHAPING_SPECS[reward_phase]
+        self.names = [name for name, _, _ in specs]
+        self.terms = [(SCALAR_TERMS[term], params) for _, term, params in specs]
+        self.batch_terms = [(BATCH_TERMS[term], params) for _, term, params in specs]
+
+    def __call__(self, inputs):
+        total = 0
+        for term, params in self.terms:
+            total += term(inputs, **params)
+        return total
+
+    # Same dict as calc_shaping_rewards
+    def components(self, inputs):
+        reward = {}
+        total = 0
+        for name, (term, params) in zip(self.names, self.terms):
+            reward[name] = term(inputs, **params)
+            total += reward[name]
+        reward["r_total"] = total
+        return reward
+
+    def batch(self, inputs, xp=np):
+        total = 0
+        for term, params in self.batch_terms:
+            total = total + term(xp, inputs, **params)
+        return total
+
+    # Breakdown of batch(), with the same keys as components()
+    def batch_components(self, inputs, xp=np):
+        reward = {}
+        total = 0
+        for name, (term, params) in zip(self.names, self.batch_terms):
+            reward[name] = term(xp, inputs, **params)
+            total = total + reward[name]
+        reward["r_total"] = total
+        return reward
+
+
+# Actions that fire the main thruster and the side thrusters, as in
+# Rocket.apply_ai_action
+THRUST_ACTIONS = (1, 4, 5)
+TORQUE_ACTIONS = (2, 3, 4, 5)
+
+
+# Rewards of stored transitions under a phase's shaping and terminal rewards.
+# The reward inputs are rebuilt from the state vectors as the training loop reads
+# them, so this matches the rewards a phase hands out up to the float32 precision
+# of the states. Which outcome ended an episode is not stored, so every terminal
+# transition is given the terminal reward of outcome
+def relabel_rewards(
+    shaping, terminal_rewards, states, actions, next_states, dones, outcome=None
+):
+    states = np.asarray(states, dtype=np.float64)
+    next_states = np.asarray(next_states, dtype=np.float64)
+    dones = np.asarray(dones) != 0
+    if outcome is None and dones.any():
+        raise ValueError("Terminal transitions need an outcome to be relabelled")
+
+    angle = np.degrees(np.arctan2(next_states[:, 4], next_states[:, 5]))
+    angle_dev = np.abs((angle - 90 + 180) % 360 - 180)
+    inputs = RewardInputs(
+        vx=next_states[:, 2] * cfg.MAX_VEL,
+        vy=next_states[:, 3] * cfg.MAX_VEL,
+        angle_dev=angle_dev,
+        curr_y=states[:, 1],
+        curr_dx=states[:, 8],
+        curr_dy=states[:, 9],
+        terrain=states[:, 10:].max(axis=1, initial=0.0),
+        thrust=np.isin(actions, THRUST_ACTIONS).astype(np.float64),
+        torque=np.isin(actions, TORQUE_ACTIONS).astype(np.float64),
+    )
+    rewards = shaping.batch(inputs, np)
+    if outcome is None:
+        return rewards
+
+    # Partial awards for pad contact from the velocity before the step
+    terminal_award = np.full(len(states), float(terminal_rewards[outcome]))
+    if outcome == "pad contact":
+        prev_vx = states[:, 2] * cfg.MAX_VEL
+        prev_vy = states[:, 3] * cfg.MAX_VEL
+        vx_score = np.maximum(1.0 - np.abs(prev_vx) / cfg.LANDING_VELOCITY, 0.0)
+        vy_score = np.maximum(1.0 - np.abs(prev_vy) / cfg.LANDING_VELOCITY, 0.0)
+        ang_score = np.maximum(1.0 - angle_dev / (cfg.LANDING_MAX_ANGLE - 90), 0.0)
+        terminal_award += terminal_rewards["partial"] * (
+            vx_score + vy_score + ang_score
+        )
+    return np.where(dones, rewards + terminal_award, rewards)
+
+
+# Compare compiled shaping rewards against calc_shaping_rewards for every phase
+# over random rocket states, in scalar and batched form, and time both
+def check_shaping_parity(samples=2000, seed=0):
+    import time
+    import torch
+    from game.rocket import Rocket
+
+    rng = np.random.default_rng(seed)
+    prev_state = [0, 0, 0, 0, 90, 0]
+    for phase in ("phase1", "phase2", "phase3", "phase4"):
+        shaping = ShapingReward(phase)
+        cases = []
+        for _ in range(samples):
+            player = Rocket([300.0, 300.0])
+            player.set_velocity(*rng.uniform(-40, 40, 2))
+            player.set_angle(rng.uniform(0, 360))
+            player.apply_ai_action(int(rng.integers(0, 6)))
+            curr_y = rng.uniform(0, 1)
+            curr_dx = rng.uniform(-1, 1)
+            curr_dy = rng.uniform(-0.2, 1)
+            terrain_slice = list(rng.uniform(0, 0.8, 2 * cfg.TERRAIN_WINDOW))
+            cases.append((player, curr_y, curr_dx, curr_dy, terrain_slice))
+
+        start = time.perf_counter()
+        expected = [
+            calc_shaping_rewards(phase, p, y, dx, dy, prev_state, t)
+            for p, y, dx, dy, t in cases
+        ]
+        reference_seconds = time.perf_counter() - start
+
+        # Compiled rewards take the highest terrain, as looked up from the level
+        peak_cases = [(p, y, dx, dy, max(t)) for p, y, dx, dy, t in cases]
+        start = time.perf_counter()
+        totals = [shaping(get_reward_inputs(*case)) for case in peak_cases]
+        compiled_seconds = time.perf_counter() - start
+
+        inputs = [get_reward_inputs(*case) for case in peak_cases]
+
+        components = [shaping.components(i) for i in inputs]
+        assert components == expected, f"{phase} components differ"
+        assert totals == [e["r_total"] for e in expected], f"{phase} totals differ"
+
+        # Batched inputs
+        arrays = [np.asarray(column, dtype=np.float64) for column in zip(*inputs)]
+        batch = RewardInputs(*arrays)
+        expected_totals = np.array([e["r_total"] for e in expected])
+        assert np.allclose(shaping.batch(batch), expected_totals), phase
+        tensors = RewardInputs(*(torch.from_numpy(a) for a in arrays))
+        batch_totals = shaping.batch(tensors, torch).numpy()
+        assert np.allclose(batch_totals, expected_totals), phase
+
+        print(
+            f"{phase}: parity ok, calc_shaping_rewards "
+            f"{1e6 * reference_seconds / samples:.2f} us, compiled total "
+            f"{1e6 * compiled_seconds / samples:.2f} us"
+        )
+
+
+# Compare Level.get_terrain_peak against the highest point of the state terrain
+# slice at every x across generated levels, and time the lookup against the
+# minimum clearance generator expression of r_terrain
+def check_terrain_peaks(num_levels=10, curr_y=0.5):
+    import time
+    from game.level import Level
+
+    window = cfg.TERRAIN_WINDOW
+    slice_seconds = 0
+    peak_seconds = 0
+    count = 0
+    for seed in range(num_levels):
+        level = Level(None, seed=seed)
+        terrain = level.get_terrain()
+        height = level.get_height()
+        # Every window from empty on the left to empty on the right. Rockets
+        # further out have escaped, and the slice end would wrap around
+        xs = range(-window, len(terrain) + window + 1)
+        slices = []
+        for x in xs:
+            left = max(0, x - window)
+            right = min(len(terrain), x + window)
+            terrain_slice = [h / height for h in terrain[left:right]]
+            slices.append(terrain_slice + [0] * (2 * window - len(terrain_slice)))
+        peaks = [level.get_terrain_peak(x) / height for x in xs]
+        assert peaks == [max(t) for t in slices], f"level {seed} peaks differ"
+
+        start = time.perf_counter()
+        expected = [min(1 - curr_y - h for h in t) for t in slices]
+        slice_seconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        clearances = [1 - curr_y - level.get_terrain_peak(x) / height for x in xs]
+        peak_seconds += time.perf_counter() - start
+
+        assert clearances == expected, f"level {seed} clearances differ"
+        count += len(xs)
+
+    print(
+        f"terrain peaks: parity ok, slice clearance "
+        f"{1e6 * slice_seconds / count:.2f} us, peak lookup "
+        f"{1e6 * peak_seconds / count:.2f} us"
+    )
+
+
+# Collect transitions from every training phase with random actions, holding
+# left torque in a quarter of the environments so rockets also flip, and relabel
+# them for every phase. Replaying the same seeds and actions under the other
+# phase gives the same transitions, so its rewards are the reference. Episodes
+# cut short by max_steps are stored as non-terminal, as they never end in
+# train_loop
+def check_relabel_rewards(num_envs=16, steps=300, seed=0):
+    from pytorch_trainer import configs
+    from trainer.lander_env import SyncVectorLanderEnv
+
+    def run(config, actions):
+        env = SyncVectorLanderEnv(config, num_envs, max_steps=150)
+        obs, _ = env.reset(seed=seed)
+        transitions = []
+        for step_actions in actions:
+            next_obs, rewards, terminated, _, infos = env.step(step_actions)
+            for i, info in enumerate(infos):
+                final_info = info.get("final_info")
+                transitions.append(
+                    (
+                        obs[i],
+                        step_actions[i],
+                        rewards[i],
+                        info.get("final_observation", next_obs[i]),
+                        terminated[i],
+                        None if final_info is None else final_info["event_description"],
+                    )
+                )
+            obs = next_obs
+        env.close()
+        return transitions
+
+    rng = np.random.default_rng(seed)
+    for config in configs:
+        actions = rng.integers(0, config["action_dim"], (steps, num_envs))
+        actions[:, : num_envs // 4] = 2
+        source = run(config, actions)
+        states, actions_taken, _, next_states, dones, outcomes = map(
+            np.array, zip(*source)
+        )
+        for phase in SHAPING_SPECS:
+            target = run(dict(config, reward_phase=phase), actions)
+            assert all(
+                np.array_equal(a[0], b[0]) and np.array_equal(a[3], b[3])
+                for a, b in zip(source, target)
+            ), f"{config['reward_phase']} to {phase} transitions differ"
+            expected = np.array([t[2] for t in target])
+
+            shaping = ShapingReward(phase)
+            terminal_rewards = get_terminal_rewards(
+                phase, config.get("terminal_rewards")
+            )
+            rewards = np.zeros(len(source))
+            for outcome in set(outcomes.tolist()):
+                rows = outcomes == outcome
+                if outcome is None:
+                    rows &= ~dones
+                rewards[rows] = relabel_rewards(
+                    shaping,
+                    terminal_rewards,
+                    states[rows],
+                    actions_taken[rows],
+                    next_states[rows],
+                    dones[rows],
+                    outcome if dones[rows].any() else None,
+                )
+            error = np.abs(rewards - expected).max()
+            assert error < 1e-3, f"{config['reward_phase']} to {phase}: {error}"
+            print(
+                f"{config['reward_phase']} to {phase}: relabel ok over "
+                f"{len(source)} transitions, {dones.sum()} terminal, "
+                f"max error {error:.1e}"
+            )
+
+
+if __name__ == "__main__":
+    check_shaping_parity()
+    check_terrain_peaks()
+    check_relabel_rewards()
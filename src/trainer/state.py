@@ -3,6 +3,15 @@ from game.level import Level
 from game.rocket import Rocket
 from game import constants as cfg
 from math import cos, sin, radians
+from weakref import WeakKeyDictionary
+import numpy as np
+import torch
+
+# Length of a state vector, 10 kinematic features followed by the terrain window
+STATE_SIZE = 10 + 2 * cfg.TERRAIN_WINDOW
+
+# Normalized, zero padded float32 terrain per level, built on first use
+padded_terrain = WeakKeyDictionary()
 
 
 def get_state(game: Game, player: Rocket, level: Level):
@@ -32,7 +41,7 @@ def get_state(game: Game, player: Rocket, level: Level):
 
     # Terrain slice
     terrain = level.get_terrain()
-    x = int(pos_x)
+    x = get_terrain_x(player)
     window = cfg.TERRAIN_WINDOW
     left = max(0, x - window)
     right = min(len(terrain), x + window)
@@ -48,3 +57,131 @@ def get_state(game: Game, player: Rocket, level: Level):
     # Collect into returned state
     state = [nx, ny, nvx, nvy, sin_a, cos_a, nomega, nfuel, dx, dy, *terrain_slice]
     return state
+
+
+# Integer x position the terrain slice of the state is centred on, which
+# together with the level fully determines the slice
+def get_terrain_x(player: Rocket):
+    return int(player.get_pos()[0])
+
+
+# Terrain heights of a level divided by its height and followed by a full window
+# of zeros, so any window starting inside the level is a slice
+def get_padded_terrain(level: Level, window=cfg.TERRAIN_WINDOW):
+    terrain = padded_terrain.get(level)
+    if terrain is None:
+        heights = np.asarray(level.get_terrain(), dtype=np.float64)
+        terrain = np.zeros(len(heights) + 2 * window)
+        terrain[: len(heights)] = heights / level.get_height()
+        padded_terrain[level] = terrain
+    return terrain
+
+
+# Write the states of the rockets of a RocketBatch into the rows of out, an
+# array or CPU tensor of [N, STATE_SIZE], building the same values as get_state
+# for all of them at once. terrain holds the padded terrain of each rocket's
+# level, and pad_x and pad_y its pad location. If rows is given, only those
+# rockets and rows are written
+def write_states(rockets, terrain, pad_x, pad_y, width, height, out, rows=None):
+    if isinstance(out, torch.Tensor):
+        out = out.numpy()
+    if rows is None:
+        rows = np.arange(len(out))
+
+    # Rocket
+    pos_x = rockets.pos[rows, 0]
+    pos_y = rockets.pos[rows, 1]
+    angle = np.radians(rockets.angle[rows])
+
+    # Normalized kinematics and pad relative position, as in get_state
+    pad_y_down = height - pad_y[rows]
+    rocket_bottom = pos_y + cfg.ROCKET_RENDER_WIDTH / 2
+    out[rows, 0] = pos_x / width
+    out[rows, 1] = pos_y / height
+    out[rows, 2] = rockets.velocity[rows, 0] / cfg.MAX_VEL
+    out[rows, 3] = rockets.velocity[rows, 1] / cfg.MAX_VEL
+    out[rows, 4] = np.sin(angle)
+    out[rows, 5] = np.cos(angle)
+    out[rows, 6] = rockets.omega[rows] / cfg.MAX_OMEGA
+    out[rows, 7] = rockets.mass_fuel[rows] / cfg.MASS_FUEL_KG
+    out[rows, 8] = (pos_x - pad_x[rows]) / width
+    out[rows, 9] = (pad_y_down - rocket_bottom) / pad_y_down
+
+    # Terrain windows, left aligned from the clipped start like get_state, so
+    # columns past the clipped end are zero
+    window = cfg.TERRAIN_WINDOW
+    x = np.trunc(pos_x).astype(np.int64)
+    left = np.minimum(np.maximum(x - window, 0), width)
+    columns = left[:, None] + np.arange(2 * window)
+    heights = terrain[rows[:, None], columns]
+    out[rows, 10:] = np.where(columns < (x + window)[:, None], heights, 0.0)
+
+
+# Write the states of rockets on random levels, from positions all around and
+# outside the level short of where get_state's slice would wrap around, into a
+# float32 tensor and a float64 array with write_states and compare them with
+# get_state. Times both
+def check_write_state(num_levels=8, num_rockets=512, seed=0):
+    import random
+    import time
+    from game.rocket_batch import RocketBatch
+
+    rng = random.Random(seed)
+    game = Game(-1)
+    window = cfg.TERRAIN_WINDOW
+    levels = [Level(None, seed=level_seed) for level_seed in range(num_levels)]
+    width = levels[0].get_width()
+    height = levels[0].get_height()
+
+    players = []
+    rocket_levels = []
+    for _ in range(num_rockets):
+        level = rng.choice(levels)
+        player = Rocket(level.get_rocket_start_loc())
+        player.pos = [
+            rng.uniform(-window, width + 2 * window),
+            rng.uniform(0, height),
+        ]
+        player.set_velocity(rng.uniform(-20, 20), rng.uniform(-20, 20))
+        player.set_angle(rng.uniform(0, 360))
+        player.set_omega(rng.uniform(-5, 5))
+        players.append(player)
+        rocket_levels.append(level)
+
+    rockets = RocketBatch.from_rockets(players)
+    terrain = np.stack([get_padded_terrain(level) for level in rocket_levels])
+    pad_x, pad_y = np.array(
+        [level.get_pad_data()[0] for level in rocket_levels], dtype=np.float64
+    ).T
+
+    start = time.perf_counter()
+    states = [
+        get_state(game, player, level) for player, level in zip(players, rocket_levels)
+    ]
+    list_seconds = time.perf_counter() - start
+    expected = torch.tensor(states, dtype=torch.float32)
+
+    out = torch.empty(num_rockets, STATE_SIZE)
+    start = time.perf_counter()
+    write_states(rockets, terrain, pad_x, pad_y, width, height, out)
+    batch_seconds = time.perf_counter() - start
+    assert torch.equal(out, expected), "float32 states differ"
+
+    out = np.empty((num_rockets, STATE_SIZE))
+    write_states(rockets, terrain, pad_x, pad_y, width, height, out)
+    assert np.array_equal(out, np.array(states)), "float64 states differ"
+
+    # A single row leaves the others untouched
+    out[:] = -1
+    write_states(rockets, terrain, pad_x, pad_y, width, height, out, np.array([3]))
+    assert np.array_equal(out[3], states[3]) and (out[4] == -1).all(), "row differs"
+
+    print(
+        f"write_states: parity ok over {num_rockets} rockets, get_state "
+        f"{1e6 * list_seconds / num_rockets:.2f} us, write_states "
+        f"{1e6 * batch_seconds / num_rockets:.2f} us per state"
+    )
+
+
+if __name__ == "__main__":
+    check_write_state()
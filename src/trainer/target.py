@@ -0,0 +1,53 @@
+import time
+import torch
+
+
+# Updates target network weights in place from the online network. tau of 1
+# copies the weights outright (hard update), while a smaller tau moves each
+# weight a fraction tau of the way towards the online weights (soft update)
+class TargetUpdater:
+    def __init__(self, target_model, model, tau=1.0):
+        if not 0 < tau <= 1:
+            raise ValueError(f"tau must be in (0, 1], got {tau}")
+        self.tau = tau
+
+        # Matching lists of tensors, gathered once so each update is a single
+        # fused call over every parameter and buffer
+        self.target_tensors = [
+            *target_model.parameters(),
+            *target_model.buffers(),
+        ]
+        self.source_tensors = [*model.parameters(), *model.buffers()]
+
+    @torch.no_grad()
+    def update(self):
+        if self.tau == 1:
+            torch._foreach_copy_(self.target_tensors, self.source_tensors)
+        else:
+            torch._foreach_lerp_(self.target_tensors, self.source_tensors, self.tau)
+
+
+# Time in-place target updates against copying through load_state_dict,
+# printing the average microseconds per update for each
+def benchmark_target_update(state_dim=130, action_dim=4, iterations=2000):
+    from trainer.model import LanderNet
+
+    model = LanderNet(state_dim, action_dim)
+    target_model = LanderNet(state_dim, action_dim)
+
+    timings = {
+        "load_state_dict": lambda: target_model.load_state_dict(model.state_dict()),
+        "hard (foreach copy)": TargetUpdater(target_model, model).update,
+        "soft (foreach lerp)": TargetUpdater(target_model, model, tau=0.005).update,
+    }
+    for name, update in timings.items():
+        update()
+        start = time.perf_counter()
+        for _ in range(iterations):
+            update()
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {1e6 * elapsed / iterations:.1f} us per update")
+
+
+if __name__ == "__main__":
+    benchmark_target_update()
@@ -1,44 +1,120 @@
+from trainer.buffer import PrioritizedReplayBuffer
+from trainer.target import TargetUpdater
 import torch.nn as nn
 import torch
 
 
-def train_step(model, target_model, buffer, device, gamma=0.99, batch_size=64):
-    # Skip training this step if not enough samples in replay buffer
-    if len(buffer) < batch_size:
-        return
+# Owns the online and target networks together with a single Adam optimizer and
+# loss, so optimizer moment estimates persist across training steps
+class Learner:
+    def __init__(
+        self,
+        model,
+        target_model,
+        device,
+        gamma=0.99,
+        lr=1e-3,
+        grad_steps=1,
+        tau=1.0,
+    ):
+        self.model = model
+        self.target_model = target_model
+        self.device = device
+        self.gamma = gamma
+        self.grad_steps = grad_steps
 
-    # Create Adam optimizer for updating model's parameters
-    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
-    # Mean Squared Error loss for comparing predicted Q-values to target Q-values
-    loss_fn = nn.MSELoss()
+        # In-place hard (tau of 1) or soft target network updates
+        self.target_updater = TargetUpdater(target_model, model, tau)
 
-    # Sample a batch of transitions from the replay buffer
-    states, actions, rewards, next_states, dones = buffer.sample(batch_size)
+        # Adam optimizer for updating model's parameters
+        self.optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+        # Mean Squared Error loss for comparing predicted Q-values to target Q-values
+        self.loss_fn = nn.MSELoss()
 
-    # Move all tensors to chosen device
-    states = states.to(device)
-    actions = actions.to(device)
-    rewards = rewards.to(device)
-    next_states = next_states.to(device)
-    dones = dones.to(device)
+    # Run grad_steps batched updates from the buffer, returning the loss of each
+    # batch and the TD error of each sampled transition as device tensors. Returns
+    # None if the buffer does not yet hold a full batch
+    def step(self, buffer, batch_size=64):
+        # Skip training this step if not enough samples in replay buffer
+        if len(buffer) < batch_size:
+            return None
 
-    # Forward pass: compute Q-values for all actions in the current states
-    q_values = model(states)
+        losses = []
+        td_errors = []
+        for _ in range(self.grad_steps):
+            loss, td_error = self.update(buffer, batch_size)
+            losses.append(loss)
+            td_errors.append(td_error)
 
-    # Compute Q-values for next states using the target network
-    # Note that .max(dim=1)[0] extracts the maximum Q-value per row (per next state)
-    next_q_values = target_model(next_states).max(dim=1)[0]
+        return torch.stack(losses), torch.stack(td_errors)
 
-    # Compute the Bellman target:
-    target = rewards + gamma * next_q_values * (1 - dones)
+    # Single gradient step on one sampled batch
+    def update(self, buffer, batch_size):
+        # Sample a batch of transitions from the replay buffer, along with buffer
+        # indices and importance-sampling weights if the buffer is prioritized
+        prioritized = isinstance(buffer, PrioritizedReplayBuffer)
+        if prioritized:
+            states, actions, rewards, next_states, dones, indices, weights = (
+                buffer.sample(batch_size)
+            )
+            weights = weights.to(self.device, non_blocking=True)
+        else:
+            states, actions, rewards, next_states, dones = buffer.sample(batch_size)
 
-    # Select the Q-value corresponding to the action actually taken
-    q_selected = q_values.gather(1, actions.unsqueeze(1)).squeeze()
+        # Move all tensors to chosen device
+        states = states.to(self.device, non_blocking=True)
+        actions = actions.to(self.device, non_blocking=True)
+        rewards = rewards.to(self.device, non_blocking=True)
+        next_states = next_states.to(self.device, non_blocking=True)
+        dones = dones.to(self.device, non_blocking=True)
 
-    # Compute loss between predicted Q-values and target Q-values
-    loss = loss_fn(q_selected, target.detach())
+        # Forward pass: compute Q-values for all actions in the current states
+        q_values = self.model(states)
 
-    # Clear old gradients, backpropagate to compute new gradients, and update model parameters
-    optimizer.zero_grad()
-    loss.backward()
-    optimizer.step()
+        # Compute Q-values for next states using the target network
+        # Note that .max(dim=1)[0] extracts the maximum Q-value per row (per next state)
+        with torch.no_grad():
+            next_q_values = self.target_model(next_states).max(dim=1)[0]
+
+        # Compute the Bellman target:
+        target = rewards + self.gamma * next_q_values * (1 - dones)
+
+        # Select the Q-value corresponding to the action actually taken
+        q_selected = q_values.gather(1, actions.unsqueeze(1)).squeeze(1)
+
+        # Compute loss between predicted Q-values and target Q-values, scaling each
+        # squared error by its importance-sampling weight for prioritized replay
+        td_error = target - q_selected
+        if prioritized:
+            loss = (weights * td_error.pow(2)).mean()
+        else:
+            loss = self.loss_fn(q_selected, target)
+
+        # Clear old gradients, backpropagate to compute new gradients, and update model parameters
+        self.optimizer.zero_grad()
+        loss.backward()
+        self.optimizer.step()
+
+        # Refresh priorities of the sampled transitions from their TD errors,
+        # which needs them on the host
+        td_error = td_error.detach().abs()
+        if prioritized:
+            buffer.update_priorities(indices, td_error.cpu().numpy())
+
+        return loss.detach(), td_error
+
+    # Move target network weights towards the online network
+    def update_target(self):
+        self.target_updater.update()
+
+    def state_dict(self):
+        return {
+            "model": self.model.state_dict(),
+            "target_model": self.target_model.state_dict(),
+            "optimizer": self.optimizer.state_dict(),
+        }
+
+    def load_state_dict(self, state_dict):
+        self.model.load_state_dict(state_dict["model"])
+        self.target_model.load_state_dict(state_dict["target_model"])
+        self.optimizer.load_state_dict(state_dict["optimizer"])
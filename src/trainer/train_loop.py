@@ -1,73 +1,85 @@
 from game import constants as cfg
-from game.game import Game
-from game.level import Level
+from game.level_cache import LevelCache
 from game.rocket import Rocket
-from trainer.state import get_state
-from trainer.action import select_action
-from trainer.buffer import ReplayBuffer
+from trainer.state import STATE_SIZE
+from trainer.action import select_actions
+from trainer.batch_env import BatchLanderEnv
 from trainer.model import LanderNet
-from trainer.reward import calc_shaping_rewards, smooth_terminal_reward
-from trainer.train import train_step
+from trainer.train import Learner
 from trainer.utils import (
     get_epsilon,
     print_episode,
     print_csv_summary,
     export_checkpoint,
+    get_plot_path,
     get_success_buffer_rate,
     evaluate_policy,
-    modify_starting_state,
+    init_replay_buffers,
 )
 from trainer.episode_info import (
     init_episode_info,
     episode_action_count,
     episode_cumulative_shaping,
     episode_min_max_avg,
+    episode_q_totals,
+    episode_final_values,
+    episode_eval_results,
     get_episode_info_fields,
 )
+from trainer.eval_worker import AsyncEvaluator
+from trainer.checkpoint import (
+    get_rng_states,
+    set_rng_states,
+    get_start_state,
+    set_start_state,
+    checkpoint_buffers,
+    save_training_state,
+    load_training_state,
+)
 from plot.train_plots import plot_trajectory
 from collections import deque
+import numpy as np
 import torch
 import random
 import matplotlib.pyplot as plt
 
 
-def train_loop(config):
-
-    # Initialize game and player
-    game = Game(-1)
-
-    # Initialize level and player
-    if config["starting_height"] is None:
-        level = Level(None, random.choice(config["level_seeds"]))
-    else:
-        level = Level(
-            None,
-            random.choice(config["level_seeds"]),
-            config["starting_height"],
-        )
-    player = Rocket(level.get_rocket_start_loc())
+# Train on one phase config. If given, report(episodes, success_rate) is called
+# with each evaluation result and training stops when it returns False
+def train_loop(config, report=None):
 
-    # Set initial conditions of rocket if applicable
-    modify_starting_state(config, player, cfg.LEVEL_WIDTH)
+    # Set device to GPU if available
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
     # Simulation rate for training
     delta_time_seconds = 1 / cfg.MODEL_HZ
 
-    # Set device to GPU if available
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
-    # Initialize replay buffers, batch size and the percentage to take from them
-    main_buffer = ReplayBuffer(config["buffer_cap"])
-    success_buffer = ReplayBuffer(config["buffer_cap"])
+    # Initialize level cache and num_envs environments stepped together, each
+    # episode drawing its level and the rocket's initial conditions from the
+    # global random state, which also seeds any random levels. Full training
+    # checkpoints cover a single environment
+    num_envs = config.get("num_envs", 1)
+    checkpoint_interval = config.get("checkpoint_interval")
+    if num_envs > 1 and checkpoint_interval:
+        raise ValueError("checkpoint_interval needs num_envs of 1")
+    level_cache = LevelCache(seed=random.randrange(2**32))
+    env = BatchLanderEnv(
+        config, num_envs, level_cache=level_cache, device=device, rng=random
+    )
+    observations, _ = env.reset()
+
+    # Initialize replay buffers, batch size and the percentage to take from them.
+    # With prioritized replay a single buffer holds every transition and rare
+    # successes are replayed through their priorities instead
+    prioritized = config.get("prioritized_replay", False)
+    main_buffer, success_buffer = init_replay_buffers(config)
     batch_size = 64
 
     # Action dimension (possible actions allowed in this training phase)
     action_dim_choice = config["action_dim"]
 
     # Initialize and training models
-    model = LanderNet(
-        state_dim=len(get_state(game, player, level)), action_dim=action_dim_choice
-    ).to(device)
+    model = LanderNet(state_dim=STATE_SIZE, action_dim=action_dim_choice).to(device)
 
     # Load previous training if applicable
     if config["checkpoint_path"] is not None:
@@ -77,50 +89,65 @@ def train_loop(config):
         model.load_state_dict(state_dict, strict=False)
 
     # Initialize target model
-    target_model = LanderNet(
-        state_dim=len(get_state(game, player, level)), action_dim=action_dim_choice
-    ).to(device)
+    target_model = LanderNet(state_dim=STATE_SIZE, action_dim=action_dim_choice).to(
+        device
+    )
     target_model.load_state_dict(model.state_dict())
 
+    # Background policy evaluation process, unless disabled in the config
+    evaluator = None
+    if config.get("async_eval", True):
+        evaluator = AsyncEvaluator(config, STATE_SIZE, rate_threshold=0.25)
+
     # Training parameters (exploration rate epsilon and discount factor gamma)
     epsilon_start = config["epsilon_start"]
     epsilon_end = config["epsilon_end"]
     epsilon_decay = config["epsilon_decay"]
     gamma = config["gamma"]
 
+    # Learner owning both networks and a persistent optimizer, optionally taking
+    # several gradient steps per environment step. Target updates every
+    # update_interval steps are hard copies for a target_tau of 1, otherwise soft
+    learner = Learner(
+        model,
+        target_model,
+        device,
+        gamma,
+        grad_steps=config.get("grad_steps", 1),
+        tau=config.get("target_tau", 1.0),
+    )
+
     # Get phase as a variable
     phase = config["reward_phase"]
 
-    # Terminal reward amounts and save criteria
-    if phase in ("phase1", "phase2", "phase3"):
-        partial_reward = 0
-        landing_reward = 200
-        escape_reward = -600
-        flip_reward = -400
-        crash_reward = -175
-        pad_reward = 200
-    elif phase == "phase4":
-        partial_reward = 100
-        landing_reward = 600
-        escape_reward = -600
-        flip_reward = -500
-        crash_reward = -300
-        pad_reward = 0
-
-    # Initialize number of steps, number of episodes, and episode reward
-    steps = 0  # training frequency (every physics frame)
-    episodes = 0  # episode frequency (ending in collision, escape, or landing)
-    episode_reward = 0
+    # Shaping reward breakdown for the episode report unless "reward_diagnostics"
+    # is off, as the environment computes it
+    reward_diagnostics = config.get("reward_diagnostics", True)
 
-    # Initialize previous state (velocity x, velocity y, angle)
-    prev_state = [None, None, 0, 0, 90, 0]
+    # Initialize number of steps, number of episodes, and each episode's reward
+    steps = 0  # training frequency (every physics frame of every environment)
+    episodes = 0  # episode frequency (ending in collision, escape, or landing)
+    episode_rewards = [0] * num_envs
 
-    # Initialize dict to store episode information, and list containing all episodes
-    episode_info = init_episode_info()
+    # Initialize dicts to store episode information, and list containing all episodes
+    episode_infos = [init_episode_info() for _ in range(num_envs)]
     all_episodes = []
 
-    # Create list to store episode steps
-    episode_transitions = []
+    # Running [max, mean] q-value sums of each episode, kept on device
+    q_totals = torch.zeros(num_envs, 2, device=device)
+
+    # Exploration random number generator on the model's device
+    generator = torch.Generator(device=device)
+    generator.manual_seed(random.randrange(2**63))
+
+    # Create lists to store each episode's steps
+    episode_transitions = [[] for _ in range(num_envs)]
+
+    # The environments build one observation per physics step and one per episode
+    # start, each carried over as the state of the next step
+    observations_built = num_envs
+    physics_steps = 0
+    episode_starts = num_envs
 
     # Open log file and create deque of last 100 cases
     recent_episodes = deque(maxlen=100)
@@ -131,10 +158,40 @@ def train_loop(config):
     fig, ax = plt.subplots()
     plt.ion()  # interactive mode so the window stays open and updates
     plt.show()
-    xs = []
-    ys = []
-
-    while episodes < config["episode_cap"]:
+    xs = [[] for _ in range(num_envs)]
+    ys = [[] for _ in range(num_envs)]
+
+    # Full training state is checkpointed every checkpoint_interval episodes if
+    # set, and "resume_from" restarts from such a checkpoint. Evaluations still
+    # running in the background when a checkpoint is taken are not recorded
+    checkpoint_dir = config.get(
+        "training_checkpoint_path", config["csv_plot_path"] + "_training"
+    )
+    buffers = checkpoint_buffers(main_buffer, success_buffer)
+    if config.get("resume_from") is not None:
+        training_state = load_training_state(config["resume_from"], buffers, device)
+        learner.load_state_dict(training_state["learner"])
+        steps = training_state["steps"]
+        episodes = training_state["episodes"]
+        all_episodes = training_state["all_episodes"]
+        recent_episodes.extend(training_state["recent_episodes"])
+        rolling_pad = training_state["rolling_pad"]
+        rolling_land = training_state["rolling_land"]
+
+        # Episode start drawn before the checkpoint was taken, and the random
+        # levels still to come
+        level_cache.set_state(training_state["level_cache"])
+        level_seed = training_state["level_seed"]
+        level = level_cache.get(level_seed, config["starting_height"])
+        player = Rocket(level.get_rocket_start_loc())
+        set_start_state(player, training_state["start_state"])
+        env.load(0, level, player)
+        observations = env.get_observations()
+        set_rng_states(training_state["rng_states"], generator)
+        print(f"Resumed from {config['resume_from']} at episode {episodes}")
+
+    stop = False
+    while not stop and episodes < config["episode_cap"]:
 
         epsilon = get_epsilon(
             epsilon_start,
@@ -144,240 +201,238 @@ def train_loop(config):
         )
 
         # Refine rate of success buffer usage
-        if phase in ("phase1", "phase2", "phase3"):
+        if prioritized:
+            buffer_pct = 0
+        elif phase in ("phase1", "phase2", "phase3"):
             buffer_pct = get_success_buffer_rate(rolling_pad)
         elif phase == "phase4":
             buffer_pct = get_success_buffer_rate(rolling_land)
 
-        # Get current state
-        state_vector = get_state(game, player, level)
-        state = torch.tensor(state_vector, dtype=torch.float32, device=device)
-        curr_x = state_vector[0]
-        curr_y = state_vector[1]
-        curr_dx = state_vector[8]
-        curr_dy = state_vector[9]
-        terrain_from_bottom = state_vector[10:]
-        vel_x, vel_y = player.get_velocity()
-        angle = player.get_angle()
-        xs.append(curr_x)
-        ys.append(curr_y)
-
-        # If first step, need to assign previous delta positions values
-        if prev_state[0] == None and prev_state[1] == None:
-            prev_state[0] = curr_dx
-            prev_state[1] = curr_dy
-
-        # Select and apply action
-        action, is_random, max_q, mean_q = select_action(
-            model, state, action_dim_choice, epsilon
-        )
-        player.apply_ai_action(action)
-        player.update_state(delta_time_seconds)
-        episode_action_count(episode_info, action, is_random)
-
-        # Use current state values to update episode info min, max, avg
-        episode_min_max_avg(
-            episode_info, vel_x, vel_y, angle, curr_dx, curr_dy, max_q, mean_q
-        )
-
-        # Calculate minor shaping rewards
-        shaping_rewards = calc_shaping_rewards(
-            phase,
-            player,
-            curr_y,
-            curr_dx,
-            curr_dy,
-            prev_state,
-            terrain_from_bottom,
-        )
-        step_reward = shaping_rewards["r_total"]
-        episode_reward += step_reward
-        episode_cumulative_shaping(episode_info, shaping_rewards)
-
-        # Update previous state and set flag
-        prev_state = [curr_dx, curr_dy, vel_x, vel_y, angle, action]
-        done = False
-
-        # Check terminal events
-        if game.calc_landing(level, player):
-            terminal_award = landing_reward
-            done = True
-            event_description = "landing"
-        elif game.escaped_boundary(level, player):
-            terminal_award = escape_reward
-            done = True
-            event_description = "escaped"
-        elif game.calc_collision(level, player):
-            if game.calc_horizontal_with_pad(level, player):
-                terminal_award = pad_reward
-                event_description = "pad contact"
-                # Partial awards for being closer to successful landing
-                vx_score = smooth_terminal_reward(vel_x, cfg.LANDING_VELOCITY)
-                vy_score = smooth_terminal_reward(vel_y, cfg.LANDING_VELOCITY)
-                ang_score = smooth_terminal_reward(
-                    player.angle_deviation_from_upright(), cfg.LANDING_MAX_ANGLE - 90
-                )
-                terminal_award += partial_reward * (vx_score + vy_score + ang_score)
-
-            else:
-                terminal_award = crash_reward
-                event_description = "collision"
-            done = True
-        elif player.angle_deviation_from_upright() > 90:
-            terminal_award = flip_reward
-            done = True
-            event_description = "flipped"
-        else:
-            terminal_award = 0
-
-        # Increment by terminal award
-        episode_reward += terminal_award
-        step_reward += terminal_award
-
-        # Get next state
-        next_state_vector = get_state(game, player, level)
-
-        # Store transition into temporary list
-        episode_transitions.append(
-            (state_vector, action, step_reward, next_state_vector, done)
+        # Current states as stored, and their positions and kinematics at full
+        # precision for the episode report
+        states = observations.cpu().numpy()
+        positions = env.state[:, [0, 1, 8, 9]].tolist()
+        kinematics = np.column_stack((env.rockets.velocity, env.rockets.angle))
+        kinematics = kinematics.tolist()
+
+        # Select and apply actions, reading back only the actions and whether they
+        # were random. Q-value statistics stay on device until an episode ends
+        actions, is_random, q_stats = select_actions(
+            model, observations, action_dim_choice, epsilon, generator
         )
-
-        # Train model either using success buffer or main buffer
-        if random.random() < buffer_pct and len(success_buffer) > batch_size:
-            train_step(model, target_model, success_buffer, device, gamma, batch_size)
-        else:
-            train_step(model, target_model, main_buffer, device, gamma, batch_size)
-
-        # Reset if episode ended
-        if done:
-            # Default values
-            traj_color = "red"
-            target_buffer = main_buffer
-
-            if phase in ("phase1", "phase2", "phase3"):
-                if event_description == "pad contact":
-                    traj_color = "lightgreen"
-                    target_buffer = success_buffer
-
-            elif phase == "phase4":
-                if event_description == "landing":
-                    traj_color = "green"
-                    target_buffer = success_buffer
-                elif event_description == "pad contact":
-                    traj_color = "lightgreen"
-
-            # Add transitions to appropriate buffer
-            for t in episode_transitions:
-                target_buffer.add(*t)
-
-            # Reset transitions for next episode
-            episode_transitions = []
-
-            # Plot trajectory and clear vars
-            plot_trajectory(xs, ys, ax, fig, traj_color, level.get_seed())
-            xs = []
-            ys = []
-
-            episode_info["r_terminal"] = terminal_award
-            episode_info["r_total"] = episode_reward
-
-            # Assign episode info
-            episode_info["episode_number"] = episodes
-            episode_info["episode_outcome"] = event_description
-            episode_info["epsilon"] = epsilon
-            episode_info["gamma"] = gamma
-            episode_info["level_seed"] = level.get_seed()
-
-            # Get number of episode steps
-            episode_info["num_steps"] = (
-                episode_info["action_count_exploration"]
-                + episode_info["action_count_exploitation"]
+        q_totals += q_stats
+        action_list, random_list = torch.stack((actions, is_random.long())).tolist()
+        observations, rewards, terminated, _, infos = env.step(actions)
+        next_states = observations.cpu().numpy()
+        physics_steps += num_envs
+        observations_built += num_envs
+
+        # Record, learn from and finish the step of each environment in turn
+        for i, (step_reward, done) in enumerate(
+            zip(rewards.tolist(), terminated.tolist())
+        ):
+            if episodes >= config["episode_cap"]:
+                break
+            curr_x, curr_y, curr_dx, curr_dy = positions[i]
+            vel_x, vel_y, angle = kinematics[i]
+            action = action_list[i]
+            episode_info = episode_infos[i]
+            info = infos[i].get("final_info", infos[i])
+            xs[i].append(curr_x)
+            ys[i].append(curr_y)
+            episode_action_count(episode_info, action, random_list[i])
+
+            # Use current state values to update episode info min, max, avg
+            episode_min_max_avg(episode_info, vel_x, vel_y, angle, curr_dx, curr_dy)
+
+            # Shaping and terminal rewards of the step
+            if reward_diagnostics:
+                episode_cumulative_shaping(episode_info, info["shaping_rewards"])
+            episode_rewards[i] += step_reward
+            event_description = info["event_description"]
+
+            # Store transition into temporary list, ending on the terminal
+            # observation of a finished episode
+            next_state = infos[i]["final_observation"] if done else next_states[i]
+            episode_transitions[i].append(
+                (states[i], action, step_reward, next_state, done, info["terrain_ref"])
             )
 
-            # Calculate averages for episode info
-            try:
-                episode_info["vy_avg"] /= episode_info["num_steps"]
-                episode_info["vx_avg"] /= episode_info["num_steps"]
-                episode_info["angle_avg"] /= episode_info["num_steps"]
-                episode_info["q_max_avg"] /= episode_info["num_steps"]
-                episode_info["q_mean_avg"] /= episode_info["num_steps"]
-            except:
-                raise ZeroDivisionError("Error: number of steps is zero for episode.")
-
-            # Get final values for episode info
-            episode_info["vy_final"] = vel_y
-            episode_info["vx_final"] = vel_x
-            episode_info["dy_pad_final"] = curr_dy
-            episode_info["dx_pad_final"] = curr_dx
-            episode_info["dx_pad_final_abs"] = abs(curr_dx)
-            episode_info["angle_final"] = angle
-
-            # Append episode to deque
-            recent_episodes.append(episode_info.copy())
-
-            # Populate multiple fields in episode info
-            episode_info = get_episode_info_fields(episode_info, recent_episodes)
-
-            # Print episode to terminal
-            print_episode(episode_info, episodes, event_description, episode_reward)
-
-            # Save episode to list and determine rolling rate of success
-            all_episodes.append(episode_info.copy())
-            rolling_pad = all_episodes[-1]["rolling_avg_pad_contact_rate"]
-            rolling_land = all_episodes[-1]["rolling_avg_landing_rate"]
-
-            # Reset and increment
-            episode_reward = 0
-            player = Rocket(level.get_rocket_start_loc())
-            episodes += 1
-            episode_info = init_episode_info()
-
-            # Set initial conditions of rocket if applicable
-            modify_starting_state(config, player, cfg.LEVEL_WIDTH)
-
-            # Get another random level
-            if config["starting_height"] is None:
-                level = Level(None, random.choice(config["level_seeds"]))
+            # Train model either using success buffer or main buffer
+            if random.random() < buffer_pct and len(success_buffer) > batch_size:
+                learner.step(success_buffer, batch_size)
             else:
-                level = Level(
-                    None,
-                    random.choice(config["level_seeds"]),
-                    config["starting_height"],
+                learner.step(main_buffer, batch_size)
+
+            # Report the episode if it ended. The environment has already started
+            # the next one on a new rocket and level
+            if done:
+                level = info["terrain_ref"][0]
+
+                # Default values
+                traj_color = "red"
+                target_buffer = main_buffer
+
+                if phase in ("phase1", "phase2", "phase3"):
+                    if event_description == "pad contact":
+                        traj_color = "lightgreen"
+                        target_buffer = success_buffer
+
+                elif phase == "phase4":
+                    if event_description == "landing":
+                        traj_color = "green"
+                        target_buffer = success_buffer
+                    elif event_description == "pad contact":
+                        traj_color = "lightgreen"
+
+                # Add transitions to appropriate buffer
+                for *t, terrain_ref in episode_transitions[i]:
+                    target_buffer.add(*t, terrain_ref=terrain_ref)
+
+                # Reset transitions for next episode
+                episode_transitions[i] = []
+                observations_built += 1
+                episode_starts += 1
+
+                # Plot trajectory and clear vars
+                plot_trajectory(xs[i], ys[i], ax, fig, traj_color, level.get_seed())
+                xs[i] = []
+                ys[i] = []
+
+                episode_q_totals(episode_info, q_totals[i])
+                episode_info["r_terminal"] = info["terminal_award"]
+                episode_info["r_total"] = episode_rewards[i]
+
+                # Assign episode info
+                episode_info["episode_number"] = episodes
+                episode_info["episode_outcome"] = event_description
+                episode_info["epsilon"] = epsilon
+                episode_info["gamma"] = gamma
+                episode_info["level_seed"] = level.get_seed()
+
+                # Get number of steps, averages and final values for episode info
+                episode_final_values(
+                    episode_info, vel_x, vel_y, angle, curr_dx, curr_dy
                 )
 
-            # Evaulate policy with zero epsilon if episode number is at interval
-            if episodes % config["eval_interval"] == 0 and episodes > 0:
-                [passed_test, success_rate] = evaluate_policy(
-                    config,
-                    model,
-                    action_dim_choice,
-                    device,
-                    delta_time_seconds,
-                    eval_episodes=50,
-                    rate_threshold=0.25,
-                    level_width=cfg.LEVEL_WIDTH,
-                )
-                if passed_test:
-                    # Export model and image
-                    export_checkpoint(model, config, plt, episodes, success_rate)
+                # Append episode to deque
+                recent_episodes.append(episode_info.copy())
+
+                # Populate multiple fields in episode info
+                episode_info = get_episode_info_fields(episode_info, recent_episodes)
 
-        # Update target network frequently enough to track online network,
-        # but not too frequent to destabilize Q-learning. Only do so after
-        # a certain number of warmup steps have occured
-        if steps > config["warmup_steps"] and steps % config["update_interval"] == 0:
-            target_model.load_state_dict(model.state_dict())
+                # Print episode to terminal
+                print_episode(
+                    episode_info, episodes, event_description, episode_rewards[i]
+                )
 
-        # update steps
-        steps += 1
+                # Save episode to list and determine rolling rate of success
+                all_episodes.append(episode_info.copy())
+                rolling_pad = all_episodes[-1]["rolling_avg_pad_contact_rate"]
+                rolling_land = all_episodes[-1]["rolling_avg_landing_rate"]
+
+                # Reset and increment
+                episode_rewards[i] = 0
+                episodes += 1
+                episode_infos[i] = init_episode_info()
+                q_totals[i].zero_()
+
+                # Results of background evaluations that have finished
+                eval_results = []
+                if evaluator is not None:
+                    eval_results = evaluator.poll()
+
+                # Evaulate policy with zero epsilon if episode number is at
+                # interval, in the background unless async evaluation is disabled
+                if episodes % config["eval_interval"] == 0 and episodes > 0:
+                    if evaluator is not None:
+                        evaluator.submit(model, episodes)
+                    else:
+                        [passed_test, success_rate, episodes_used] = evaluate_policy(
+                            config,
+                            model,
+                            action_dim_choice,
+                            device,
+                            delta_time_seconds,
+                            eval_episodes=50,
+                            rate_threshold=0.25,
+                            level_cache=level_cache,
+                            confidence=config.get("eval_confidence"),
+                        )
+                        eval_results = [(episodes, success_rate, episodes_used)]
+                        if passed_test:
+                            # Export model and image
+                            export_checkpoint(
+                                model, config, plt, episodes, success_rate
+                            )
+                episode_eval_results(all_episodes, eval_results)
+
+                # Stop training early if the report callback rejects an evaluation
+                if report is not None and not all(
+                    report(eval_episode, rate) for eval_episode, rate, _ in eval_results
+                ):
+                    stop = True
+                    break
+
+            # Update target network frequently enough to track online network,
+            # but not too frequent to destabilize Q-learning. Only do so after
+            # a certain number of warmup steps have occured
+            if (
+                steps > config["warmup_steps"]
+                and steps % config["update_interval"] == 0
+            ):
+                learner.update_target()
+
+            # update steps
+            steps += 1
+
+            # Checkpoint the full training state between episodes
+            if done and checkpoint_interval and episodes % checkpoint_interval == 0:
+                training_state = {
+                    "learner": learner.state_dict(),
+                    "steps": steps,
+                    "episodes": episodes,
+                    "all_episodes": all_episodes,
+                    "recent_episodes": list(recent_episodes),
+                    "rolling_pad": rolling_pad,
+                    "rolling_land": rolling_land,
+                    "level_seed": env.levels[0].get_seed(),
+                    "start_state": get_start_state(env.players[0]),
+                    "level_cache": level_cache.get_state(),
+                    "rng_states": get_rng_states(generator),
+                }
+                save_training_state(checkpoint_dir, training_state, buffers)
+
+    # Stop any background level generation and write buffers to disk if applicable
+    env.close()
+    level_cache.close()
+    main_buffer.close()
+    success_buffer.close()
+
+    # Report replay sampling throughput, including any terrain decompression
+    sample_rate = main_buffer.get_sample_rate()
+    print(f"Replay sampling: {sample_rate:.0f} transitions/s")
+
+    # One observation per physics step plus one per episode start
+    print(
+        f"Observations built: {observations_built} for {physics_steps} physics "
+        f"steps and {episode_starts} episode starts"
+    )
 
     # Save model after training
     torch.save(model.state_dict(), config["save_path"])
     print("Model saved to " + config["save_path"])
 
-    # Create csv file output
+    # Create csv file output once outstanding evaluations have been recorded
+    if evaluator is not None:
+        episode_eval_results(all_episodes, evaluator.close())
     print_csv_summary(all_episodes, config)
 
     # Save trajectory plot after training
     plt.ioff()  # turn off interactive mode
-    plt.savefig("training_trajectories.png", dpi=300, bbox_inches="tight")
+    plt.savefig(
+        get_plot_path(config, "training_trajectories") + ".png",
+        dpi=300,
+        bbox_inches="tight",
+    )
     plt.close()  # close the figure window
@@ -0,0 +1,188 @@
+from trainer.train_loop import train_loop
+from trainer.pipeline import redirect_output, set_seed
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import csv
+import multiprocessing as mp
+import os
+import random
+import torch
+import matplotlib.pyplot as plt
+
+
+# Config with each search space key set to a random choice from a list, or a
+# uniform draw from a (low, high) range, integer if both bounds are. Dotted keys
+# such as "terminal_rewards.landing" set an entry of a dict valued key
+def sample_config(base_config, search_space, rng):
+    config = dict(base_config)
+    params = {}
+    for key, space in search_space.items():
+        if isinstance(space, tuple):
+            low, high = space
+            if isinstance(low, int) and isinstance(high, int):
+                value = rng.randint(low, high)
+            else:
+                value = rng.uniform(low, high)
+        else:
+            value = rng.choice(space)
+        params[key] = value
+
+        if "." in key:
+            outer, inner = key.split(".", 1)
+            config[outer] = {**(config.get(outer) or {}), inner: value}
+        else:
+            config[key] = value
+    return config, params
+
+
+# Report callback implementing asynchronous successive halving. When a trial's
+# evaluation reaches the next rung it is recorded with the scores of the other
+# trials at that rung, and the trial only continues if it is in the top
+# 1 / reduction_factor of them. Rung scores are shared between trial processes
+class RungReporter:
+    def __init__(self, milestones, reduction_factor, rung_scores, lock):
+        self.milestones = list(milestones)
+        self.reduction_factor = reduction_factor
+        self.rung_scores = rung_scores
+        self.lock = lock
+        self.episodes = 0
+        self.success_rate = 0
+        self.stopped = False
+
+    def __call__(self, episodes, success_rate):
+        self.episodes = episodes
+        self.success_rate = success_rate
+        if not self.milestones or episodes < self.milestones[0]:
+            return True
+        milestone = self.milestones.pop(0)
+
+        with self.lock:
+            scores = self.rung_scores.get(milestone, []) + [success_rate]
+            self.rung_scores[milestone] = scores
+
+        keep = max(1, len(scores) // self.reduction_factor)
+        cutoff = sorted(scores, reverse=True)[keep - 1]
+        self.stopped = success_rate < cutoff
+        return not self.stopped
+
+
+# Trains one sampled config in a pool worker until it finishes or is stopped at
+# a rung, returning the episodes reached and the last evaluated success rate
+def run_trial(config, milestones, reduction_factor, rung_scores, lock, log_path):
+    redirect_output(log_path)
+    plt.switch_backend("Agg")
+    torch.set_num_threads(1)
+    set_seed(config["seed"])
+
+    reporter = RungReporter(milestones, reduction_factor, rung_scores, lock)
+    train_loop(config, report=reporter)
+    return reporter.episodes, reporter.success_rate, reporter.stopped
+
+
+# Tunes base_config over the search space by training num_trials sampled configs
+# in parallel worker processes. Trials are evaluated every min_episodes and
+# stopped at rungs of min_episodes * reduction_factor^k episodes by successive
+# halving, so only the best trials train for the full max_episodes. Writes a
+# leaderboard CSV ranked by episodes reached then success rate, and returns it
+def tune(
+    base_config,
+    search_space,
+    num_trials=16,
+    min_episodes=200,
+    max_episodes=None,
+    reduction_factor=3,
+    max_workers=None,
+    seed=0,
+    name="tune",
+    log_dir="logs",
+):
+    if max_episodes is None:
+        max_episodes = base_config["episode_cap"]
+    milestones = []
+    milestone = min_episodes
+    while milestone < max_episodes:
+        milestones.append(milestone)
+        milestone *= reduction_factor
+    os.makedirs(log_dir, exist_ok=True)
+
+    # Trials evaluate in process at every rung and keep their outputs separate,
+    # with plots prefixed by the trial name
+    rng = random.Random(seed)
+    trials = []
+    for i in range(num_trials):
+        config, params = sample_config(base_config, search_space, rng)
+        trial_name = f"{name}_trial_{i:03d}"
+        config.update(
+            seed=seed + i,
+            episode_cap=max_episodes,
+            eval_interval=min_episodes,
+            async_eval=False,
+            save_path=trial_name + ".pth",
+            csv_plot_path=trial_name,
+            plot_prefix=trial_name,
+            buffer_path=None,
+            warm_start_buffer_path=None,
+        )
+        trials.append((trial_name, config, params))
+
+    ctx = mp.get_context("spawn")
+    with ctx.Manager() as manager:
+        rung_scores = manager.dict()
+        lock = manager.Lock()
+        with ProcessPoolExecutor(
+            max_workers, mp_context=ctx, max_tasks_per_child=1
+        ) as pool:
+            futures = {}
+            for trial_name, config, params in trials:
+                log_path = os.path.join(log_dir, trial_name + ".log")
+                future = pool.submit(
+                    run_trial,
+                    config,
+                    milestones,
+                    reduction_factor,
+                    rung_scores,
+                    lock,
+                    log_path,
+                )
+                futures[future] = (trial_name, params)
+
+            leaderboard = []
+            for future in as_completed(futures):
+                trial_name, params = futures[future]
+                episodes, success_rate, stopped = future.result()
+                status = "stopped" if stopped else "completed"
+                print(f"{trial_name} {status} at episode {episodes}: {success_rate}")
+                leaderboard.append(
+                    {
+                        "trial": trial_name,
+                        "episodes": episodes,
+                        "success_rate": success_rate,
+                        "stopped_early": stopped,
+                        **params,
+                    }
+                )
+
+    leaderboard.sort(
+        key=lambda row: (row["episodes"], row["success_rate"]), reverse=True
+    )
+    with open(name + "_leaderboard.csv", "w", newline="") as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=list(leaderboard[0].keys()))
+        writer.writeheader()
+        writer.writerows(leaderboard)
+    return leaderboard
+
+
+# Example search over the first training phase
+if __name__ == "__main__":
+    from pytorch_trainer import configs
+
+    tune(
+        configs[0],
+        {
+            "epsilon_decay": (1500, 6000),
+            "gamma": [0.97, 0.98, 0.99, 0.995],
+            "update_interval": [1, 2, 4, 8],
+            "terminal_rewards.collision": (-400, -100),
+            "terminal_rewards.pad contact": (100, 400),
+        },
+        name="tune_phase_01",
+    )
@@ -1,12 +1,20 @@
 import csv
+import os
+from math import sqrt
+from statistics import NormalDist
+import numpy as np
 import torch
 import random
-from trainer.state import get_state
-from trainer.action import select_action
-from game.rocket import Rocket
-from game.level import Level
-from game.game import Game
-from game import constants as cfg
+from trainer.action import select_actions
+from trainer.buffer import (
+    ReplayBuffer,
+    PrioritizedReplayBuffer,
+    MemmapReplayBuffer,
+    CompactReplayBuffer,
+)
+from game.level_cache import LevelCache
+from game.termination import Outcome
+from trainer.reward import ShapingReward, get_terminal_rewards, relabel_rewards
 
 
 def get_epsilon(
@@ -57,7 +65,16 @@ def print_csv_summary(all_episodes, config):
         writer.writerows(all_episodes)
 
 
-def export_checkpoint(model, config, plt, episodes, success_rate):
+# Path of a plot of a training run, prefixed with its "plot_prefix" if set and
+# otherwise named after its csv_plot_path, so runs sharing a working directory
+# keep their plots apart
+def get_plot_path(config, plot_name):
+    return f"{config.get('plot_prefix', config['csv_plot_path'])}_{plot_name}"
+
+
+def export_checkpoint(
+    model, config, plt, episodes, success_rate, plot_name="training_trajectories"
+):
     print(
         f"High pad contact rate of {success_rate*100}% during test, exporting at episode: {episodes}"
     )
@@ -71,7 +88,8 @@ def export_checkpoint(model, config, plt, episodes, success_rate):
     # Save trajectory plot
     plt.ioff()
     plt.savefig(
-        f"training_trajectories_episode_{int(episodes)}_rate_{int(success_rate*100)}.png",
+        f"{get_plot_path(config, plot_name)}_episode_{int(episodes)}"
+        f"_rate_{int(success_rate*100)}.png",
         dpi=300,
         bbox_inches="tight",
     )
@@ -91,6 +109,13 @@ def get_success_buffer_rate(rolling_pad):
     return buffer_pct
 
 
+# Evaluate the greedy policy, returning whether its success rate beats
+# rate_threshold, the success rate and the number of episodes played. With a
+# confidence set, episodes run in chunks and evaluation stops early once the
+# Wilson score interval for the success rate lies entirely on one side of the
+# threshold. The interval is checked after every chunk, so the allowed error
+# rate 1 - confidence is split evenly across those looks (Bonferroni) to hold
+# it over the whole sequential test
 def evaluate_policy(
     config,
     model,
@@ -99,68 +124,228 @@ def evaluate_policy(
     delta_time_seconds,
     eval_episodes=50,
     rate_threshold=0.2,
-    level_width=cfg.LEVEL_WIDTH,
+    level_cache=None,
+    trajectories=None,
+    confidence=None,
+    chunk_size=10,
 ):
-    eval_game = Game(-1)
-    success_cases = 0
-    for i in range(eval_episodes):
-        if config["starting_height"] is None:
-            eval_level = Level(None, random.choice(config["level_seeds"]))
-        else:
-            eval_level = Level(
-                None,
-                random.choice(config["level_seeds"]),
-                config["starting_height"],
-            )
+    owns_cache = level_cache is None
+    if owns_cache:
+        level_cache = LevelCache()
+
+    if confidence is not None:
+        looks = -(-eval_episodes // chunk_size)
+        look_confidence = 1 - (1 - confidence) / looks
 
-        eval_player = Rocket(eval_level.get_rocket_start_loc())
-
-        # Set initial conditions of rocket if applicable
-        modify_starting_state(config, eval_player, level_width)
-
-        done = False
-        while not done:
-            state_vector = get_state(eval_game, eval_player, eval_level)
-            state = torch.tensor(state_vector, dtype=torch.float32, device=device)
-            action, _, _, _ = select_action(model, state, action_dim_choice, 0.0)
-            eval_player.apply_ai_action(action)
-            eval_player.update_state(delta_time_seconds)
-            if eval_game.calc_landing(eval_level, eval_player):
-                success_cases += 1
-                done = True
-            elif eval_game.calc_collision(eval_level, eval_player):
-                if eval_game.calc_horizontal_with_pad(
-                    eval_level, eval_player
-                ) and config["reward_phase"] in ("phase1", "phase2", "phase3"):
-                    success_cases += 1
-                done = True
-            elif (
-                eval_game.escaped_boundary(eval_level, eval_player)
-                or eval_player.angle_deviation_from_upright() > 90
-            ):
-                done = True
-
-    success_rate = success_cases / eval_episodes
-    print(f"Epsilon zero test success rate: {100*success_rate}%")
+    results = []
+    while len(results) < eval_episodes:
+        count = eval_episodes - len(results)
+        if confidence is not None:
+            count = min(count, chunk_size)
+        results += play_eval_episodes(
+            config,
+            model,
+            action_dim_choice,
+            device,
+            delta_time_seconds,
+            count,
+            level_cache,
+        )
+
+        # Stop once the pass/fail decision is settled
+        if confidence is not None:
+            successes = sum(success for _, _, _, success in results)
+            lower, upper = wilson_interval(successes, len(results), look_confidence)
+            if lower > rate_threshold or upper <= rate_threshold:
+                break
+
+    # Hand back normalized trajectories, level seeds and successes if requested
+    if trajectories is not None:
+        trajectories += results
+
+    if owns_cache:
+        level_cache.close()
+
+    episodes_used = len(results)
+    success_rate = sum(success for _, _, _, success in results) / episodes_used
+    print(
+        f"Epsilon zero test success rate: {100*success_rate}% "
+        f"over {episodes_used} episodes"
+    )
 
     if success_rate > rate_threshold:
-        return [True, success_rate]
-    return [False, success_rate]
+        return [True, success_rate, episodes_used]
+    return [False, success_rate, episodes_used]
+
+
+# Play evaluation episodes with epsilon zero, stepping them in lockstep with one
+# batched forward pass per step over the episodes that have not finished yet.
+# Returns (xs, ys, level seed, success) for each episode
+def play_eval_episodes(
+    config,
+    model,
+    action_dim_choice,
+    device,
+    delta_time_seconds,
+    count,
+    level_cache,
+):
+    # Imported here as trainer.batch_env itself builds on this module
+    from trainer.batch_env import BatchLanderEnv
+
+    # Start every evaluation episode on one batched environment, drawing levels
+    # and initial conditions from the global random state, and step them together
+    env = BatchLanderEnv(
+        config, count, level_cache=level_cache, device=device, rng=random
+    )
+    env.reset()
+
+    alive = np.ones(count, dtype=bool)
+    eval_xs = [[] for i in range(count)]
+    eval_ys = [[] for i in range(count)]
+    eval_success = np.zeros(count, dtype=bool)
+    success_outcomes = [Outcome.LANDING]
+    if config["reward_phase"] in ("phase1", "phase2", "phase3"):
+        success_outcomes.append(Outcome.PAD_CONTACT)
+
+    # Finished rockets keep being stepped with no action, but are ignored
+    actions = torch.zeros(count, dtype=torch.int64, device=device)
+    while alive.any():
+        rows = np.flatnonzero(alive)
+        for i, (x, y) in zip(rows.tolist(), env.state[rows, :2].tolist()):
+            eval_xs[i].append(x)
+            eval_ys[i].append(y)
+        rows = torch.from_numpy(rows).to(device)
+        states = env.get_observations()[rows]
+        selected, _, _ = select_actions(model, states, action_dim_choice, 0.0)
+        actions.zero_()
+        actions[rows] = selected
+
+        outcomes = env.advance(actions, delta_time_seconds).cpu().numpy()
+        eval_success |= alive & np.isin(outcomes, success_outcomes)
+        alive &= outcomes == Outcome.NONE
+
+    return [
+        (eval_xs[i], eval_ys[i], env.levels[i].get_seed(), bool(eval_success[i]))
+        for i in range(count)
+    ]
+
+
+# Two-sided Wilson score interval for a success rate at the given confidence
+def wilson_interval(successes, trials, confidence):
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    rate = successes / trials
+    denominator = 1 + z**2 / trials
+    center = (rate + z**2 / (2 * trials)) / denominator
+    margin = z * sqrt(rate * (1 - rate) / trials + z**2 / (4 * trials**2))
+    return center - margin / denominator, center + margin / denominator
+
+
+# Get a level for the next episode, chosen from the configured seeds
+def get_level(config, level_cache, rng=random):
+    return level_cache.get(rng.choice(config["level_seeds"]), config["starting_height"])
+
+
+# Create the main and success replay buffers for a training phase. A config may
+# set "prioritized_replay" to share one prioritized buffer, "compact_replay" to
+# store terrain slices by reference, "buffer_path" to keep the buffers on disk,
+# and "warm_start_buffer_path" to seed empty buffers from those a previous phase
+# left on disk
+def init_replay_buffers(config):
+    capacity = config["buffer_cap"]
+    phase = config["reward_phase"]
+    if config.get("prioritized_replay", False):
+        main_buffer = PrioritizedReplayBuffer(capacity)
+        success_buffer = main_buffer
+    elif config.get("compact_replay", False):
+        if config.get("warm_start_buffer_path") is not None:
+            raise ValueError("compact_replay cannot warm-start from a full buffer")
+        main_buffer = CompactReplayBuffer(capacity)
+        success_buffer = CompactReplayBuffer(capacity)
+    elif config.get("buffer_path") is not None:
+        main_buffer = MemmapReplayBuffer(
+            config["buffer_path"] + "_main", capacity, reward_phase=phase
+        )
+        success_buffer = MemmapReplayBuffer(
+            config["buffer_path"] + "_success", capacity, reward_phase=phase
+        )
+    else:
+        main_buffer = ReplayBuffer(capacity)
+        success_buffer = ReplayBuffer(capacity)
+
+    # Buffers reopened after a crash already hold this phase's experience
+    warm_start_path = config.get("warm_start_buffer_path")
+    if warm_start_path is not None and len(main_buffer) == 0:
+        warm_start_buffers(config, warm_start_path, main_buffer, success_buffer)
+
+    return main_buffer, success_buffer
+
+
+# Outcome that counts as a success, and sends an episode to the success buffer
+def get_success_event(reward_phase):
+    if reward_phase == "phase4":
+        return "landing"
+    return "pad contact"
+
+
+# Copy the transitions a previous phase left on disk, with rewards relabelled
+# for this phase. Outcomes are not stored, so terminal transitions are dropped
+# from the main buffer. Every episode in the success buffer ended in the success
+# event of its phase, so it is only copied if this phase defines success the same
+def warm_start_buffers(config, path, main_buffer, success_buffer):
+    phase = config["reward_phase"]
+    shaping = ShapingReward(phase)
+    terminal_rewards = get_terminal_rewards(phase, config.get("terminal_rewards"))
+
+    def relabel(outcome):
+        def relabel_chunk(states, actions, rewards, next_states, dones):
+            if outcome is None:
+                keep = dones == 0
+                states, actions = states[keep], actions[keep]
+                next_states, dones = next_states[keep], dones[keep]
+            rewards = relabel_rewards(
+                shaping, terminal_rewards, states, actions, next_states, dones, outcome
+            )
+            return states, actions, rewards, next_states, dones
+
+        return relabel_chunk
+
+    if os.path.isdir(path + "_main"):
+        previous = MemmapReplayBuffer(path + "_main", read_only=True)
+        copied = main_buffer.copy_from(previous, relabel(None))
+        print(f"Warm-started {copied} of {len(previous)} transitions from {path}_main")
+
+    if os.path.isdir(path + "_success"):
+        previous = MemmapReplayBuffer(path + "_success", read_only=True)
+        if previous.reward_phase is None:
+            print(f"Not warm-starting from {path}_success without a reward phase")
+        elif get_success_event(previous.reward_phase) != get_success_event(phase):
+            print(
+                f"Not warm-starting from {path}_success, as {previous.reward_phase} "
+                f"and {phase} define success differently"
+            )
+        else:
+            copied = success_buffer.copy_from(
+                previous, relabel(get_success_event(phase))
+            )
+            print(f"Warm-started {copied} transitions from {path}_success")
 
 
-def modify_starting_state(config, player, level_width):
+# Randomize the rocket's initial conditions within any ranges the config sets,
+# drawing from rng (the random module unless an environment passes its own)
+def modify_starting_state(config, player, level_width, rng=random):
     if "starting_horz" in config.keys():
         [x_min, x_max] = config["starting_horz"]
-        start_x = random.uniform(x_min * level_width, x_max * level_width)
+        start_x = rng.uniform(x_min * level_width, x_max * level_width)
         player.set_x_pos(start_x)
 
     if "starting_angle_omega_alpha" in config.keys():
         [[angle_min, angle_max], [omega_min, omega_max], [alpha_min, alpha_max]] = (
             config["starting_angle_omega_alpha"]
         )
-        start_angle = random.uniform(angle_min, angle_max)
-        start_omega = random.uniform(omega_min, omega_max)
-        start_alpha = random.uniform(alpha_min, alpha_max)
+        start_angle = rng.uniform(angle_min, angle_max)
+        start_omega = rng.uniform(omega_min, omega_max)
+        start_alpha = rng.uniform(alpha_min, alpha_max)
         player.set_angle(start_angle)
         player.set_omega(start_omega)
         player.set_alpha(start_alpha)
@@ -169,14 +354,14 @@ def modify_starting_state(config, player, level_width):
         [[vel_x_min, vel_x_max], [vel_y_min, vel_y_max]] = config[
             "starting_velocity_x_y"
         ]
-        start_vel_x = random.uniform(vel_x_min, vel_x_max)
-        start_vel_y = random.uniform(vel_y_min, vel_y_max)
+        start_vel_x = rng.uniform(vel_x_min, vel_x_max)
+        start_vel_y = rng.uniform(vel_y_min, vel_y_max)
         player.set_velocity(start_vel_x, start_vel_y)
 
     if "starting_accel_x_y" in config.keys():
         [[accel_x_min, accel_x_max], [accel_y_min, accel_y_max]] = config[
             "starting_accel_x_y"
         ]
-        start_accel_x = random.uniform(accel_x_min, accel_x_max)
-        start_accel_y = random.uniform(accel_y_min, accel_y_max)
+        start_accel_x = rng.uniform(accel_x_min, accel_x_max)
+        start_accel_y = rng.uniform(accel_y_min, accel_y_max)
         player.set_accel(start_accel_x, start_accel_y)